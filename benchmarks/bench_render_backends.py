@@ -0,0 +1,83 @@
+"""
+Compares the frame throughput of the thread and process render backends.
+
+Run from the repository root:
+
+    python benchmarks/bench_render_backends.py --width 6000 --height 4000 --frames 20 --streams 2
+
+Each stream is a thread rendering frames with changing parameters, like the render thread
+while a slider is dragged. A probe thread measures how long a Python thread waits for the
+GIL meanwhile, which is what the UI experiences during rendering.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.append('imageprocessor/src')
+
+from ImageProcessing import Parameter, PreviewImage, ThreadRenderBackend
+from render_backends import ProcessRenderBackend
+
+
+def probe(stop, stalls):
+    while not stop.is_set():
+        start = time.perf_counter()
+        time.sleep(0.001)
+        stalls.append(time.perf_counter() - start - 0.001)
+
+
+def run(backend, image_object, frames, streams, directory):
+    # warm up, e.g. starts the worker processes and shares the image
+    backend.render_to_file(image_object, Parameter(), os.path.join(directory, 'warmup.tif'))
+
+    def stream(index):
+        for frame in range(frames):
+            params = Parameter(exposure=frame / frames, shadows=frame % 50, highlights=-(frame % 50))
+            backend.render_to_file(image_object, params, os.path.join(directory, f'{index}.tif'))
+
+    stop, stalls = threading.Event(), []
+    probe_thread = threading.Thread(target=probe, args=(stop, stalls))
+    threads = [threading.Thread(target=stream, args=(_,)) for _ in range(streams)]
+    probe_thread.start()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    probe_thread.join()
+    return frames * streams / elapsed, max(stalls, default=0) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--width', type=int, default=3000)
+    parser.add_argument('--height', type=int, default=2000)
+    parser.add_argument('--frames', type=int, default=10, help='frames per stream')
+    parser.add_argument('--streams', type=int, default=1)
+    parser.add_argument('--processes', type=int, default=2)
+    args = parser.parse_args()
+
+    raw_image = np.random.default_rng(0).random((args.height, args.width, 3), dtype=np.float32)
+    image_object = PreviewImage(None, raw_image)
+    backends = {
+        'thread': ThreadRenderBackend(),
+        'process': ProcessRenderBackend(processes=args.processes),
+    }
+    print(f'{args.width}x{args.height}, {args.streams} stream(s) x {args.frames} frames, '
+          f'{os.cpu_count()} CPU(s)')
+    with tempfile.TemporaryDirectory() as directory:
+        for name, backend in backends.items():
+            fps, stall = run(backend, image_object, args.frames, args.streams, directory)
+            print(f'{name:>8}: {fps:6.2f} frames/s, longest GIL stall {stall:7.1f} ms')
+            backend.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 import threading
 import os
 import base64
+import shutil
+import time
 
 import rawpy
 import numpy as np
@@ -8,6 +10,8 @@ from PIL import Image
 import cv2
 import flet as ft
 
+import compute_backends
+from config import FRAME_DELIVERY, MAX_DISPLAY_FPS, PROXY_LONG_EDGE, RENDER_WORKERS, TONE_MAP_LONG_EDGE
 from directory_management import generate_temp_dir
 
 
@@ -51,27 +55,58 @@ class Parameter:
         self.shadows = 0
         self.black_levels = 0
 
+    def copy(self):
+        """
+        Creates an independent copy of the parameters.
+
+        :return: A new Parameter object with the same values.
+        """
+        return Parameter(self.exposure, self.contrast, self.highlights, self.shadows, self.black_levels)
+
 
 class RawImage:
     """
     A class that handles the processing of raw image files, including adjustments
     such as exposure, contrast, highlights, shadows, and black levels.
     """
-    def __init__(self, file_path):
+    # Radius of the shadow and highlight tone map filter, as a fraction of the long edge of the image
+    TONE_RADIUS = 0.01
+    # Regularization of the guided filter upsampling the tone maps, larger values smooth across more edges
+    TONE_EPSILON = 0.01
+    # Range of tones modified by the shadows and by the highlights adjustment, as a fraction of the tonal range
+    TONE_RANGE = 0.5
+    # Value kept unchanged by the contrast adjustment
+    CONTRAST_PIVOT = 0.416
+
+    def __init__(self, file_path, buffer=None):
         """
         Loads and processes the raw image from the specified file path.
 
         :param file_path: Path to the raw image file to be processed.
+        :param buffer: A file-like object with the content of the raw file, e.g. a memory-mapped
+                       file read ahead by the `Prefetcher`. The file is read from disk if None.
         """
         self.file_path = file_path
-        with rawpy.imread(file_path) as raw_file:
-            self.raw_image = raw_file.postprocess(
+        self.raw_image = self.decode(file_path if buffer is None else buffer)
+        self.raw_image = self.raw_image.astype(np.float32) / 65535.0
+
+    @staticmethod
+    def decode(source, half_size=False):
+        """
+        Decodes a raw file into a linear 16-bit RGB image.
+
+        :param source: Path to the raw image file, or a file-like object with its content.
+        :param half_size: Decode at half the resolution without demosaicing, several times faster.
+        :return: The linear image as a uint16 array.
+        """
+        with rawpy.imread(source) as raw_file:
+            return raw_file.postprocess(
                 use_camera_wb=True,
                 output_bps=16,
                 no_auto_bright=True,
-                gamma=(1, 1)
+                gamma=(1, 1),
+                half_size=half_size
             )
-        self.raw_image = self.raw_image.astype(np.float32) / 65535.0
 
     @staticmethod
     def adjust_exposure(image, stops):
@@ -82,10 +117,10 @@ class RawImage:
         :param stops: The number of exposure stops to adjust by.
         :return: The exposure-adjusted image.
         """
-        return image * (2 ** stops)
+        return compute_backends.kernel('affine')(image, 2 ** stops, 0)
 
     @staticmethod
-    def adjust_contrast(image, contrast, pivot=0.416):
+    def adjust_contrast(image, contrast, pivot=CONTRAST_PIVOT):
         """
         Adjusts the contrast of the image.
 
@@ -95,14 +130,95 @@ class RawImage:
         :return: The contrast-adjusted image.
         """
         contrast = contrast / 800 + 1
-        return (image - pivot) * contrast + pivot
+        return compute_backends.kernel('affine')(image, contrast, pivot * (1 - contrast))
+
+    @staticmethod
+    def create_tone_plane(linear, long_edge=TONE_MAP_LONG_EDGE):
+        """
+        Creates the downscaled copy of a linear image the shadow and highlight tone maps are computed on.
+
+        :param linear: The linear image, a float array or a uint16 array as returned by `decode`.
+        :param long_edge: The long edge of the tone plane in pixels. Smaller images are copied as is.
+        :return: The linear tone plane as a float32 array.
+        """
+        height, width = linear.shape[:2]
+        scale = min(1, long_edge / max(height, width))
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        plane = cv2.resize(linear, size, interpolation=cv2.INTER_AREA)
+        if plane.dtype == np.uint16:
+            return plane.astype(np.float32) / 65535.0
+        return plane.astype(np.float32, copy=False)
+
+    def tone_plane(self):
+        """
+        Returns the tone plane of the image, created once per linear image, see `create_tone_plane`.
+
+        :return: The linear tone plane.
+        """
+        if getattr(self, '_tone_plane_source', None) is not self.raw_image:
+            self._tone_plane = self.create_tone_plane(self.raw_image)
+            self._tone_plane_source = self.raw_image
+        return self._tone_plane
+
+    @staticmethod
+    def sample_window(low, origin, shape, full_shape):
+        """
+        Bilinearly upsamples a window of a low resolution image to the full resolution.
+
+        Pixel centres are aligned like `cv2.resize`, so any window, e.g. a strip of an export,
+        gets the same values as the same pixels of the whole upsampled image.
+
+        :param low: The low resolution image of shape (height, width, channels).
+        :param origin: The (row, column) of the top left pixel of the window in the full image.
+        :param shape: The (height, width) of the window.
+        :param full_shape: The (height, width) of the full image.
+        :return: A list of the upsampled channels of the window, each of shape (height, width).
+        """
+        # rows are interpolated here, only for the rows of the window
+        coordinates = (np.arange(origin[0], origin[0] + shape[0]) + 0.5) * (low.shape[0] / full_shape[0]) - 0.5
+        coordinates = np.clip(coordinates, 0, low.shape[0] - 1)
+        top = np.floor(coordinates).astype(np.intp)
+        bottom = np.minimum(top + 1, low.shape[0] - 1)
+        weight = (coordinates - top).astype(np.float32)[:, None, None]
+        rows = low[top] * (1 - weight) + low[bottom] * weight
+        # columns by cv2.resize, which leaves the rows unchanged as the height stays the same
+        columns = slice(origin[1], origin[1] + shape[1])
+        return [
+            cv2.resize(rows[..., _], (full_shape[1], shape[0]), interpolation=cv2.INTER_LINEAR)[:, columns]
+            for _ in range(rows.shape[2])
+        ]
+
+    @staticmethod
+    def guided_coefficients(guide_low, source_low, radius, epsilon):
+        """
+        Computes the coefficients of a guided filter (He et al.) at low resolution.
+
+        The filtered map is `a * guide + b` with the upsampled coefficients, so it follows the
+        edges of the full resolution guide without a blur at full resolution (fast guided filter).
+
+        :param guide_low: The guide at low resolution, values in [0, 255].
+        :param source_low: The map to filter at low resolution, values in [0, 255].
+        :param radius: The radius of the filter in low resolution pixels.
+        :param epsilon: The regularization of the filter.
+        :return: An array of shape (height, width, 2) with the coefficients a and b, for values in [0, 255].
+        """
+        box_blur = compute_backends.kernel('box_blur')
+        size = 2 * radius + 1
+        guide_low = guide_low * (1 / 255)
+        source_low = source_low * (1 / 255)
+        mean_guide = box_blur(guide_low, size)
+        mean_source = box_blur(source_low, size)
+        variance = box_blur(guide_low * guide_low, size) - mean_guide * mean_guide
+        a = (box_blur(guide_low * source_low, size) - mean_guide * mean_source) / (variance + epsilon)
+        b = mean_source - a * mean_guide
+        return np.dstack([box_blur(a, size), box_blur(b, size) * 255]).astype(np.float32)
 
     @staticmethod
     def shadow_highlights_correction(
             img,
             shadow_amount_percent, shadow_tone_percent, shadow_radius,
             highlight_amount_percent, highlight_tone_percent, highlight_radius,
-            color_percent
+            color_percent, tone_plane=None, origin=(0, 0), full_shape=None
     ):
         # Copied from https://gist.github.com/HViktorTsoi/8e8b0468a9fb07842669aa368382a7df
         """
@@ -110,60 +226,44 @@ class RawImage:
         :param img: input RGB image numpy array of shape (height, width, 3)
         :param shadow_amount_percent [0.0 ~ 1.0]: Controls (separately for the highlight and shadow values in the image) how much of a correction to make.
         :param shadow_tone_percent [0.0 ~ 1.0]: Controls the range of tones in the shadows or highlights that are modified.
-        :param shadow_radius [>0]: Controls the size of the local neighborhood around each pixel
+        :param shadow_radius [>0]: Controls the size of the local neighborhood around each pixel, in tone plane pixels
         :param highlight_amount_percent [0.0 ~ 1.0]: Controls (separately for the highlight and shadow values in the image) how much of a correction to make.
         :param highlight_tone_percent [0.0 ~ 1.0]: Controls the range of tones in the shadows or highlights that are modified.
-        :param highlight_radius [>0]: Controls the size of the local neighborhood around each pixel
+        :param highlight_radius [>0]: Controls the size of the local neighborhood around each pixel, in tone plane pixels
         :param color_percent [-1.0 ~ 1.0]:
+        :param tone_plane: A downscaled copy of the whole image the tone maps are computed on, with the
+                           same adjustments as img. The tone maps are computed on img if None.
+        :param origin: The (row, column) of img in the whole image, if img is a window of it.
+        :param full_shape: The (height, width) of the whole image, the shape of img if None.
         :return:
         """
         img *= 255
         img = np.clip(img, 0, 255)
-        shadow_tone = shadow_tone_percent * 255
-        highlight_tone = 255 - highlight_tone_percent * 255
-
         shadow_gain = 1 + shadow_amount_percent * 6
         highlight_gain = 1 + highlight_amount_percent * 6
 
         # extract RGB channel
         height, width = img.shape[:2]
         img = img.astype(np.float32)
-        img_R, img_G, img_B = img[..., 2].reshape(-1), img[..., 1].reshape(-1), img[..., 0].reshape(-1)
 
         # The entire correction process is carried out in YUV space,
         # adjust highlights/shadows in Y space, and adjust colors in UV space
         # convert to Y channel (grey intensity) and UV channel (color)
-        img_Y = .3 * img_R + .59 * img_G + .11 * img_B
-        img_U = -img_R * .168736 - img_G * .331264 + img_B * .5
-        img_V = img_R * .5 - img_G * .418688 - img_B * .081312
-
-        # extract shadow / highlight
-        shadow_map = 255 - img_Y * 255 / shadow_tone
-        shadow_map[np.where(img_Y >= shadow_tone)] = 0
-        highlight_map = 255 - (255 - img_Y) * 255 / (255 - highlight_tone)
-        highlight_map[np.where(img_Y <= highlight_tone)] = 0
-
-        # // Gaussian blur on tone map, for smoother transition
-        if shadow_amount_percent * shadow_radius > 0:
-            # shadow_map = cv2.GaussianBlur(shadow_map.reshape(height, width), ksize=(shadow_radius, shadow_radius), sigmaX=0).reshape(-1)
-            shadow_map = cv2.blur(shadow_map.reshape(height, width), ksize=(shadow_radius, shadow_radius)).reshape(-1)
-
-        if highlight_amount_percent * highlight_radius > 0:
-            # highlight_map = cv2.GaussianBlur(highlight_map.reshape(height, width), ksize=(highlight_radius, highlight_radius), sigmaX=0).reshape(-1)
-            highlight_map = cv2.blur(highlight_map.reshape(height, width),
-                                     ksize=(highlight_radius, highlight_radius)).reshape(-1)
-
-        # Tone LUT
-        t = np.arange(256)
-        LUT_shadow = (1 - np.power(1 - t * (1 / 255), shadow_gain)) * 255
-        LUT_shadow = np.maximum(0, np.minimum(255, np.int_(LUT_shadow + .5)))
-        LUT_highlight = np.power(t * (1 / 255), highlight_gain) * 255
-        LUT_highlight = np.maximum(0, np.minimum(255, np.int_(LUT_highlight + .5)))
+        img_Y, img_U, img_V = RawImage.to_yuv(img)
+
+        # extract shadow / highlight on the tone plane, a downscaled copy of the whole image
+        tone_plane = img if tone_plane is None else np.clip(tone_plane * 255, 0, 255)
+        maps = RawImage.tone_maps(
+            RawImage.luminance(tone_plane), img_Y.reshape(height, width),
+            shadow_tone_percent if shadow_amount_percent != 0 else None, shadow_radius,
+            highlight_tone_percent if highlight_amount_percent != 0 else None, highlight_radius,
+            origin, full_shape
+        )
+        shadow_map = maps.pop(0) if shadow_amount_percent != 0 else np.zeros_like(img_Y)
+        highlight_map = maps.pop(0) if highlight_amount_percent != 0 else np.zeros_like(img_Y)
 
         # adjust tone
-        shadow_map = shadow_map * (1 / 255)
-        highlight_map = highlight_map * (1 / 255)
-
+        LUT_shadow, LUT_highlight = RawImage.tone_luts(shadow_gain, highlight_gain)
         iH = (1 - shadow_map) * img_Y + shadow_map * LUT_shadow[np.int_(img_Y)]
         iH = (1 - highlight_map) * iH + highlight_map * LUT_highlight[np.int_(iH)]
         img_Y = iH
@@ -183,13 +283,108 @@ class RawImage:
             img_V = w * img_V + (1 - w) * img_V * color_gain
 
         # re convert to RGB channel
-        output_R = np.int_(img_Y + 1.402 * img_V + .5)
-        output_G = np.int_(img_Y - .34414 * img_U - .71414 * img_V + .5)
-        output_B = np.int_(img_Y + 1.772 * img_U + .5)
+        return RawImage.from_yuv(img_Y, img_U, img_V, (height, width))
 
-        output = np.vstack([output_B, output_G, output_R]).T.reshape(height, width, 3)
-        output = np.minimum(output, 255)
-        return output / 255.
+    @staticmethod
+    def luminance(image):
+        """
+        Returns the luminance of an image, the Y channel of `to_yuv`.
+
+        :param image: The image, an array of shape (..., 3).
+        :return: The luminance, of the shape of image without its channels.
+        """
+        return .3 * image[..., 2] + .59 * image[..., 1] + .11 * image[..., 0]
+
+    @staticmethod
+    def to_yuv(image):
+        """
+        Converts an image to the YUV space the shadow and highlight correction works in.
+
+        :param image: The image with values in [0, 255], an array of shape (..., 3).
+        :return: A tuple of the flattened Y, U and V channels.
+        """
+        img_R, img_G, img_B = image[..., 2].reshape(-1), image[..., 1].reshape(-1), image[..., 0].reshape(-1)
+        img_Y = .3 * img_R + .59 * img_G + .11 * img_B
+        img_U = -img_R * .168736 - img_G * .331264 + img_B * .5
+        img_V = img_R * .5 - img_G * .418688 - img_B * .081312
+        return img_Y, img_U, img_V
+
+    @staticmethod
+    def from_yuv(img_Y, img_U, img_V, shape):
+        """
+        Converts the channels of `to_yuv` back to an image.
+
+        :param img_Y: The Y channel, flattened, or one row per image sharing the U and V channels.
+        :param img_U: The flattened U channel.
+        :param img_V: The flattened V channel.
+        :param shape: The shape of the result without its channels, e.g. (height, width).
+        :return: The image with values in [0, 1], of shape shape + (3,).
+        """
+        output = np.stack([
+            np.int_(img_Y + 1.772 * img_U + .5),
+            np.int_(img_Y - .34414 * img_U - .71414 * img_V + .5),
+            np.int_(img_Y + 1.402 * img_V + .5)
+        ], axis=-1).reshape(*shape, 3)
+        return np.minimum(output, 255) / 255.
+
+    @staticmethod
+    def tone_maps(plane_Y, guide, shadow_tone_percent, shadow_radius, highlight_tone_percent, highlight_radius,
+                  origin=(0, 0), full_shape=None):
+        """
+        Computes the shadow and highlight tone maps, how much each pixel is adjusted.
+
+        The maps are extracted from the luminance of the tone plane and upsampled to the image
+        with a guided filter, for smoother transitions that keep the edges of the image.
+
+        :param plane_Y: The luminance of the tone plane, values in [0, 255].
+        :param guide: The luminance of the image or window, values in [0, 255].
+        :param shadow_tone_percent: The range of tones of the shadow map [0.0 ~ 1.0], None for no shadow map.
+        :param shadow_radius: The radius of the shadow map filter, in tone plane pixels.
+        :param highlight_tone_percent: The range of tones of the highlight map [0.0 ~ 1.0], None for no highlight map.
+        :param highlight_radius: The radius of the highlight map filter, in tone plane pixels.
+        :param origin: The (row, column) of the guide in the whole image, if it is a window of it.
+        :param full_shape: The (height, width) of the whole image, the shape of guide if None.
+        :return: A list of the requested maps in this order, flattened, values in [0, 1].
+        """
+        coefficients = []
+        if shadow_tone_percent is not None:
+            shadow_tone = shadow_tone_percent * 255
+            shadow_map = 255 - plane_Y * 255 / shadow_tone
+            shadow_map[plane_Y >= shadow_tone] = 0
+            coefficients.append(RawImage.guided_coefficients(plane_Y, shadow_map, shadow_radius, RawImage.TONE_EPSILON))
+        if highlight_tone_percent is not None:
+            highlight_tone = 255 - highlight_tone_percent * 255
+            highlight_map = 255 - (255 - plane_Y) * 255 / (255 - highlight_tone)
+            highlight_map[plane_Y <= highlight_tone] = 0
+            coefficients.append(
+                RawImage.guided_coefficients(plane_Y, highlight_map, highlight_radius, RawImage.TONE_EPSILON)
+            )
+        # both maps are upsampled at once, each by its coefficients a and b
+        maps = []
+        if coefficients:
+            full_shape = guide.shape if full_shape is None else full_shape
+            planes = RawImage.sample_window(np.dstack(coefficients), origin, guide.shape, full_shape)
+            for a, b in zip(planes[0::2], planes[1::2]):
+                a = a * guide
+                a += b
+                maps.append(np.clip(a, 0, 255, out=a).reshape(-1) * (1 / 255))
+        return maps
+
+    @staticmethod
+    def tone_luts(shadow_gain, highlight_gain):
+        """
+        Computes the tone curves brightening the shadows and darkening the highlights.
+
+        :param shadow_gain: The gain of the shadow curve, or a column of gains, one curve per row.
+        :param highlight_gain: The gain of the highlight curve, or a column of gains, one curve per row.
+        :return: A tuple of the shadow and highlight lookup tables from 256 luminance levels.
+        """
+        t = np.arange(256)
+        LUT_shadow = (1 - np.power(1 - t * (1 / 255), shadow_gain)) * 255
+        LUT_shadow = np.maximum(0, np.minimum(255, np.int_(LUT_shadow + .5)))
+        LUT_highlight = np.power(t * (1 / 255), highlight_gain) * 255
+        LUT_highlight = np.maximum(0, np.minimum(255, np.int_(LUT_highlight + .5)))
+        return LUT_shadow, LUT_highlight
 
     @staticmethod
     def adjust_black_levels(image, black_levels):
@@ -202,7 +397,7 @@ class RawImage:
         """
         black_levels = (black_levels / 100) / 2
         range_ = 1 - black_levels
-        return image * range_ + black_levels
+        return compute_backends.kernel('affine')(image, range_, black_levels)
 
     def render_image(self, params):
         """
@@ -212,21 +407,133 @@ class RawImage:
         :param params: The parameters object containing the adjustments to apply.
         :return: The final rendered image.
         """
-        # exposure
-        image = self.adjust_exposure(self.raw_image, params.exposure)
-        # contrast
-        image = self.adjust_contrast(image, params.contrast)
-        # black_levels
-        image = self.adjust_black_levels(image, params.black_levels)
+        return self.render_window(self.raw_image, params, self.tone_plane())
+
+    def render_region(self, params, region=None):
+        """
+        Renders a region of the image at its native resolution, e.g. the part visible when zoomed in.
+
+        Only the pixels of the region are rendered, so a 1:1 view of a large image costs about as
+        much as a screen-sized render.
+
+        :param params: The parameters object containing the adjustments to apply.
+        :param region: The (top, left, height, width) of the region in pixels, the whole image if None.
+        :return: The rendered region.
+        """
+        if region is None:
+            return self.render_image(params)
+        top, left, height, width = region
+        window = self.raw_image[top:top + height, left:left + width]
+        return self.render_window(window, params, self.tone_plane(), (top, left), self.raw_image.shape[:2])
+
+    @classmethod
+    def affine_terms(cls, params):
+        """
+        Combines the exposure, contrast and black levels adjustments, which are all affine, into one.
+
+        :param params: The parameters object containing the adjustments to apply.
+        :return: A tuple (scale, offset), the adjusted value of x is x * scale + offset.
+        """
+        exposure = 2 ** params.exposure
+        contrast = params.contrast / 800 + 1
+        black_levels = (params.black_levels / 100) / 2
+        scale = exposure * contrast * (1 - black_levels)
+        offset = cls.CONTRAST_PIVOT * (1 - contrast) * (1 - black_levels) + black_levels
+        return scale, offset
+
+    def render_batch(self, params_list):
+        """
+        Renders the image with several parameters objects at once, e.g. the previews of presets.
+
+        Every result is the same as `render_image` with the same parameters. The luminance, the colour
+        and the guided shadow and highlight tone maps only depend on exposure, contrast and black
+        levels, so they are computed once for all parameters sharing these, e.g. variations of the
+        highlights and shadows, whose tone curves and conversion back to RGB are then evaluated for
+        all of them in one broadcast pass. Meant for small proxies, the memory grows with the number of parameters.
+
+        :param params_list: A list of parameters objects.
+        :return: A list of the rendered images, in the order of params_list.
+        """
+        linear, tone_plane = self.raw_image, self.tone_plane()
+        height, width = linear.shape[:2]
+        radius = max(1, round(self.TONE_RADIUS * max(tone_plane.shape[:2])))
+        groups = {}  # (scale, offset) -> indices of the parameters objects sharing them
+        for index, params in enumerate(params_list):
+            groups.setdefault(self.affine_terms(params), []).append(index)
+        affine = compute_backends.kernel('affine')
+        rendered = [None] * len(params_list)
+        for (scale, offset), indices in groups.items():
+            # the shared stages of `shadow_highlights_correction`
+            image = np.clip(affine(linear, scale, offset) * 255, 0, 255)
+            img_Y, img_U, img_V = self.to_yuv(image)
+            plane = np.clip(affine(tone_plane, scale, offset) * 255, 0, 255)
+            shadows = np.array([params_list[_].shadows / 100 for _ in indices])[:, None]
+            highlights = np.array([params_list[_].highlights / 100 for _ in indices])[:, None]
+            maps = self.tone_maps(
+                self.luminance(plane), img_Y.reshape(height, width),
+                self.TONE_RANGE if shadows.any() else None, radius,
+                self.TONE_RANGE if highlights.any() else None, radius
+            )
+            # the tone curves of all parameters of the group at once, one row each, a curve whose amount
+            # is 0 leaves the luminance unchanged, like the zero map of a single render
+            LUT_shadow, LUT_highlight = self.tone_luts(1 + shadows * 6, 1 + highlights * 6)
+            iH = np.broadcast_to(img_Y.astype(np.float64), (len(indices), img_Y.size))
+            if shadows.any():
+                shadow_map = maps.pop(0) if shadows.all() else maps.pop(0) * (shadows != 0)
+                iH = (1 - shadow_map) * img_Y + shadow_map * LUT_shadow[:, np.int_(img_Y)]
+            if highlights.any():
+                highlight_map = maps.pop(0) if highlights.all() else maps.pop(0) * (highlights != 0)
+                iH = (1 - highlight_map) * iH + highlight_map * np.take_along_axis(LUT_highlight, np.int_(iH), axis=1)
+            output = self.from_yuv(iH, img_U, img_V, (len(indices), height, width))
+            for index, result in zip(indices, output):
+                rendered[index] = result
+        return rendered
+
+    @classmethod
+    def render_window(cls, linear, params, tone_plane, origin=(0, 0), full_shape=None):
+        """
+        Renders a window of an image, e.g. a strip of an export, identical to the same pixels of a full render.
+
+        Every adjustment is per pixel except the shadow and highlight tone maps, which are
+        computed on the tone plane of the whole image, so no neighbouring pixels are needed.
+
+        :param linear: The linear window, a float array.
+        :param params: The parameters object containing the adjustments to apply.
+        :param tone_plane: The tone plane of the whole image, see `create_tone_plane`.
+        :param origin: The (row, column) of the window in the whole image.
+        :param full_shape: The (height, width) of the whole image, the shape of the window if None.
+        :return: The rendered window.
+        """
+        # exposure, contrast and black levels are affine, so they are combined into a single pass
+        scale, offset = cls.affine_terms(params)
+        affine = compute_backends.kernel('affine')
+        image = affine(linear, scale, offset)
         # highlights, shadows
-        image = self.shadow_highlights_correction(
+        radius = max(1, round(cls.TONE_RADIUS * max(tone_plane.shape[:2])))
+        image = cls.shadow_highlights_correction(
             image,
-            shadow_amount_percent=params.shadows/100, shadow_tone_percent=0.5, shadow_radius=5,
-            highlight_amount_percent=params.highlights/100, highlight_tone_percent=0.5, highlight_radius=5,
-            color_percent=0
+            shadow_amount_percent=params.shadows/100, shadow_tone_percent=cls.TONE_RANGE, shadow_radius=radius,
+            highlight_amount_percent=params.highlights/100, highlight_tone_percent=cls.TONE_RANGE,
+            highlight_radius=radius,
+            color_percent=0,
+            tone_plane=affine(tone_plane, scale, offset), origin=origin, full_shape=full_shape
         )
         return image
 
+    def create_proxy(self, long_edge=PROXY_LONG_EDGE):
+        """
+        Creates a downscaled copy of the linear image, used to render previews quickly.
+
+        :param long_edge: The long edge of the proxy in pixels. Smaller images are copied as is.
+        :return: The linear proxy image.
+        """
+        height, width = self.raw_image.shape[:2]
+        scale = long_edge / max(height, width)
+        if scale >= 1:
+            return self.raw_image.copy()
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(self.raw_image, size, interpolation=cv2.INTER_AREA)
+
     @staticmethod
     def srgb_gamma_correction(image):
         """
@@ -235,11 +542,7 @@ class RawImage:
         :param image: The linear image to be gamma corrected.
         :return: The gamma-corrected image.
         """
-        mask = image <= 0.0031308
-        corrected = np.empty_like(image)
-        corrected[mask] = 12.92 * image[mask]
-        corrected[~mask] = 1.055 * (image[~mask] ** (1 / 2.4)) - 0.055
-        return corrected
+        return compute_backends.kernel('srgb_gamma')(image)
 
 
     @staticmethod
@@ -251,16 +554,35 @@ class RawImage:
         :param path: The destination path for the image.
         :param bit_depth: The bit depth to save the image in (8 or 16).
         """
+        image = RawImage.quantize(image, RawImage.output_type(path, bit_depth))
+        Image.fromarray(image, mode='RGB').save(path)
+
+    @staticmethod
+    def output_type(path, bit_depth=8):
+        """
+        Returns the data type an image is saved with.
+
+        :param path: The destination path for the image, only PNG and TIFF support 16 bits.
+        :param bit_depth: The requested bit depth (8 or 16).
+        :return: np.uint8 or np.uint16.
+        """
         if path.lower().endswith(('.png', '.tif', '.tiff')) and bit_depth == 16:
-            data_type = np.uint16
-            scale = 65535
-        else:
-            data_type = np.uint8
-            scale = 255
+            return np.uint16
+        return np.uint8
+
+    @staticmethod
+    def quantize(image, data_type):
+        """
+        Converts a rendered linear image into sRGB pixel values.
+
+        :param image: The rendered image.
+        :param data_type: np.uint8 or np.uint16.
+        :return: The gamma-corrected image as an array of the data type.
+        """
+        scale = np.iinfo(data_type).max
         image = RawImage.srgb_gamma_correction(image)
         image = np.clip(image, 0, 1)
-        image = (image * scale).astype(data_type)
-        Image.fromarray(image, mode='RGB').save(path)
+        return (image * scale).astype(data_type)
 
 
 class EmptyImage(RawImage):
@@ -275,15 +597,303 @@ class EmptyImage(RawImage):
         """
         self.raw_image = np.zeros((256, 256, 3), dtype=np.float32)
 
+
+class HalfSizeImage(RawImage):
+    """
+    A subclass of RawImage decoded at half resolution, shown while the full decode runs in the background.
+    """
+    def __init__(self, file_path):
+        """
+        Loads the raw image at half resolution.
+
+        :param file_path: Path to the raw image file.
+        """
+        self.file_path = file_path
+        self.raw_image = self.decode(file_path, half_size=True).astype(np.float32) / 65535.0
+
+
+class PreviewImage(RawImage):
+    """
+    A subclass of RawImage built from an already decoded linear image, such as a stored proxy,
+    instead of decoding the raw file.
+
+    It renders like a RawImage, which allows editing to start before the raw file is decoded.
+    """
+    def __init__(self, file_path, raw_image):
+        """
+        Initializes the image from a linear image.
+
+        :param file_path: Path to the raw image file the linear image was created from.
+        :param raw_image: The linear RGB image.
+        """
+        self.file_path = file_path
+        # no copy if the image already is float32, e.g. a view of a shared memory buffer
+        self.raw_image = raw_image.astype(np.float32, copy=False)
+
+
+class Viewport:
+    """
+    The part of an image shown at 1:1 in the edit view.
+
+    The centre is kept as a fraction of the image size, so the same part stays in view when a
+    half size decode is replaced by the full image.
+    """
+    def __init__(self, width, height, center_x=0.5, center_y=0.5):
+        """
+        Initializes the viewport.
+
+        :param width: The width of the view in pixels.
+        :param height: The height of the view in pixels.
+        :param center_x: The horizontal centre of the view as a fraction of the image width.
+        :param center_y: The vertical centre of the view as a fraction of the image height.
+        """
+        self.width = width
+        self.height = height
+        self.center_x = center_x
+        self.center_y = center_y
+
+    def region(self, shape):
+        """
+        Returns the region of an image inside the view, moved inside the image at its borders.
+
+        :param shape: The shape of the image.
+        :return: The (top, left, height, width) of the region in pixels.
+        """
+        height, width = min(self.height, shape[0]), min(self.width, shape[1])
+        top = min(max(round(self.center_y * shape[0] - height / 2), 0), shape[0] - height)
+        left = min(max(round(self.center_x * shape[1] - width / 2), 0), shape[1] - width)
+        return top, left, height, width
+
+    def pan(self, dx, dy, shape):
+        """
+        Moves the image in the view by a number of pixels, e.g. by dragging it.
+
+        :param dx: The horizontal movement in pixels, positive to the right.
+        :param dy: The vertical movement in pixels, positive downwards.
+        :param shape: The shape of the image.
+        """
+        # the centre stays where the view fits in the image, so panning back responds immediately
+        half_width = min(self.width, shape[1]) / 2 / shape[1]
+        half_height = min(self.height, shape[0]) / 2 / shape[0]
+        self.center_x = min(max(self.center_x - dx / shape[1], half_width), 1 - half_width)
+        self.center_y = min(max(self.center_y - dy / shape[0], half_height), 1 - half_height)
+
+
+class ThreadRenderBackend:
+    """
+    The default render backend of ImageProcessorThread, which renders and encodes frames in the calling thread.
+    """
+    def render_to_file(self, image_object, params, path, region=None):
+        """
+        Renders an image and saves the frame.
+
+        :param image_object: The image to render.
+        :param params: Parameters used for rendering the image.
+        :param path: The destination path of the frame, its extension selects the format.
+        :param region: The (top, left, height, width) of the region to render, the whole image if None.
+        """
+        RawImage.save_image(image_object.render_region(params, region), path)
+
+    def close(self):
+        """
+        Releases the resources of the backend, nothing to do for this backend.
+        """
+        pass
+
+
+def update_control(control, page):
+    """
+    Sends the changes of a single control to the client instead of diffing the whole page.
+
+    Falls back to a page update if the control is not on the page yet.
+
+    :param control: The changed control.
+    :param page: The page the control belongs to.
+    """
+    try:
+        control.update()
+    except AssertionError:  # flet asserts the control was added to the page
+        page.update()
+
+
+def frame_source(path, page):
+    """
+    Returns the `ft.Image.src` of a frame file.
+
+    Desktop clients load the file directly. Web clients fetch it from the assets directory,
+    which the app serves from TEMP_DIR.
+
+    :param path: The path of the frame file inside TEMP_DIR.
+    :param page: The page showing the frame.
+    :return: The path or URL of the frame.
+    """
+    if page is not None and page.web:
+        return '/' + os.path.relpath(path, TEMP_DIR).replace(os.sep, '/')
+    return path
+
+
+def remove_file(path):
+    """
+    Removes a file, ignoring files which are already gone or still in use.
+
+    :param path: The path of the file.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def publish_file(path, alias):
+    """
+    Makes `alias` refer to the content of `path`, as a hard link if the file system supports it.
+
+    :param path: The path of the file.
+    :param alias: The path through which the content is also available.
+    """
+    temp_path = alias + '.tmp'
+    remove_file(temp_path)
+    try:
+        os.link(path, temp_path)
+    except OSError:
+        shutil.copyfile(path, temp_path)
+    os.replace(temp_path, alias)
+
+
+class FramePresenter:
+    """
+    Delivers rendered frames to their image container at a capped frame rate.
+
+    Only the newest frame is kept: a frame replaced by a newer one before its turn is neither
+    encoded nor sent, so fast slider drags do not queue up stale frames on the websocket.
+
+    Every frame is a separate file with a versioned name. With the 'file' delivery the image
+    control only receives the path of the file and the client loads the binary itself, the new
+    name keeps it from showing a cached frame. With the 'base64' delivery the file is sent
+    inline as `src_base64`.
+    """
+    # Delivered frames kept on disk, the client may still be loading the previous one
+    KEEP_FRAMES = 2
+
+    def __init__(self, max_fps=MAX_DISPLAY_FPS, delivery=FRAME_DELIVERY):
+        """
+        Initializes the presenter, its daemon thread is started with the first frame.
+
+        :param max_fps: The maximum number of frames delivered per second, 0 for no limit.
+        :param delivery: 'file' or 'base64', see the class description.
+        """
+        self.interval = 1 / max_fps if max_fps else 0
+        self.delivery = delivery
+        self.presented = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._frame = None  # (frame path, image container, page) waiting to be delivered
+        self._delivered = []  # paths of the delivered frames still on disk
+        self._last_present = 0
+        self._thread = None
+
+    def submit(self, frame_path, image_container, page):
+        """
+        Queues a frame for delivery, replacing and deleting a frame that was not delivered yet.
+
+        The presenter owns the frame file from now on and deletes it once it is outdated.
+
+        :param frame_path: The path of the frame file.
+        :param image_container: The container displaying the frame.
+        :param page: The page of the container.
+        """
+        with self._lock:
+            if self._frame is not None:
+                self.dropped += 1
+                remove_file(self._frame[0])
+            self._frame = (frame_path, image_container, page)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._event.set()
+
+    def _run(self):
+        while True:
+            self._event.wait()
+            delay = self._last_present + self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                self._event.clear()
+                frame, self._frame = self._frame, None
+            if frame is None:
+                continue
+            self._last_present = time.monotonic()
+            self.show(*frame)
+            self.presented += 1
+            self._delivered.append(frame[0])
+            while len(self._delivered) > self.KEEP_FRAMES:
+                remove_file(self._delivered.pop(0))
+
+    def show(self, frame_path, image_container, page, key=None):
+        """
+        Shows a frame file in its image container and updates only the image control.
+
+        :param frame_path: The path of the frame file.
+        :param image_container: The container displaying the frame.
+        :param page: The page of the container.
+        :param key: If given, the new key of the image control, e.g. 'original' for the compare view.
+        """
+        if self.delivery == 'file':
+            source = {'src': frame_source(frame_path, page), 'src_base64': None}
+        else:
+            with open(frame_path, 'rb') as file:
+                source = {'src': None, 'src_base64': base64.b64encode(file.read()).decode('utf-8')}
+        if image_container.content is None:
+            image_container.content = ft.Image(key=key or 'temp', **source)
+            update_control(image_container, page)
+        else:
+            for name, value in source.items():
+                setattr(image_container.content, name, value)
+            if key is not None:
+                image_container.content.key = key
+            update_control(image_container.content, page)
+
+
 class ImageProcessorThread(threading.Thread):
     """
     A singleton thread class responsible for processing images asynchronously.
 
     This thread processes images in the background and ensures that only one instance is active at any time.
     It performs image rendering, saving, and encoding tasks, and manages the state of an image container.
+    Frames are rendered by its `backend`, a ThreadRenderBackend unless replaced, e.g. by a
+    `render_backends.ProcessRenderBackend`. If a `viewport` is set, only its region of the image
+    is rendered at native resolution.
+
+    In the web server mode every session renders on its own thread created with `new_session`.
+    All render threads share `render_slots`, so no more frames than `RENDER_WORKERS` are rendered
+    at the same time, and a session whose frame waits for a slot renders only its newest parameters.
     """
     _instance = None
     _lock = threading.Lock()
+    render_slots = threading.BoundedSemaphore(RENDER_WORKERS or os.cpu_count() or 1)
+    _rendering = 0  # number of render threads working on a frame
+
+    @classmethod
+    def new_session(cls, name):
+        """
+        Creates a render thread for one session besides the singleton, with its own image,
+        parameters, viewport and frames.
+
+        :param name: The name of the session, e.g. the session ID of its page.
+        :return: The new ImageProcessorThread, already started.
+        """
+        instance = super(ImageProcessorThread, cls).__new__(cls)
+        instance._initialize(os.path.join(TEMP_DIR, 'sessions', str(name)))
+        return instance
+
+    @classmethod
+    def busy(cls):
+        """
+        Returns True while any render thread works on a frame, so background work can wait.
+        """
+        return cls._rendering > 0
 
     def __new__(cls, *args, **kwargs):
         """
@@ -298,60 +908,91 @@ class ImageProcessorThread(threading.Thread):
                     cls._instance._initialize()  # Ensure attributes are initialized once
         return cls._instance
 
-    def _initialize(self):
+    def _initialize(self, directory=TEMP_DIR):
         """
         Initializes the attributes of the thread instance. This ensures that the thread is ready to process images.
 
         The thread runs as a daemon and starts automatically.
-        """
-        if self._instance is not None:
-            super().__init__()
-            self.event = threading.Event()
-            self.daemon = True
-            self.page = None
-            self.image_object = None
-            self.params = None
-            self.image_container = None
-            self.generate_original = False
-            self.need_update_image = False
-            self.start()
 
-            self._initialized = True  # Prevent re-initialization
+        :param directory: The folder inside TEMP_DIR the frames are written to.
+        """
+        super().__init__()
+        self.event = threading.Event()
+        self.daemon = True
+        self.page = None
+        self.image_object = None
+        self.params = None
+        self.image_container = None
+        self.generate_original = False
+        self.need_update_image = False
+        self.backend = ThreadRenderBackend()
+        self.viewport = None  # a Viewport when zoomed to 1:1, None to show the whole image
+        self.presenter = FramePresenter()
+        self.directory = directory
+        self.closed = False
+        self.frame_version = 0
+        self.frame_path = None  # the last rendered frame, also available as temp.tif
+        self.original_path = None  # the last rendered original, also available as original.tif
+        self.start()
+
+        self._initialized = True  # Prevent re-initialization
 
     def run(self):
         """
         The main loop that continuously checks if image processing is needed.
 
-        This method waits for the event to be set and processes the image if necessary. It performs the rendering,
-        saving, encoding, and updating the image container, then triggers the page update.
+        This method waits for the event to be set and processes the image if necessary. It performs the rendering
+        and saving, then hands the frame to the `FramePresenter`, which updates the image container.
         """
-        while True:
+        while not self.closed:
             self.event.wait()  # Wait for the event to be set
-            while self.need_update_image:
-                self.need_update_image = False
-                image = self.image_object.render_image(self.params)
-                target_path = os.path.join(TEMP_DIR, 'temp.tif')
-                RawImage.save_image(image, target_path)
-
-                with open(target_path, 'rb') as file:
-                    encoded_string = base64.b64encode(file.read()).decode('utf-8')
-
-                if self.image_container.content is None:
-                    self.image_container.content = ft.Image(
-                        src_base64=encoded_string, key='temp'
-                    )
-                else:
-                    self.image_container.content.src_base64 = encoded_string
-
-                self.page.update()
-
-                if self.generate_original:
-                    original_params = Parameter()
-                    original_image = self.image_object.render_image(original_params)
-                    original_target = os.path.join(TEMP_DIR, 'original.tif')
-                    RawImage.save_image(original_image, original_target)
-
+            with self._lock:
+                ImageProcessorThread._rendering += 1
+            try:
+                self._render_frames()
+            finally:
+                with self._lock:
+                    ImageProcessorThread._rendering -= 1
             self.event.clear()  # Clear the event after processing
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _render_frames(self):
+        """
+        Renders frames until no new parameters are waiting, each one while holding a render slot.
+        """
+        while self.need_update_image and not self.closed:
+            self.need_update_image = False
+            # every frame gets a new file name, so clients never show a cached frame
+            self.frame_version += 1
+            frames_dir = os.path.join(self.directory, 'frames')
+            os.makedirs(frames_dir, exist_ok=True)
+            target_path = os.path.join(frames_dir, f'{self.frame_version}.tif')
+            viewport = self.viewport
+            region = None if viewport is None else viewport.region(self.image_object.raw_image.shape)
+            with self.render_slots:
+                self.backend.render_to_file(self.image_object, self.params, target_path, region)
+            publish_file(target_path, os.path.join(self.directory, 'temp.tif'))
+            self.frame_path = target_path
+            self.presenter.submit(target_path, self.image_container, self.page)
+
+            if self.generate_original:
+                original_target = os.path.join(frames_dir, f'original-{self.frame_version}.tif')
+                with self.render_slots:
+                    self.backend.render_to_file(self.image_object, Parameter(), original_target, region)
+                publish_file(original_target, os.path.join(self.directory, 'original.tif'))
+                if self.original_path is not None:
+                    remove_file(self.original_path)
+                self.original_path = original_target
+
+    def close(self):
+        """
+        Stops a session's render thread, which removes its frames once the current frame is done.
+        The singleton is never closed, its frames are removed with TEMP_DIR.
+        """
+        if self is ImageProcessorThread._instance:
+            return
+        self.closed = True
+        self.event.set()
 
     def process_image(self, image_object: RawImage, params, image_container, generate_original=False):
         """
@@ -368,24 +1009,3 @@ class ImageProcessorThread(threading.Thread):
         self.generate_original = generate_original
         self.need_update_image = True
         self.event.set()  # Trigger image processing
-
-
-def create_thumbnail(image_path, thumbnail_path):
-    """
-    Creates a thumbnail of a raw image and saves it to the specified path.
-
-    This function reads a raw image file, processes it to create a smaller version, and saves it as a thumbnail.
-
-    :param image_path: Path to the raw image file.
-    :param thumbnail_path: Path where the thumbnail image will be saved.
-    """
-    with rawpy.imread(image_path) as raw:
-        img = raw.postprocess(
-            use_camera_wb=True,
-            output_bps=8,
-            half_size=True
-        )
-        img = Image.fromarray(img)
-        long_edge = 512
-        img.thumbnail((long_edge, long_edge))
-        img.save(thumbnail_path)
@@ -1,22 +1,37 @@
+import base64
+import copy
+import hashlib
+import io
 import os
 import json
+import threading
+import time
+from collections import deque
 from dotenv import load_dotenv
 
+import numpy as np
 from PIL import Image
 from google import genai
 import httpx
 
+from config import AI_BACKEND, AI_DEADLINE, AI_HEDGE_DELAY, AI_HEDGE_MIN_SAMPLES, AI_HEDGE_MODEL, \
+    AI_HEDGE_PERCENTILE, AI_LATENCY_SAMPLES, AI_SERVICE_URL
 from ImageProcessing import Parameter
 from directory_management import generate_temp_dir
 
 
-def _generate_prompt(prompt: str, parameters: Parameter) -> str:
+def _generate_prompt(prompt: str, parameters: Parameter, suggestion: Parameter = None) -> str:
     """Generate a structured prompt string for the API call with image parameters."""
+    # the local auto-tone gives the model a measured starting point, so fewer requests are needed
+    hint = '' if suggestion is None else f""";
+    A histogram analysis of the unedited image suggests {{exposure: {suggestion.exposure}, contrast: {suggestion.contrast}, 
+    highlights: {suggestion.highlights}, shadows: {suggestion.shadows}, 
+    black_levels: {suggestion.black_levels}}} as a neutral starting point"""
     return f"""
     Analyze this image: I want {prompt}; 
     Current parameters are {{exposure: {parameters.exposure}, contrast: {parameters.contrast}, 
     highlights: {parameters.highlights}, shadows: {parameters.shadows}, 
-    black_levels: {parameters.black_levels}}} and return a JSON object with the following fields:
+    black_levels: {parameters.black_levels}}}{hint} and return a JSON object with the following fields:
     {{
       "improvement_suggestions": "A couple of sentences on how to improve the image.",
       "exposure_adjustment": "A float number between -5 and 5 indicating the recommended stops of exposure adjustment.",
@@ -28,85 +43,526 @@ def _generate_prompt(prompt: str, parameters: Parameter) -> str:
     Ensure the response is valid JSON and nothing else.
     """
 
+class ResponseParser:
+    """
+    Parses the JSON object of a model response while it streams in, chunk by chunk.
 
-class ImageAnalyzer:
+    Anything around the object, e.g. a Markdown code fence, is skipped. Every top-level field is
+    decoded as soon as its value is complete, and the text of a string field can be read while it
+    is still streaming. Every character is scanned once, however the response is split into chunks.
+    """
     def __init__(self):
-        """Initialize the ImageAnalyzer with API key and temporary directory."""
-        load_dotenv()  # Load environment variables from .env file
+        self.text = ''
+        self.fields = {}  # the complete top-level fields
+        self.complete = False
+        self._position = 0
+        self._start = None  # index of the opening brace of the object
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = 'key'  # at the top level: 'key', 'colon' or 'value'
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+
+    def feed(self, chunk):
+        """
+        Adds the next chunk of the response.
+
+        :param chunk: The text of the chunk.
+        :return: True if a field was completed by the chunk.
+        """
+        self.text += chunk
+        count = len(self.fields)
+        text = self.text
+        while self._position < len(text) and not self.complete:
+            char = text[self._position]
+            if self._start is None:
+                if char == '{':
+                    self._start = self._position
+                    self._depth = 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == 'key':
+                        self._key = self._decode(text[self._key_start:self._position + 1])
+                        self._expect = 'colon'
+            elif not char.isspace():
+                if self._depth == 1:
+                    if self._expect == 'key' and char == '"':
+                        self._key_start = self._position
+                    elif self._expect == 'colon' and char == ':':
+                        self._expect = 'value'
+                    elif self._expect == 'value' and self._value_start is None:
+                        self._value_start = self._position
+                if char == '"':
+                    self._in_string = True
+                elif char in '{[':
+                    self._depth += 1
+                elif char in '}]':
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._end_field(self._position)
+                        self.complete = True
+                elif char == ',' and self._depth == 1:
+                    self._end_field(self._position)
+            self._position += 1
+        return len(self.fields) > count
+
+    def _end_field(self, end):
+        if self._key is not None and self._value_start is not None:
+            value = self._decode(self.text[self._value_start:end])
+            if value is not None:
+                self.fields[self._key] = value
+        self._expect, self._key, self._value_start = 'key', None, None
+
+    @staticmethod
+    def _decode(text):
+        try:
+            return json.loads(text)
+        except json.decoder.JSONDecodeError:
+            return None
+
+    def partial(self, key):
+        """
+        Returns the text of a string field so far, e.g. to show it while it streams.
+
+        :param key: The name of the field.
+        :return: The complete or partial text, None if the value has not started or is not a string.
+        """
+        if key in self.fields:
+            value = self.fields[key]
+            return value if isinstance(value, str) else None
+        if key != self._key or self._value_start is None or self.text[self._value_start] != '"':
+            return None
+        text = self.text[self._value_start:self._position]
+        if self._in_string:
+            # drop a trailing escape sequence cut by the chunk
+            for cut in range(min(6, len(text) - 1) + 1):
+                value = self._decode(text[:len(text) - cut] + '"')
+                if value is not None:
+                    return value
+            return None
+        return self._decode(text)
+
+    def result(self):
+        """
+        Decodes the whole object once the response ended.
+
+        :return: The decoded object.
+        :raises json.decoder.JSONDecodeError: If the response holds no complete and valid JSON object.
+        """
+        if not self.complete:
+            raise json.decoder.JSONDecodeError('Incomplete JSON object', self.text, len(self.text))
+        return json.loads(self.text[self._start:self._position])
+
+
+def stub_response(text: str) -> str:
+    """
+    Generate a deterministic answer in the format requested by the prompt, without any network call.
+
+    The adjustments are derived from a hash of the text, so the same prompt and parameters always get the same answer.
+    """
+    digest = hashlib.sha1(text.encode()).digest()
+    response_json = {
+        "improvement_suggestions": "Stub analysis: the adjustments are derived from the prompt, not the image.",
+        "exposure_adjustment": round(digest[0] / 255 * 2 - 1, 2),
+        "contrast_adjustment": digest[1] % 41 - 20,
+        "highlight_adjustment": digest[2] % 51,
+        "shadows_adjustment": digest[3] % 51,
+        "black_levels_adjustment": digest[4] % 21
+    }
+    # fenced like the answers of the model
+    return '```json\n' + json.dumps(response_json, indent=2) + '\n```'
+
+
+class LatencyTracker:
+    """Keeps the most recent latencies of a service and their percentiles, safe to use from several threads."""
+    def __init__(self, size: int = AI_LATENCY_SAMPLES):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def count(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float):
+        """Return the q-th percentile of the recent latencies, None before the first one."""
+        with self._lock:
+            if not self._samples:
+                return None
+            return float(np.percentile(self._samples, q))
+
+
+class _Attempt:
+    def __init__(self):
+        self.parser = ResponseParser()
+        self.error = None
+        self.done = False
+
+
+class _HedgedRequest:
+    """
+    The requests racing for one answer, each streamed in its own thread.
+
+    The first request sending a chunk streams to `on_update`, the first one with a complete
+    answer wins, and once the call returns the others are dropped at their next chunk. Updates
+    are sent under the lock, so none arrives after `finish`.
+    """
+    def __init__(self, on_update, parse_parameters):
+        self.on_update = on_update
+        self.parse_parameters = parse_parameters
+        self.condition = threading.Condition()
+        self.attempts = []
+        self.leader = None
+        self.winner = None
+        self.finished = False
+
+    def all_done(self):
+        return all(_.done for _ in self.attempts)
+
+    def launch(self, backend, image, prompt):
+        attempt = _Attempt()
+        self.attempts.append(attempt)
+        threading.Thread(target=self._run, args=(attempt, backend, image, prompt), daemon=True).start()
+
+    def finish(self):
+        with self.condition:
+            self.finished = True
+
+    def _run(self, attempt, backend, image, prompt):
+        feedback = None
+        try:
+            # Make the API call with the image and prompt
+            if self.on_update is None:
+                attempt.parser.feed(backend.generate(image, prompt))
+            else:
+                for chunk in backend.generate_stream(image, prompt):
+                    with self.condition:
+                        if self.finished:
+                            return
+                        if self.leader is None:
+                            self.leader = attempt
+                    new_fields = attempt.parser.feed(chunk)
+                    partial_feedback = attempt.parser.partial('improvement_suggestions')
+                    if attempt is self.leader and (new_fields or partial_feedback != feedback):
+                        feedback = partial_feedback
+                        # checked again under the lock, no update is shown after the call returned
+                        with self.condition:
+                            if self.finished:
+                                return
+                            self.on_update(feedback or '', self.parse_parameters(attempt.parser.fields))
+                    if attempt.parser.complete:
+                        break
+            attempt.parser.result()  # only a valid answer can win
+        except Exception as e:
+            attempt.error = e
+        with self.condition:
+            attempt.done = True
+            if attempt.error is None and self.winner is None:
+                self.winner = attempt
+            self.condition.notify_all()
+
+
+class Analyzer:
+    """
+    The interface of the image analysis backends.
+
+    A backend generates the text answering the image and the prompt, `api_call` builds the
+    prompt, parses the answer and handles its errors the same way for every backend.
+    """
+    hedge_percentile = AI_HEDGE_PERCENTILE
+
+    def __init__(self):
+        """Initialize the analyzer with the temporary directory holding the rendered image."""
         self.temp_dir = generate_temp_dir()  # Create a temporary directory for image processing
-        self.api_key = os.getenv("GOOGLE_AI_STUDIO_API_KEY")  # Retrieve API key from environment variables
+        self.latency = LatencyTracker()  # Seconds until the complete answer of the answered calls
+        self.stats = {'calls': 0, 'hedged': 0, 'hedge_wins': 0, 'timeouts': 0}
+        self._stats_lock = threading.Lock()  # calls of several sessions count at the same time
 
-        # Raise an exception if the API key is missing
-        if not self.api_key:
-            raise ValueError("Missing GOOGLE_AI_STUDIO_API_KEY in environment variables")
+    def generate(self, image: Image.Image, prompt: str) -> str:
+        """Return the whole answer of the backend to the image and the prompt."""
+        raise NotImplementedError
 
-        # Initialize the API client
-        self.client = genai.Client(api_key=self.api_key)
+    def generate_stream(self, image: Image.Image, prompt: str):
+        """Yield the answer of the backend chunk by chunk, in one chunk unless the backend streams."""
+        yield self.generate(image, prompt)
 
-    def _prepare_image(self, image_name='temp.tif') -> str:
-        """Convert TIFF image to JPEG format for analysis and return the JPEG path."""
-        tiff_path = os.path.join(self.temp_dir, image_name)  # Path to the TIFF image
-        jpeg_path = os.path.join(self.temp_dir, 'temp.jpeg')  # Path for the converted JPEG image
+    def _prepare_image(self, image_name='temp.tif', directory=None) -> str:
+        """
+        Convert TIFF image to JPEG format for analysis and return the JPEG path.
+
+        The JPEG is written next to the TIFF, in `directory` or the temporary directory by default,
+        so every web session converts its own frame.
+        """
+        directory = self.temp_dir if directory is None else directory
+        tiff_path = os.path.join(directory, image_name)  # Path to the TIFF image
+        jpeg_path = os.path.join(directory, 'temp.jpeg')  # Path for the converted JPEG image
 
-        # Convert and save the TIFF image as JPEG
-        Image.open(tiff_path).save(jpeg_path)
+        # Convert and save the TIFF image as JPEG, replaced at once so a concurrent call never reads half a file
+        temp_path = f'{jpeg_path}.{threading.get_ident()}.tmp'
+        with Image.open(tiff_path) as image:
+            image.save(temp_path, format='JPEG')
+        os.replace(temp_path, jpeg_path)
         return jpeg_path
 
-    def api_call(self, prompt: str, parameters: Parameter):
+    @staticmethod
+    def _parse_parameters(response_json, parameters):
+        """Create a Parameter from the adjustments of a response, keeping the current values of missing ones."""
+        return Parameter(
+            exposure=response_json.get('exposure_adjustment', parameters.exposure),
+            contrast=response_json.get('contrast_adjustment', parameters.contrast),
+            highlights=response_json.get('highlight_adjustment', parameters.highlights),
+            shadows=response_json.get('shadows_adjustment', parameters.shadows),
+            black_levels=response_json.get('black_levels_adjustment', parameters.black_levels)
+        )
+
+    def hedge_delay(self):
+        """
+        Return the seconds after which a request without an answer is hedged, None if hedging is off.
+
+        It is the `AI_HEDGE_PERCENTILE` of the recent latencies, or `AI_HEDGE_DELAY` until
+        `AI_HEDGE_MIN_SAMPLES` latencies were measured.
+        """
+        if self.hedge_percentile is None:
+            return None
+        if self.latency.count() < AI_HEDGE_MIN_SAMPLES:
+            return AI_HEDGE_DELAY
+        return self.latency.percentile(self.hedge_percentile)
+
+    def hedge_backend(self):
+        """Return the analyzer sending the hedged request, the same one unless a backend has a faster fallback."""
+        return self
+
+    def _count(self, name: str):
+        """Increment one of the `stats` counters."""
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def metrics(self) -> dict:
+        """Return the p50, p95 and p99 latencies in seconds of the answered calls and the counts of `stats`."""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {
+            'p50': self.latency.percentile(50),
+            'p95': self.latency.percentile(95),
+            'p99': self.latency.percentile(99),
+            **stats
+        }
+
+    def api_call(self, prompt: str, parameters: Parameter, suggestion: Parameter = None, on_update=None,
+                 deadline: float = AI_DEADLINE, directory: str = None):
         """
         Make an API call with the given prompt and image parameters.
 
         Args:
             prompt (str): The prompt describing the desired image analysis.
             parameters (Parameter): The current image parameters.
+            suggestion (Parameter, optional): The parameters proposed by the local auto-tone, sent as a starting point.
+            on_update (callable, optional): If given, the response is streamed, and this is called with the
+                feedback so far and the parameters with every adjustment received so far, whenever either changes.
+            deadline (float, optional): The seconds after which the call gives up and returns the suggestion
+                instead, marked with 'fallback', or fails without one. None waits as long as the backend.
+            directory (str, optional): The folder holding the rendered frame, e.g. of a web session. Defaults
+                to the temporary directory.
+
+        If no answer arrived after `hedge_delay`, a second request is raised to `hedge_backend`, and
+        the first complete answer is used. Only one of the requests streams to `on_update`.
 
         Returns:
             dict: Contains success status, feedback, and updated parameters.
         """
         # Prepare the image for API submission
-        image_path = self._prepare_image()
-        image = Image.open(image_path)
+        image_path = self._prepare_image(directory=directory)
+        with Image.open(image_path) as image:
+            # decoded once and the file closed, the racing requests only read the pixels
+            image.load()
 
         # Generate the structured prompt
-        structured_prompt = _generate_prompt(prompt, parameters)
+        structured_prompt = _generate_prompt(prompt, parameters, suggestion)
 
-        # Generate response
-        try:
-            # Make the API call with the image and prompt
-            response = self.client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=[image, structured_prompt]
-            )
-        except httpx.ConnectError:  # Handle connection error
+        # Generate response, hedged and bounded by the deadline
+        request = _HedgedRequest(on_update, lambda fields: self._parse_parameters(fields, parameters))
+        started = time.monotonic()
+        request.launch(self, image, structured_prompt)
+        hedge_delay = self.hedge_delay()
+        hedge_at = None if hedge_delay is None else started + hedge_delay
+        end = None if deadline is None else started + deadline
+        while True:
+            with request.condition:
+                if request.winner is not None or request.all_done():
+                    break
+                now = time.monotonic()
+                if end is not None and now >= end:
+                    break
+                if hedge_at is not None and now >= hedge_at:
+                    # no answer by the usual latency, race a second request, likely on a faster model
+                    hedge_at = None
+                    self._count('hedged')
+                    request.launch(self.hedge_backend(), image, structured_prompt)
+                    continue
+                limits = [_ for _ in (hedge_at, end) if _ is not None]
+                request.condition.wait(min(limits) - now if limits else None)
+        request.finish()
+        self._count('calls')
+
+        if request.winner is None and not request.all_done():
+            self._count('timeouts')
+            if suggestion is not None:
+                # the histogram auto-tone is better than nothing
+                return {
+                    'success': 1,
+                    'feedback': 'The analysis took too long, the local auto-tone was applied instead.',
+                    'new_parameters': suggestion,
+                    'fallback': True
+                }
             return {
                 'success': 0,
-                'feedback': 'API call failed. No internet connection'
+                'feedback': 'API call failed. No response before the deadline'
             }
-
-        # Clean up the API response
-        response_text = response.text.removeprefix('```json\n').removesuffix('\n```')
+        if request.winner is not None:
+            self.latency.record(time.monotonic() - started)
+            if request.winner is not request.attempts[0]:
+                self._count('hedge_wins')
+            parser = request.winner.parser
+        else:
+            # every request ended without a complete answer, report the first one
+            attempt = request.attempts[0]
+            if isinstance(attempt.error, httpx.ConnectError):  # Handle connection error
+                return {
+                    'success': 0,
+                    'feedback': 'API call failed. No internet connection'
+                }
+            if isinstance(attempt.error, httpx.HTTPError):  # Handle an error response or a timeout
+                return {
+                    'success': 0,
+                    'feedback': f'API call failed. {attempt.error}'
+                }
+            if attempt.error is not None and not isinstance(attempt.error, json.decoder.JSONDecodeError):
+                raise attempt.error
+            parser = attempt.parser
 
         # Parse the response as JSON
         try:
-            response_json = json.loads(response_text)
+            response_json = parser.result()
         except json.decoder.JSONDecodeError:  # Handle invalid JSON response
             return {
                 'success': 0,
                 'feedback': 'API response is not valid JSON. Please try again.'
             }
 
-        # Create a new Parameter object with updated values
-        new_parameters = Parameter(
-            exposure=response_json.get('exposure_adjustment', parameters.exposure),
-            contrast=response_json.get('contrast_adjustment', parameters.contrast),
-            highlights=response_json.get('highlight_adjustment', parameters.highlights),
-            shadows=response_json.get('shadows_adjustment', parameters.shadows),
-            black_levels=response_json.get('black_levels_adjustment', parameters.black_levels)
-        )
-
         # Return the final result with success status, feedback, and new parameters
         return {
             'success': 1,
             'feedback': response_json.get('improvement_suggestions', ''),
-            'new_parameters': new_parameters
+            'new_parameters': self._parse_parameters(response_json, parameters)
         }
+
+
+class ImageAnalyzer(Analyzer):
+    """Analyzes images with Gemini through Google AI Studio."""
+    model = "gemini-2.0-flash"
+
+    def __init__(self):
+        """Initialize the ImageAnalyzer with API key and temporary directory."""
+        load_dotenv()  # Load environment variables from .env file
+        super().__init__()
+        self.api_key = os.getenv("GOOGLE_AI_STUDIO_API_KEY")  # Retrieve API key from environment variables
+
+        # Raise an exception if the API key is missing
+        if not self.api_key:
+            raise ValueError("Missing GOOGLE_AI_STUDIO_API_KEY in environment variables")
+
+        # Initialize the API client
+        self.client = genai.Client(api_key=self.api_key)
+
+    def hedge_backend(self):
+        if AI_HEDGE_MODEL is None:
+            return self
+        hedge = copy.copy(self)
+        hedge.model = AI_HEDGE_MODEL
+        return hedge
+
+    def generate(self, image, prompt):
+        response = self.client.models.generate_content(model=self.model, contents=[image, prompt])
+        return response.text
+
+    def generate_stream(self, image, prompt):
+        for chunk in self.client.models.generate_content_stream(model=self.model, contents=[image, prompt]):
+            yield chunk.text or ''
+
+
+class StubAnalyzer(Analyzer):
+    """Answers with `stub_response` in small chunks, so the AI path runs offline and deterministically."""
+    chunk_size = 16
+
+    def generate(self, image, prompt):
+        return stub_response(prompt)
+
+    def generate_stream(self, image, prompt):
+        text = stub_response(prompt)
+        for start in range(0, len(text), self.chunk_size):
+            yield text[start:start + self.chunk_size]
+
+
+class HttpAnalyzer(Analyzer):
+    """
+    Sends the image and the prompt to an analysis server over HTTP, e.g. the stand-in server of
+    fake_analyzer.py, which answers like the model with a configurable latency and error rate.
+    """
+    def __init__(self, url: str = AI_SERVICE_URL, timeout: float = 60.0):
+        """
+        Initialize the analyzer.
+
+        Args:
+            url (str): The base URL of the server, requests are sent to its /generate endpoint.
+            timeout (float): The seconds to wait for the connection and for every chunk of the answer.
+        """
+        super().__init__()
+        self.url = url.rstrip('/') + '/generate'
+        self.timeout = timeout
+
+    @staticmethod
+    def _request(image, prompt):
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, format='JPEG')
+        return {'prompt': prompt, 'image': base64.b64encode(buffer.getvalue()).decode()}
+
+    def generate(self, image, prompt):
+        response = httpx.post(self.url, json=self._request(image, prompt), timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def generate_stream(self, image, prompt):
+        with httpx.stream('POST', self.url, json=self._request(image, prompt), timeout=self.timeout) as response:
+            response.raise_for_status()
+            yield from response.iter_text()
+
+
+ANALYZERS = {
+    'gemini': ImageAnalyzer,
+    'stub': StubAnalyzer,
+    'http': HttpAnalyzer,
+}
+
+
+def create_analyzer(backend: str = AI_BACKEND) -> Analyzer:
+    """
+    Create the analyzer of a backend.
+
+    Args:
+        backend (str): One of the keys of `ANALYZERS`, see `AI_BACKEND`.
+
+    Returns:
+        Analyzer: The analyzer, the Gemini one raises a ValueError if the API key is missing.
+    """
+    if backend not in ANALYZERS:
+        raise ValueError(f'Unknown AI backend: {backend}')
+    return ANALYZERS[backend]()
@@ -0,0 +1,92 @@
+import numpy as np
+
+from ImageProcessing import Parameter, RawImage
+
+# Rec. 709 weights of the luminance
+LUMINANCE_WEIGHTS = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+# Range in stops of the log2 luminance histogram and its number of bins, 1/32 stop each
+HISTOGRAM_RANGE = (-16.0, 4.0)
+HISTOGRAM_BINS = 640
+# Rendered value the median luminance is exposed to, the pivot of the contrast adjustment
+MIDDLE = RawImage.CONTRAST_PIVOT
+# Distance between the 25th and the 75th percentile of the rendered luminance aimed at by the contrast
+TARGET_SPREAD = 0.5
+# Rendered value of the 99th percentile above which highlights are recovered, fully at HIGHLIGHT_CLIP
+HIGHLIGHT_KNEE = 0.9
+HIGHLIGHT_CLIP = 1.5
+# Rendered value of the 5th percentile below which shadows are lifted, by at most MAX_SHADOWS
+SHADOW_KNEE = 0.04
+MAX_SHADOWS = 50
+# Rendered value the 1st percentile is pulled down to when the blacks are washed out, by at most MAX_BLACK_LEVELS
+BLACK_POINT = 0.02
+MAX_BLACK_LEVELS = 50
+
+
+def luminance_histogram(linear):
+    """
+    Counts the log2 luminance of a linear image in `HISTOGRAM_BINS` bins.
+
+    Every statistic of `auto_tone` is read from this histogram, and an exposure change only
+    shifts it, so the image is read once.
+
+    :param linear: The linear RGB image, a float array, or a uint16 array as returned by `RawImage.decode`.
+    :return: The counts of the bins as an int64 array.
+    """
+    if linear.dtype == np.uint16:
+        linear = linear.astype(np.float32) / 65535.0
+    luminance = linear.reshape(-1, 3) @ LUMINANCE_WEIGHTS
+    low, high = HISTOGRAM_RANGE
+    stops = np.log2(np.maximum(luminance, 2 ** low))
+    bins = ((stops - low) * (HISTOGRAM_BINS / (high - low))).astype(np.int64)
+    return np.bincount(np.clip(bins, 0, HISTOGRAM_BINS - 1), minlength=HISTOGRAM_BINS)
+
+
+def percentiles(histogram, fractions):
+    """
+    Reads percentiles of the log2 luminance from a histogram.
+
+    :param histogram: The histogram returned by `luminance_histogram`.
+    :param fractions: The fractions of the pixels, e.g. [0.5] for the median.
+    :return: An array of the log2 luminance below which each fraction of the pixels lies.
+    """
+    cumulative = np.cumsum(histogram)
+    indices = np.searchsorted(cumulative, np.asarray(fractions) * cumulative[-1])
+    low, high = HISTOGRAM_RANGE
+    return low + (indices + 0.5) * ((high - low) / HISTOGRAM_BINS)
+
+
+def auto_tone(linear):
+    """
+    Proposes the parameters of an image from the histogram of its linear luminance, without any network call.
+
+    The median is exposed to `MIDDLE`, the contrast stretches or compresses the midtones to
+    `TARGET_SPREAD`, highlights are recovered when the brightest percent is clipped, shadows are
+    lifted when the darkest pixels are crushed, and washed out blacks are pulled down.
+
+    A small linear image is enough and much faster, e.g. the tone plane of `RawImage.tone_plane`
+    or the proxy of a thumbnail, so the whole library can be toned in a batch.
+
+    :param linear: The linear RGB image, see `luminance_histogram`.
+    :return: The proposed Parameter, rounded like the sliders of the edit view.
+    """
+    p01, p05, p25, p50, p75, p99 = percentiles(luminance_histogram(linear), [0.01, 0.05, 0.25, 0.5, 0.75, 0.99])
+    exposure = float(np.clip(np.log2(MIDDLE) - p50, -5, 5))
+    v01, v05, v25, v75, v99 = 2 ** (np.array([p01, p05, p25, p75, p99]) + exposure)
+
+    contrast = np.clip(800 * (TARGET_SPREAD / max(v75 - v25, 1e-6) - 1), -100, 100)
+    highlights = np.clip(100 * (v99 - HIGHLIGHT_KNEE) / (HIGHLIGHT_CLIP - HIGHLIGHT_KNEE), 0, 100)
+    shadows = np.clip(MAX_SHADOWS * (SHADOW_KNEE - v05) / SHADOW_KNEE, 0, MAX_SHADOWS)
+    # after the contrast, black levels map x to x * (1 - k) + k with k = black_levels / 200, solved for v01 -> BLACK_POINT
+    v01 = MIDDLE + (v01 - MIDDLE) * (round(contrast) / 800 + 1)
+    black_levels = np.clip(200 * (BLACK_POINT - v01) / max(1 - v01, 1e-6), -MAX_BLACK_LEVELS, 0)
+    # black levels move the median too, the exposure moves it back to MIDDLE
+    k = round(black_levels) / 200
+    median = MIDDLE + ((MIDDLE - k) / (1 - k) - MIDDLE) / (round(contrast) / 800 + 1)
+    exposure = float(np.clip(exposure + np.log2(median / MIDDLE), -5, 5))
+    return Parameter(
+        exposure=round(exposure, 2),
+        contrast=int(round(contrast)),
+        highlights=int(round(highlights)),
+        shadows=int(round(shadows)),
+        black_levels=int(round(black_levels))
+    )
@@ -0,0 +1,250 @@
+import json
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# The kernels of the render pipeline which have interchangeable implementations:
+#   affine(image, scale, offset) -> image * scale + offset, e.g. exposure, contrast and black levels
+#   srgb_gamma(image) -> the sRGB transfer function applied to a linear image
+#   box_blur(image, ksize) -> a 2D image blurred with a ksize x ksize box, borders reflected like cv2.blur
+KERNELS = ('affine', 'srgb_gamma', 'box_blur')
+# The kernels used until a selection is made, the implementations the pipeline always had
+DEFAULT_SELECTION = {'affine': 'numpy', 'srgb_gamma': 'numpy', 'box_blur': 'cv2'}
+# Key of the CONFIG table where the selection made by `auto_select` is stored
+CONFIG_KEY = 'compute_backends'
+
+
+def _affine_numpy(image, scale, offset):
+    return image * scale + offset
+
+
+def _srgb_gamma_numpy(image):
+    mask = image <= 0.0031308
+    corrected = np.empty_like(image)
+    corrected[mask] = 12.92 * image[mask]
+    corrected[~mask] = 1.055 * (image[~mask] ** (1 / 2.4)) - 0.055
+    return corrected
+
+
+def _box_blur_numpy(image, ksize):
+    before = ksize // 2
+    padded = np.pad(image, ((before, ksize - 1 - before), (before, ksize - 1 - before)), mode='reflect')
+    # box sums from a summed-area table, accumulated in float64 to keep the error of large images small
+    table = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1))
+    np.cumsum(np.cumsum(padded, axis=0, dtype=np.float64), axis=1, out=table[1:, 1:])
+    height, width = image.shape
+    sums = (table[ksize:ksize + height, ksize:ksize + width] - table[:height, ksize:ksize + width]
+            - table[ksize:ksize + height, :width] + table[:height, :width])
+    return (sums / (ksize * ksize)).astype(image.dtype)
+
+
+def _affine_cv2(image, scale, offset):
+    return cv2.addWeighted(image, scale, image, 0, offset)
+
+
+def _srgb_gamma_cv2(image):
+    return np.where(image <= 0.0031308, image * 12.92, cv2.pow(image, 1 / 2.4) * 1.055 - 0.055)
+
+
+def _box_blur_cv2(image, ksize):
+    return cv2.blur(image, ksize=(ksize, ksize))
+
+
+BACKENDS = {
+    'numpy': {'affine': _affine_numpy, 'srgb_gamma': _srgb_gamma_numpy, 'box_blur': _box_blur_numpy},
+    'cv2': {'affine': _affine_cv2, 'srgb_gamma': _srgb_gamma_cv2, 'box_blur': _box_blur_cv2},
+}
+
+if numexpr is not None:
+    def _affine_numexpr(image, scale, offset):
+        return numexpr.evaluate('image * scale + offset').astype(image.dtype, copy=False)
+
+    def _srgb_gamma_numexpr(image):
+        return numexpr.evaluate(
+            'where(image <= 0.0031308, image * 12.92, 1.055 * image ** (1 / 2.4) - 0.055)'
+        ).astype(image.dtype, copy=False)
+
+    # numexpr only evaluates element-wise expressions, the box blur is left to the other backends
+    BACKENDS['numexpr'] = {'affine': _affine_numexpr, 'srgb_gamma': _srgb_gamma_numexpr}
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _affine_loop(flat, scale, offset, out):
+        for i in numba.prange(flat.size):
+            out[i] = flat[i] * scale + offset
+
+    @numba.njit(parallel=True, cache=True)
+    def _srgb_gamma_loop(flat, out):
+        for i in numba.prange(flat.size):
+            value = flat[i]
+            if value <= 0.0031308:
+                out[i] = 12.92 * value
+            else:
+                out[i] = 1.055 * value ** (1 / 2.4) - 0.055
+
+    @numba.njit(cache=True)
+    def _reflect(index, size):
+        # mirrors an index outside [0, size) without repeating the border pixel, like BORDER_REFLECT_101
+        if size == 1:
+            return 0
+        while index < 0 or index >= size:
+            index = -index if index < 0 else 2 * size - 2 - index
+        return index
+
+    @numba.njit(parallel=True, cache=True)
+    def _box_blur_loop(image, ksize, out):
+        height, width = image.shape
+        before = ksize // 2
+        rows = np.empty((height, width), dtype=np.float64)
+        for y in numba.prange(height):
+            for x in range(width):
+                total = 0.0
+                for k in range(-before, ksize - before):
+                    total += image[y, _reflect(x + k, width)]
+                rows[y, x] = total
+        for y in numba.prange(height):
+            for x in range(width):
+                total = 0.0
+                for k in range(-before, ksize - before):
+                    total += rows[_reflect(y + k, height), x]
+                out[y, x] = total / (ksize * ksize)
+
+    def _affine_numba(image, scale, offset):
+        image = np.ascontiguousarray(image)
+        out = np.empty_like(image)
+        _affine_loop(image.reshape(-1), image.dtype.type(scale), image.dtype.type(offset), out.reshape(-1))
+        return out
+
+    def _srgb_gamma_numba(image):
+        image = np.ascontiguousarray(image)
+        out = np.empty_like(image)
+        _srgb_gamma_loop(image.reshape(-1), out.reshape(-1))
+        return out
+
+    def _box_blur_numba(image, ksize):
+        out = np.empty_like(image)
+        _box_blur_loop(np.ascontiguousarray(image), ksize, out)
+        return out
+
+    BACKENDS['numba'] = {'affine': _affine_numba, 'srgb_gamma': _srgb_gamma_numba, 'box_blur': _box_blur_numba}
+
+# kernel -> name of the backend it runs on
+_selection = dict(DEFAULT_SELECTION)
+
+
+def kernel(name):
+    """
+    Returns the implementation of a kernel on the selected backend.
+
+    :param name: One of `KERNELS`.
+    :return: The kernel function.
+    """
+    return BACKENDS[_selection[name]][name]
+
+
+def selection():
+    """
+    Returns the backend selected for each kernel.
+
+    :return: A dictionary mapping each kernel to a backend name.
+    """
+    return dict(_selection)
+
+
+def select(choices):
+    """
+    Selects the backends of kernels. Backends which are not installed or lack the kernel are ignored.
+
+    :param choices: A dictionary mapping kernel names to backend names, or a backend name for all kernels.
+    :return: The resulting selection, see `selection`.
+    """
+    if isinstance(choices, str):
+        choices = {_: choices for _ in KERNELS}
+    for name, backend in choices.items():
+        if name in _selection and name in BACKENDS.get(backend, {}):
+            _selection[name] = backend
+    return selection()
+
+
+def _inputs(name, size):
+    """
+    Returns the arguments a kernel is benchmarked with, a size x size image like the render pipeline uses.
+    """
+    image = np.random.default_rng(0).random((size, size, 3), dtype=np.float32)
+    if name == 'affine':
+        return image, 1.5, 0.1
+    if name == 'srgb_gamma':
+        return (image,)
+    return image[..., 0] * 255, 5
+
+
+def benchmark(size=512, repeat=3):
+    """
+    Times every installed implementation of every kernel.
+
+    Each implementation is called once to warm up (e.g. to compile the numba kernels) and its
+    result is checked against the numpy implementation, so one that does not match is left out.
+
+    :param size: The side in pixels of the square test image.
+    :param repeat: The number of timed calls, the fastest one counts.
+    :return: A dictionary mapping each kernel to a dictionary of backend name -> seconds.
+    """
+    timings = {}
+    for name in KERNELS:
+        args = _inputs(name, size)
+        reference = BACKENDS['numpy'][name](*args)
+        timings[name] = {}
+        for backend, kernels in BACKENDS.items():
+            if name not in kernels:
+                continue
+            try:
+                if not np.allclose(kernels[name](*args), reference, rtol=1e-3, atol=1e-3):
+                    continue
+            except Exception:  # e.g. a numba kernel which fails to compile on this host
+                continue
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                kernels[name](*args)
+                best = min(best, time.perf_counter() - start)
+            timings[name][backend] = best
+    return timings
+
+
+def auto_select(database, backend='auto'):
+    """
+    Selects the backend of every kernel, benchmarking the installed backends once per host.
+
+    The choice is stored in the CONFIG table and reused at the next start, unless it names a
+    backend which is no longer installed or a kernel was added, then the benchmark runs again.
+
+    :param database: The Database holding the CONFIG table.
+    :param backend: 'auto', or the name of a backend used for every kernel it implements.
+    :return: The resulting selection, see `selection`.
+    """
+    if backend != 'auto':
+        return select(backend)
+    stored = database.get_config(CONFIG_KEY)
+    if stored:
+        try:
+            choices = json.loads(stored[0][0])
+        except (TypeError, ValueError):
+            choices = {}
+        if all(name in BACKENDS.get(choices.get(name), {}) for name in KERNELS):
+            return select(choices)
+    timings = benchmark()
+    choices = {name: min(times, key=times.get) for name, times in timings.items() if times}
+    database.set_config(CONFIG_KEY, json.dumps(choices))
+    return select(choices)
@@ -28,4 +28,109 @@ EXPORT_EXTENSIONS = [
     '.jpeg', 'jpg',
     '.png',
     '.tiff', 'tif'
-]
\ No newline at end of file
+]
+
+# Thumbnail sizes (long edge in pixels) kept in the thumbnail store
+THUMBNAIL_SIZES = [100, 200, 400]
+LIBRARY_THUMBNAIL_SIZE = 200
+# Long edge in pixels of the linear proxy kept per image, edited thumbnails are rendered from it
+THUMBNAIL_PROXY_LONG_EDGE = 400
+# Seconds after the last edit of an image before its thumbnails are rendered again
+THUMBNAIL_RENDER_DELAY = 2.0
+
+# Confirm duplicates found by the quick content fingerprint with a hash of the whole file
+DEDUP_FULL_HASH = False
+
+# Long edge in pixels of the downscaled linear proxy used for fast previews
+PROXY_LONG_EDGE = 1280
+
+# Long edge in pixels of the downscaled image the shadow and highlight tone maps are computed on
+TONE_MAP_LONG_EDGE = 512
+
+# Backend of the pixel kernels: 'auto' benchmarks the installed backends once and picks the fastest
+# per kernel, or one of 'numpy', 'numexpr', 'numba' and 'cv2' for every kernel it implements
+COMPUTE_BACKEND = 'auto'
+
+# Where preview frames are rendered: 'thread' (the render thread) or 'process' (a pool of worker processes)
+RENDER_BACKEND = 'thread'
+RENDER_PROCESSES = 2
+# Number of images the worker processes keep in shared memory, one per session editing at the same time
+RENDER_SHARED_IMAGES = 4
+
+# Run as a web server where every browser session edits on its own render thread, instead of a desktop window
+SERVER_MODE = False
+SERVER_PORT = 8550
+# Maximum number of frames rendered and raw files decoded at the same time by all sessions, 0 for one per CPU core
+RENDER_WORKERS = 0
+
+# Local HTTP render service: its port, the decoded images it keeps for repeated requests, and the
+# number of encoded previews it caches
+RENDER_SERVICE_PORT = 8551
+RENDER_SERVICE_IMAGES = 4
+RENDER_SERVICE_PREVIEWS = 64
+
+# Maximum number of preview frames per second sent to the window, 0 for no limit
+MAX_DISPLAY_FPS = 30
+# How preview frames reach the window: 'file' (the client loads a versioned frame file) or 'base64' (sent inline)
+FRAME_DELIVERY = 'file'
+
+# Neighbouring library images decoded ahead of time in the edit view, and the memory they may use
+PREFETCH_AHEAD = 2
+PREFETCH_BEHIND = 1
+PREFETCH_MEMORY_MB = 1024
+
+# Rows rendered at a time when exporting, bounds the memory used by the render pipeline
+EXPORT_STRIP_ROWS = 256
+
+# Maximum number of queued write operations the database writer thread commits in one transaction
+DB_WRITE_BATCH_SIZE = 64
+
+# Background jobs running at once, and the classes of jobs: (priority, lower runs first, and the number of
+# jobs of the class running at once)
+JOB_WORKERS = 2
+JOB_CLASSES = {'thumbnail': (0, 2), 'edit': (1, 1), 'metadata': (2, 1), 'export': (3, 1)}
+# Attempts of a failing job before it is kept as failed, retried after JOB_RETRY_DELAY seconds, doubled every time
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 1.0
+# Days a failed job is kept with its error before it is deleted at the next start
+JOB_FAILED_KEEP_DAYS = 7
+
+# Backend of the AI image analysis: 'gemini' (Google AI Studio), 'stub' (a deterministic local answer without
+# any network call) or 'http' (the stand-in server of fake_analyzer.py at AI_SERVICE_URL)
+AI_BACKEND = 'gemini'
+AI_SERVICE_URL = 'http://127.0.0.1:8552'
+# Stand-in analysis server: its port, the seconds before the first chunk of an answer, the mean seconds of an
+# exponentially distributed jitter added to them, the seconds between chunks, and the fraction of failing requests
+FAKE_AI_PORT = 8552
+FAKE_AI_LATENCY = 1.0
+FAKE_AI_JITTER = 0.5
+FAKE_AI_CHUNK_DELAY = 0.05
+FAKE_AI_ERROR_RATE = 0.0
+# Seconds after which an AI analysis falls back to the local auto-tone, None to wait as long as the service
+AI_DEADLINE = 30.0
+# A request without an answer after this percentile of the recent latencies is raised again, to AI_HEDGE_MODEL
+# if set, and the first answer is used. None turns hedging off. Until AI_HEDGE_MIN_SAMPLES latencies were
+# measured, requests are hedged after AI_HEDGE_DELAY seconds. AI_LATENCY_SAMPLES latencies are kept.
+AI_HEDGE_PERCENTILE = 95
+AI_HEDGE_MODEL = 'gemini-2.0-flash-lite'
+AI_HEDGE_DELAY = 10.0
+AI_HEDGE_MIN_SAMPLES = 20
+AI_LATENCY_SAMPLES = 200
+
+# Variations of the edited parameters previewed in a strip next to the edit view: the name of each and the
+# changes added to the parameters, and the long edge in pixels of the previews
+PRESETS = [
+    ('+1 EV', {'exposure': 1}),
+    ('-1 EV', {'exposure': -1}),
+    ('High contrast', {'contrast': 50}),
+    ('Low contrast', {'contrast': -50}),
+    ('Lift shadows', {'shadows': 50}),
+    ('Recover highlights', {'highlights': 50}),
+    ('Balanced', {'shadows': 30, 'highlights': 30}),
+    ('Deep blacks', {'black_levels': -30}),
+    ('Matte', {'contrast': -30, 'black_levels': 30}),
+    ('Bright', {'exposure': 0.7, 'contrast': -20, 'shadows': 30}),
+    ('Moody', {'exposure': -0.7, 'contrast': 40, 'black_levels': -20}),
+    ('Punchy', {'contrast': 60, 'highlights': 20, 'shadows': 20}),
+]
+PRESET_LONG_EDGE = 160
@@ -1,14 +1,187 @@
 import os
+import queue
+import re
 import sqlite3
+import threading
+from concurrent.futures import Future
+from config import DB_WRITE_BATCH_SIZE, DEDUP_FULL_HASH
 from directory_management import generate_persist_dir
+from fingerprint import full_hash, quick_hash
+from metadata import METADATA_COLUMNS, read_metadata
+
+# Columns of the editing parameters, in the order of the `Parameter` constructor
+PARAMETER_COLUMNS = ['exposure', 'contrast', 'highlights', 'shadows', 'black_levels']
+_EDITED = 'exposure != 0 OR contrast != 0 OR highlights != 0 OR shadows != 0 OR black_levels != 0'
+
+# Schema migrations applied in order on top of the tables created in `Database._initialize`.
+# Each migration is a list of SQL statements run in one transaction; the number of applied
+# migrations is kept in `PRAGMA user_version`.
+MIGRATIONS = [
+    # 1: metadata catalog, indexed for sorting and filtering the library
+    [
+        'ALTER TABLE images ADD COLUMN capture_time TEXT',
+        'ALTER TABLE images ADD COLUMN camera_make TEXT',
+        'ALTER TABLE images ADD COLUMN camera_model TEXT',
+        'ALTER TABLE images ADD COLUMN lens TEXT',
+        'ALTER TABLE images ADD COLUMN iso INTEGER',
+        'ALTER TABLE images ADD COLUMN exposure_time REAL',
+        'ALTER TABLE images ADD COLUMN aperture REAL',
+        'ALTER TABLE images ADD COLUMN focal_length REAL',
+        'ALTER TABLE images ADD COLUMN file_size INTEGER',
+        'ALTER TABLE images ADD COLUMN edited INTEGER NOT NULL DEFAULT 0',
+        f'UPDATE images SET edited = ({_EDITED})',
+        'CREATE INDEX idx_images_capture_time ON images (capture_time)',
+        'CREATE INDEX idx_images_camera ON images (camera_make, camera_model)',
+        'CREATE INDEX idx_images_camera_model ON images (camera_model)',
+        'CREATE INDEX idx_images_lens ON images (lens)',
+        'CREATE INDEX idx_images_iso ON images (iso)',
+        'CREATE INDEX idx_images_file_size ON images (file_size)',
+        'CREATE INDEX idx_images_edited ON images (edited)',
+        f'''CREATE TRIGGER images_edited_insert AFTER INSERT ON images BEGIN
+            UPDATE images SET edited = ({_EDITED}) WHERE id = NEW.id;
+        END''',
+        f'''CREATE TRIGGER images_edited_update
+        AFTER UPDATE OF exposure, contrast, highlights, shadows, black_levels ON images BEGIN
+            UPDATE images SET edited = ({_EDITED}) WHERE id = NEW.id;
+        END''',
+    ],
+    # 2: content fingerprints for duplicate detection at import
+    [
+        'ALTER TABLE images ADD COLUMN content_hash TEXT',
+        'ALTER TABLE images ADD COLUMN full_hash TEXT',
+        'CREATE INDEX idx_images_content_hash ON images (content_hash)',
+    ],
+    # 3: watched library folders, kept in sync by comparing (path, mtime, file_size)
+    [
+        'ALTER TABLE images ADD COLUMN mtime REAL',
+        'CREATE INDEX idx_images_sync ON images (path, mtime, file_size)',
+        '''CREATE TABLE library_folders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            path TEXT UNIQUE NOT NULL
+        )''',
+        # files of library folders skipped as duplicates, so rescans do not fingerprint them again
+        '''CREATE TABLE duplicate_files (
+            path TEXT PRIMARY KEY,
+            mtime REAL,
+            file_size INTEGER,
+            duplicate_of TEXT
+        )''',
+    ],
+    # 4: persistent background jobs, see jobs.JobScheduler
+    [
+        '''CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created REAL NOT NULL
+        )''',
+        'CREATE INDEX idx_jobs_state ON jobs (state)',
+    ],
+    # 5: files of library folders deleted from the library, so syncs do not import them again
+    [
+        'CREATE TABLE excluded_files (path TEXT PRIMARY KEY)',
+    ],
+]
+
+# Library sort keys -> ORDER BY columns, all backed by an index
+SORT_COLUMNS = {
+    'id': ['id'],
+    'capture_time': ['capture_time'],
+    'camera': ['camera_make', 'camera_model'],
+    'lens': ['lens'],
+    'iso': ['iso'],
+    'file_size': ['file_size'],
+    'edited': ['edited'],
+}
+# Columns that can be filtered on by value or by (minimum, maximum) range
+FILTER_COLUMNS = ['capture_time', 'camera_make', 'camera_model', 'lens', 'iso', 'file_size', 'edited']
+
+# Statements answered by the per-thread read connections, everything else goes to the writer thread
+_READ_STATEMENTS = ('SELECT', 'EXPLAIN', 'VALUES')
+# Statements that cannot run inside a transaction
+_NO_TRANSACTION_STATEMENTS = ('VACUUM',)
+# The tokens that matter when looking for the statement behind a WITH clause
+_CTE_TOKENS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\[[^\]]*\]|`[^`]*`|--[^\n]*|/\*.*?\*/|[()]|\w+", re.S)
+_STOP = object()
+
+
+def _cte_statement(statement):
+    """
+    Find the statement that follows the common table expressions of a WITH statement.
+
+    Args:
+        statement (str): The upper-case SQL statement, starting with WITH.
+
+    Returns:
+        str: The first keyword outside the parentheses of the expressions, e.g. SELECT or INSERT.
+    """
+    depth = 0
+    for token in _CTE_TOKENS.findall(statement):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0 and token in ('SELECT', 'VALUES', 'INSERT', 'REPLACE', 'UPDATE', 'DELETE'):
+            return token
+    return ''
+
+
+def _is_read(query):
+    """
+    Check whether an SQL statement only reads, so it can run on a read connection.
+
+    Args:
+        query (str): The SQL statement.
+
+    Returns:
+        bool: True for SELECT-like statements, including those behind a WITH clause, and PRAGMA
+            queries without an assignment.
+    """
+    statement = query.lstrip().upper()
+    if statement.startswith('PRAGMA'):
+        return '=' not in statement
+    if statement.startswith('WITH'):
+        return _cte_statement(statement) in _READ_STATEMENTS
+    return statement.startswith(_READ_STATEMENTS)
+
+
+class ImportSummary:
+    """
+    The outcome of an import: the imported images, the skipped ones and the decode time
+    saved by not importing duplicates.
+    """
+    def __init__(self):
+        self.imported = []
+        self.already_imported = []  # paths that are already in the library
+        self.duplicates = []  # (path, path of the image with the same content)
+        self.skipped_decode_seconds = 0.0
+
+    def __str__(self):
+        text = f'Imported {len(self.imported)} image(s)'
+        if self.duplicates:
+            text += (f', skipped {len(self.duplicates)} duplicate(s)'
+                     f' (about {self.skipped_decode_seconds:.1f} s of decoding saved)')
+        if self.already_imported:
+            text += f', {len(self.already_imported)} already in the library'
+        return text
+
 
 class Database:
     """
-    Singleton class for managing a SQLite database connection and operations.
+    Singleton class for managing the SQLite database and its operations.
 
     This class implements a strict singleton pattern so that only one instance
     of the Database is created during the application's lifecycle. It handles
     basic CRUD operations and database schema initialization.
+
+    The database runs in WAL mode. Every thread reads through its own connection, so readers
+    never share cursor state and do not block each other or the writer. All writes go through
+    a queue to a single writer thread, which runs queued operations in batches of up to
+    `DB_WRITE_BATCH_SIZE` per transaction; a failing operation is rolled back on its own
+    without affecting the rest of the batch.
     """
     _instance = None
 
@@ -29,17 +202,18 @@ class Database:
 
     def _initialize(self):
         """
-        Initialize the database connection and schema.
+        Initialize the database connections and schema.
 
-        This method sets up the SQLite connection, creates the cursor, and
-        initializes the necessary tables (images and CONFIG) if they do not exist.
+        This method opens the write connection, switches the database to WAL mode,
+        initializes the necessary tables (images, CONFIG and thumbnails) if they do not exist,
+        applies the migrations and starts the writer thread.
         """
-        self.conn = sqlite3.connect(
-            os.path.join(generate_persist_dir(), 'images.db'),
-            check_same_thread=False
-        )
-        self.cursor = self.conn.cursor()
-        self.cursor.execute('''
+        self.path = os.path.join(generate_persist_dir(), 'images.db')
+        # only used by the writer thread once it is started
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute('''
                 CREATE TABLE IF NOT EXISTS images (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     path TEXT UNIQUE NOT NULL,
@@ -50,18 +224,159 @@ class Database:
                     black_levels INTEGER DEFAULT 0
                 )
             ''')
-        self.cursor.execute('''
+        self.conn.execute('''
                 CREATE TABLE IF NOT EXISTS CONFIG (
                     key TEXT NOT NULL PRIMARY KEY,
                     value TEXT
                 )
             ''')
-        self.conn.commit()
+        self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS thumbnails (
+                    image_id INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (image_id, size)
+                )
+            ''')
+        self._migrate()
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._readers = {}  # thread -> its read connection, closed by `close` or when the thread ended
+        self._pending = []  # futures of writes queued without waiting, checked by `commit`
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _migrate(self):
+        """
+        Apply the schema migrations that have not been applied to this database yet.
+
+        Every migration runs in its own transaction together with the update of
+        `PRAGMA user_version`, so an interrupted migration is retried on the next start.
+        """
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            script = ';\n'.join(['BEGIN', *statements, f'PRAGMA user_version = {number}', 'COMMIT'])
+            self.conn.executescript(script + ';')
+
+    def _reader(self):
+        """
+        Return the read connection of the calling thread, opening it on first use.
+
+        Returns:
+            sqlite3.Connection: A read-only connection used by this thread only.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # check_same_thread is off so that `close` can close it from another thread
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            connection.execute('PRAGMA query_only = ON')
+            self._local.connection = connection
+            with self._lock:
+                for thread in [_ for _ in self._readers if not _.is_alive()]:
+                    self._readers.pop(thread).close()
+                self._readers[threading.current_thread()] = connection
+        return connection
+
+    def _write_loop(self):
+        """
+        Run queued write operations until `close` is called.
+
+        Operations waiting in the queue are taken together and run in one transaction, each in
+        its own savepoint. Operations that cannot run in a transaction run on their own.
+        """
+        held = None
+        while True:
+            operation = held if held is not None else self._writes.get()
+            held = None
+            if operation is _STOP:
+                return
+            if not operation[2]:
+                self._run_operations([operation], transaction=False)
+                continue
+            batch = [operation]
+            while len(batch) < DB_WRITE_BATCH_SIZE:
+                try:
+                    operation = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if operation is _STOP or not operation[2]:
+                    held = operation
+                    break
+                batch.append(operation)
+            self._run_operations(batch)
+
+    def _run_operations(self, batch, transaction=True):
+        """
+        Run write operations and resolve their futures once the changes are committed.
+
+        Args:
+            batch (list): (function, future, transaction) tuples.
+            transaction (bool): Whether to run the batch in a transaction.
+        """
+        results = []
+        try:
+            if transaction:
+                self.conn.execute('BEGIN IMMEDIATE')
+            for function, future, _ in batch:
+                if transaction:
+                    self.conn.execute('SAVEPOINT operation')
+                try:
+                    results.append((future, function(self.conn.cursor()), None))
+                except Exception as error:
+                    if transaction:
+                        self.conn.execute('ROLLBACK TO operation')
+                    results.append((future, None, error))
+                if transaction:
+                    self.conn.execute('RELEASE operation')
+            if transaction:
+                self.conn.execute('COMMIT')
+        except sqlite3.Error as error:
+            if self.conn.in_transaction:
+                self.conn.execute('ROLLBACK')
+            results = [(_[1], None, error) for _ in batch]
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def write(self, function, wait=True, transaction=True):
+        """
+        Run a write operation in the writer thread.
+
+        The function gets a cursor of the write connection. Its statements are committed
+        atomically, together with other queued operations; it must not commit itself.
+
+        Args:
+            function (callable): Called with a sqlite3.Cursor, its return value is the result.
+            wait (bool): Whether to wait until the operation is committed. If False, the write
+                is queued and a Future is returned; errors are raised by the next `commit`.
+            transaction (bool): False for statements that cannot run in a transaction (VACUUM).
+
+        Returns:
+            The result of the function, or a Future of it if `wait` is False.
+        """
+        if threading.current_thread() is self._writer:
+            # called from a write operation, which already runs in the writer thread
+            return function(self.conn.cursor())
+        future = Future()
+        self._writes.put((function, future, transaction))
+        if not wait:
+            with self._lock:
+                self._pending = [_ for _ in self._pending if not _.done() or _.exception()]
+                self._pending.append(future)
+            return future
+        return future.result()
 
     def execute(self, query, replacement=None):
         """
         Execute an SQL query with optional parameter replacements.
 
+        Read queries run on the read connection of the calling thread, other statements are
+        run and committed by the writer thread.
+
         Args:
             query (str): The SQL query to be executed.
             replacement (tuple, optional): Optional tuple of parameters to safely
@@ -70,18 +385,35 @@ class Database:
         Returns:
             sqlite3.Cursor: The cursor after executing the query.
         """
-        if replacement is None:
-            return self.cursor.execute(query)
-        else:
-            return self.cursor.execute(query, replacement)
+        replacement = () if replacement is None else replacement
+        if _is_read(query):
+            return self._reader().execute(query, replacement)
+        transaction = not query.lstrip().upper().startswith(_NO_TRANSACTION_STATEMENTS)
+        return self.write(lambda cursor: cursor.execute(query, replacement), transaction=transaction)
+
+    def executemany(self, query, replacements, commit=True):
+        """
+        Execute a write statement once for every set of parameters, in one transaction.
+
+        Args:
+            query (str): The SQL statement.
+            replacements (list): A list of parameter tuples.
+            commit (bool): Whether to wait until the statements are committed.
+        """
+        replacements = list(replacements)
+        self.write(lambda cursor: cursor.executemany(query, replacements), wait=commit)
 
     def commit(self):
         """
-        Commit the current transaction to the database.
+        Wait until the writes queued without waiting are committed.
 
-        This method should be called after performing operations that modify the database.
+        Writes are committed by the writer thread; this raises the error of a queued
+        write that failed, if any.
         """
-        self.conn.commit()
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
 
     def insert(self, table, values, list_=False, dict_=False, commit=True):
         """
@@ -96,30 +428,30 @@ class Database:
             list_ (bool): If True, `values` is expected to be a list of values/dictionaries.
             dict_ (bool): If True, `values` is expected to be a dictionary (or list of dictionaries)
                           mapping column names to their respective values.
-            commit (bool): Whether to commit the transaction after inserting.
+            commit (bool): Whether to wait until the insert is committed.
 
         Returns:
-            int: The last row ID inserted.
-        """
-        if not dict_:
-            self.cursor.execute(f'INSERT INTO {table} VALUES (?)', values)
-        elif not list_ and dict_:
-            columns = ', '.join(values.keys())
-            placeholder = ', '.join(['?' for _ in range(len(values))])
-            self.cursor.execute(
-                f'INSERT INTO {table} ({columns}) VALUES ({placeholder})',
-                tuple(values.values())
-            )
-        elif list_ and dict_:
-            columns = ', '.join(values[0].keys())
-            placeholder = ', '.join(['?' for _ in range(len(values[0]))])
-            self.cursor.executemany(
-                f'INSERT INTO {table} ({columns}) VALUES ({placeholder})',
-                tuple([tuple(item.values()) for item in values])
-            )
-        if commit:
-            self.commit()
-        return self.cursor.lastrowid
+            int: The last row ID inserted, or a Future of it if `commit` is False.
+        """
+        def insert(cursor):
+            if not dict_:
+                cursor.execute(f'INSERT INTO {table} VALUES (?)', values)
+            elif not list_ and dict_:
+                columns = ', '.join(values.keys())
+                placeholder = ', '.join(['?' for _ in range(len(values))])
+                cursor.execute(
+                    f'INSERT INTO {table} ({columns}) VALUES ({placeholder})',
+                    tuple(values.values())
+                )
+            elif list_ and dict_:
+                columns = ', '.join(values[0].keys())
+                placeholder = ', '.join(['?' for _ in range(len(values[0]))])
+                cursor.executemany(
+                    f'INSERT INTO {table} ({columns}) VALUES ({placeholder})',
+                    tuple([tuple(item.values()) for item in values])
+                )
+            return cursor.lastrowid
+        return self.write(insert, wait=commit)
 
     def delete(self, table, condition, replacement=None, commit=True):
         """
@@ -129,14 +461,10 @@ class Database:
             table (str): The table name from which to delete records.
             condition (str): The SQL condition (WHERE clause) to identify which records to delete.
             replacement (tuple, optional): Optional tuple of parameters to safely replace placeholders in the condition.
-            commit (bool): Whether to commit the transaction after deletion.
+            commit (bool): Whether to wait until the deletion is committed.
         """
-        if replacement is None:
-            self.cursor.execute(f'DELETE FROM {table} WHERE {condition}')
-        else:
-            self.cursor.execute(f'DELETE FROM {table} WHERE {condition}', replacement)
-        if commit:
-            self.commit()
+        replacement = () if replacement is None else replacement
+        self.write(lambda cursor: cursor.execute(f'DELETE FROM {table} WHERE {condition}', replacement), wait=commit)
 
     def drop(self, table, commit=True):
         """
@@ -144,11 +472,9 @@ class Database:
 
         Args:
             table (str): The table name to be dropped.
-            commit (bool): Whether to commit the transaction after dropping the table.
+            commit (bool): Whether to wait until the table is dropped.
         """
-        self.cursor.execute(f'DROP TABLE {table}')
-        if commit:
-            self.commit()
+        self.write(lambda cursor: cursor.execute(f'DROP TABLE {table}'), wait=commit)
 
     def select(self, table, columns: list, condition=None, replacement=None):
         """
@@ -165,16 +491,16 @@ class Database:
         """
         if condition is not None:
             if replacement is not None:
-                return self.cursor.execute(
+                return self.execute(
                     f'SELECT {", ".join(columns)} FROM {table} WHERE {condition}',
                     replacement
                 ).fetchall()
             else:
-                return self.cursor.execute(
+                return self.execute(
                     f'SELECT {", ".join(columns)} FROM {table} WHERE {condition}'
                 ).fetchall()
         else:
-            return self.cursor.execute(
+            return self.execute(
                 f'SELECT {", ".join(columns)} FROM {table}'
             ).fetchall()
 
@@ -188,48 +514,406 @@ class Database:
             value (list): List of values corresponding to the columns.
             condition (str): SQL condition (WHERE clause) to identify which records to update.
             replacement (tuple, optional): Optional tuple of parameters to safely replace placeholders in the condition.
-            commit (bool): Whether to commit the transaction after updating.
+            commit (bool): Whether to wait until the update is committed.
         """
         set_clause = ", ".join([f"{column[i]} = {value[i]}" for i in range(len(column))])
-        if replacement is None:
-            self.cursor.execute(
-                f'UPDATE {table} SET {set_clause} WHERE {condition}'
-            )
-        else:
-            self.cursor.execute(
-                f'UPDATE {table} SET {set_clause} WHERE {condition}', replacement
-            )
-        if commit:
-            self.commit()
+        replacement = () if replacement is None else replacement
+        self.write(
+            lambda cursor: cursor.execute(f'UPDATE {table} SET {set_clause} WHERE {condition}', replacement),
+            wait=commit
+        )
 
-    def import_image(self, paths):
+    def import_image(self, paths, summary=None, verify_full_hash=DEDUP_FULL_HASH):
         """
         Import images into the database if they do not already exist.
 
-        For each path provided, the method checks if the image exists in the database.
-        If not, it inserts the new image path into the 'images' table.
+        For each path provided, the method checks if the image exists in the database, either
+        at the same path or as a copy with the same content fingerprint (see `quick_hash`).
+        If not, it reads the image metadata from the file header and inserts the new image
+        path together with its metadata and fingerprint into the 'images' table.
 
         Args:
             paths (list): A list of image paths to be imported.
+            summary (ImportSummary, optional): Filled with the imported, duplicate and already
+                imported paths and the decode time saved by skipping duplicates.
+            verify_full_hash (bool): Whether to confirm duplicates with a hash of the whole file.
 
         Returns:
             tuple or None: A tuple containing a sorted list of new image IDs and the new image paths,
                            or None if no new images were imported.
         """
+        if summary is None:
+            summary = ImportSummary()
         new_images = []
+        seen = set()
+        rows = []
+        pending = {}  # content hash -> paths imported in this call
         for path in paths:
             exist = self.select('images', ['path'], 'path = ?', (path,))
-            if not exist:
-                new_images.append(path)
+            if exist or path in seen:
+                summary.already_imported.append(path)
+                continue
+            content_hash = quick_hash(path)
+            if content_hash is not None:
+                duplicate_of = self._find_duplicate(path, content_hash, verify_full_hash, pending)
+                if duplicate_of is not None:
+                    summary.duplicates.append((path, duplicate_of))
+                    continue
+                pending.setdefault(content_hash, []).append(path)
+            new_images.append(path)
+            seen.add(path)
+            rows.append({
+                'path': path,
+                **read_metadata(path),
+                'content_hash': content_hash,
+                'full_hash': full_hash(path) if verify_full_hash and content_hash is not None else None
+            })
+        summary.imported = new_images
+        summary.skipped_decode_seconds = len(summary.duplicates) * self.average_decode_time()
         if not new_images:
             return None
-        self.insert('images', [{'path': _} for _ in new_images], list_=True, dict_=True)
-        placeholders = ', '.join('?' for _ in new_images)
-        ids = self.select('images', ['id'], f'path IN ({placeholders})', tuple(new_images))
-        ids = [_[0] for _ in ids]
+        self.insert('images', rows, list_=True, dict_=True)
+        ids = []
+        # look the IDs up in chunks to stay below SQLite's limit of bound parameters
+        for start in range(0, len(new_images), 500):
+            chunk = new_images[start:start + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            ids += [_[0] for _ in self.select('images', ['id'], f'path IN ({placeholders})', tuple(chunk))]
         ids.sort()
         return ids, new_images
 
+    def _find_duplicate(self, path, content_hash, verify_full_hash, pending):
+        """
+        Find an image with the same content as `path` in the library or in the current import.
+
+        Library images whose file no longer exists are not considered duplicates. When
+        `verify_full_hash` is set, candidates must also match the hash of the whole file;
+        missing full hashes of library images are computed and stored on the way.
+
+        Args:
+            path (str): The path of the image being imported.
+            content_hash (str): Its content fingerprint.
+            verify_full_hash (bool): Whether to confirm candidates with a full hash.
+            pending (dict): Content hash -> paths already accepted in the current import.
+
+        Returns:
+            str or None: The path of the image with the same content, or None.
+        """
+        candidates = self.select('images', ['id', 'path', 'full_hash'], 'content_hash = ?', (content_hash,))
+        candidates = [_ for _ in candidates if os.path.exists(_[1])]
+        candidates += [(None, _, None) for _ in pending.get(content_hash, [])]
+        if not candidates or not verify_full_hash:
+            return candidates[0][1] if candidates else None
+        new_full_hash = full_hash(path)
+        for image_id, candidate_path, candidate_full_hash in candidates:
+            if candidate_full_hash is None:
+                candidate_full_hash = full_hash(candidate_path)
+                if image_id is not None and candidate_full_hash is not None:
+                    self.execute('UPDATE images SET full_hash = ? WHERE id = ?', (candidate_full_hash, image_id))
+            if new_full_hash is not None and candidate_full_hash == new_full_hash:
+                return candidate_path
+        return None
+
+    def record_decode_time(self, seconds):
+        """
+        Add a measured raw decode time to the running average kept in the CONFIG table.
+
+        Args:
+            seconds (float): The time it took to decode one raw image.
+        """
+        def record(cursor):
+            # read and written in one operation of the writer thread, so concurrent measurements are not lost
+            values = dict(cursor.execute(
+                "SELECT key, value FROM config WHERE key IN ('decode_time_count', 'decode_time_average')"
+            ).fetchall())
+            count = int(values.get('decode_time_count', 0))
+            average = (float(values.get('decode_time_average', 0.0)) * count + seconds) / (count + 1)
+            cursor.executemany(
+                'INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)',
+                [('decode_time_count', count + 1), ('decode_time_average', average)]
+            )
+        self.write(record)
+
+    def average_decode_time(self):
+        """
+        Retrieve the average time it takes to decode a raw image of this library.
+
+        Returns:
+            float: The average decode time in seconds, 0 if nothing was measured yet.
+        """
+        average = self.get_config('decode_time_average')
+        return float(average[0][0]) if average else 0.0
+
+    def query_images(self, sort_by='id', descending=False, filters=None, limit=None, offset=0):
+        """
+        Retrieve the IDs of the library images in the given order, optionally filtered by metadata.
+
+        Every sort key and filter column is indexed and only IDs are returned, so the query
+        is answered from the indexes and stays fast on large libraries.
+
+        Args:
+            sort_by (str): A key of SORT_COLUMNS. Ties are ordered by image ID.
+            descending (bool): Whether to sort in descending order.
+            filters (dict, optional): Maps columns of FILTER_COLUMNS to either a value that must
+                match exactly, or a (minimum, maximum) tuple where either bound may be None.
+            limit (int, optional): The maximum number of IDs to return, for paging.
+            offset (int): The number of IDs to skip, for paging.
+
+        Returns:
+            list: A list of image IDs.
+
+        Raises:
+            ValueError: If the sort key or a filter column is unknown.
+        """
+        if sort_by not in SORT_COLUMNS:
+            raise ValueError(f'Unknown sort key: {sort_by}')
+        conditions = []
+        replacement = []
+        for column, value in (filters or {}).items():
+            if column not in FILTER_COLUMNS:
+                raise ValueError(f'Unknown filter column: {column}')
+            if isinstance(value, tuple):
+                minimum, maximum = value
+                if minimum is not None:
+                    conditions.append(f'{column} >= ?')
+                    replacement.append(minimum)
+                if maximum is not None:
+                    conditions.append(f'{column} <= ?')
+                    replacement.append(maximum)
+            else:
+                conditions.append(f'{column} = ?')
+                replacement.append(int(value) if isinstance(value, bool) else value)
+        direction = 'DESC' if descending else 'ASC'
+        order = ', '.join(f'{column} {direction}' for column in SORT_COLUMNS[sort_by] + ['id'])
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        query = f'SELECT id FROM images {where} ORDER BY {order}'
+        if limit is not None:
+            query += ' LIMIT ? OFFSET ?'
+            replacement += [limit, offset]
+        rows = self.execute(query, tuple(replacement)).fetchall()
+        return [_[0] for _ in rows]
+
+    def distinct_values(self, column):
+        """
+        Retrieve the distinct non-empty values of a filter column, e.g. to fill a filter menu.
+
+        Args:
+            column (str): A column of FILTER_COLUMNS.
+
+        Returns:
+            list: The sorted distinct values.
+        """
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f'Unknown filter column: {column}')
+        rows = self.execute(
+            f'SELECT DISTINCT {column} FROM images WHERE {column} IS NOT NULL ORDER BY {column}'
+        ).fetchall()
+        return [_[0] for _ in rows]
+
+    def backfill_metadata(self):
+        """
+        Read the metadata of images imported before the metadata catalog existed.
+
+        Only images without a stored file size or modification time are read, so this is
+        a no-op once done.
+
+        Returns:
+            int: The number of updated images.
+        """
+        rows = self.select('images', ['id', 'path'], 'file_size IS NULL OR mtime IS NULL')
+        updates = []
+        for image_id, path in rows:
+            metadata = read_metadata(path)
+            if metadata['file_size'] is not None:
+                updates.append((*[metadata[_] for _ in METADATA_COLUMNS], image_id))
+        if updates:
+            set_clause = ', '.join(f'{_} = ?' for _ in METADATA_COLUMNS)
+            self.executemany(f'UPDATE images SET {set_clause} WHERE id = ?', updates)
+        return len(updates)
+
+    def backfill_content_hash(self):
+        """
+        Compute the content fingerprint of images imported before duplicate detection existed.
+
+        Returns:
+            int: The number of updated images.
+        """
+        rows = self.select('images', ['id', 'path'], 'content_hash IS NULL')
+        updates = [(quick_hash(path), image_id) for image_id, path in rows]
+        updates = [_ for _ in updates if _[0] is not None]
+        if updates:
+            self.executemany('UPDATE images SET content_hash = ? WHERE id = ?', updates)
+        return len(updates)
+
+    def add_library_folder(self, path):
+        """
+        Register a folder whose raw files are kept in sync with the library.
+
+        Args:
+            path (str): The folder path.
+
+        Returns:
+            bool: True if the folder was added, False if it was already registered.
+        """
+        path = os.path.normpath(path)
+        if self.select('library_folders', ['id'], 'path = ?', (path,)):
+            return False
+        self.insert('library_folders', {'path': path}, dict_=True)
+        return True
+
+    def remove_library_folder(self, path):
+        """
+        Stop keeping a folder in sync. Images already imported from it stay in the library.
+
+        Args:
+            path (str): The folder path.
+        """
+        self.delete('library_folders', 'path = ?', (os.path.normpath(path),))
+
+    def library_folders(self):
+        """
+        Retrieve the registered library folders.
+
+        Returns:
+            list: The folder paths.
+        """
+        return [_[0] for _ in self.select('library_folders', ['path'])]
+
+    @staticmethod
+    def _folder_range(folder):
+        """
+        Compute the range of paths below a folder, for range queries on an indexed path column.
+
+        Every path starting with the folder and a separator sorts between that prefix and the
+        prefix with its last character incremented.
+
+        Args:
+            folder (str): The folder path.
+
+        Returns:
+            tuple: The inclusive lower and exclusive upper bound.
+        """
+        prefix = os.path.join(os.path.normpath(folder), '')
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def file_records(self, folder):
+        """
+        Retrieve the (path, mtime, file_size) records of all images below a folder.
+
+        The path range is answered by the (path, mtime, file_size) index alone.
+
+        Args:
+            folder (str): The folder path.
+
+        Returns:
+            dict: Maps each image path to a (id, mtime, file_size) tuple.
+        """
+        rows = self.execute(
+            'SELECT path, id, mtime, file_size FROM images WHERE path >= ? AND path < ?',
+            self._folder_range(folder)
+        ).fetchall()
+        return {path: (image_id, mtime, file_size) for path, image_id, mtime, file_size in rows}
+
+    def duplicate_records(self, folder):
+        """
+        Retrieve the records of files below a folder skipped as duplicates of an image still in the library.
+
+        Args:
+            folder (str): The folder path.
+
+        Returns:
+            dict: Maps each file path to a (mtime, file_size, duplicate_of) tuple.
+        """
+        rows = self.execute(
+            'SELECT path, mtime, file_size, duplicate_of FROM duplicate_files WHERE path >= ? AND path < ? '
+            'AND duplicate_of IN (SELECT path FROM images)',
+            self._folder_range(folder)
+        ).fetchall()
+        return {path: (mtime, file_size, duplicate_of) for path, mtime, file_size, duplicate_of in rows}
+
+    def excluded_paths(self, folder):
+        """
+        Retrieve the paths of the files below a folder deleted from the library, see `delete_images`.
+
+        Args:
+            folder (str): The folder path.
+
+        Returns:
+            set: The excluded paths.
+        """
+        rows = self.execute(
+            'SELECT path FROM excluded_files WHERE path >= ? AND path < ?', self._folder_range(folder)
+        ).fetchall()
+        return {_[0] for _ in rows}
+
+    def include_paths(self, paths):
+        """
+        Forget excluded files, e.g. after they were removed from disk or imported again by the user.
+
+        Args:
+            paths (iterable): The paths of the files.
+        """
+        self.executemany('DELETE FROM excluded_files WHERE path = ?', [(_,) for _ in paths])
+
+    def set_duplicate_records(self, records, removed_paths=()):
+        """
+        Store the files skipped as duplicates and forget the ones that no longer exist.
+
+        Args:
+            records (list): (path, mtime, file_size, duplicate_of) tuples.
+            removed_paths (iterable): Paths of previously skipped files that were removed.
+        """
+        removed = [(_,) for _ in removed_paths]
+
+        def store(cursor):
+            cursor.executemany('INSERT OR REPLACE INTO duplicate_files VALUES (?, ?, ?, ?)', records)
+            cursor.executemany('DELETE FROM duplicate_files WHERE path = ?', removed)
+        self.write(store)
+
+    def refresh_file_records(self, image_ids):
+        """
+        Re-read the metadata and content fingerprint of images whose file has changed.
+
+        Args:
+            image_ids (list): The IDs of the changed images.
+        """
+        if not image_ids:
+            return
+        placeholders = ', '.join('?' for _ in image_ids)
+        rows = self.select('images', ['id', 'path'], f'id IN ({placeholders})', tuple(image_ids))
+        updates = []
+        for image_id, path in rows:
+            metadata = read_metadata(path)
+            updates.append((*[metadata[_] for _ in METADATA_COLUMNS], quick_hash(path), image_id))
+        set_clause = ', '.join(f'{_} = ?' for _ in METADATA_COLUMNS + ['content_hash'])
+        self.executemany(f'UPDATE images SET {set_clause}, full_hash = NULL WHERE id = ?', updates)
+
+    def delete_images(self, image_ids, exclude=False):
+        """
+        Delete images, their thumbnails and the duplicate records pointing to them in one transaction.
+
+        Args:
+            image_ids (list): The IDs of the images to delete.
+            exclude (bool): Whether to keep their files from being imported again by a folder sync,
+                e.g. when the user deleted them from the library.
+        """
+        if not image_ids:
+            return
+        rows = [(_,) for _ in image_ids]
+
+        def delete(cursor):
+            if exclude:
+                cursor.executemany(
+                    'INSERT OR IGNORE INTO excluded_files SELECT path FROM images WHERE id = ?', rows
+                )
+            cursor.executemany('DELETE FROM thumbnails WHERE image_id = ?', rows)
+            # files skipped as duplicates of a deleted image can be imported again
+            cursor.executemany(
+                'DELETE FROM duplicate_files WHERE duplicate_of IN (SELECT path FROM images WHERE id = ?)', rows
+            )
+            cursor.executemany('DELETE FROM images WHERE id = ?', rows)
+        self.write(delete)
+
     def get_params(self, image_id):
         """
         Retrieve image parameters for a given image ID.
@@ -240,11 +924,31 @@ class Database:
         Returns:
             list: A list containing the exposure, contrast, highlights, shadows, and black_levels parameters.
         """
-        return self.select(
-            'images',
-            ['exposure', 'contrast', 'highlights', 'shadows', 'black_levels'],
-            'id = ?',
-            (image_id,)
+        return self.select('images', PARAMETER_COLUMNS, 'id = ?', (image_id,))
+
+    def apply_params(self, image_ids, params):
+        """
+        Copy one set of parameters to many images in one transaction.
+
+        Args:
+            image_ids (list): The IDs of the images to update.
+            params (Parameter): The parameters to apply.
+        """
+        values = [getattr(params, _) for _ in PARAMETER_COLUMNS]
+        set_clause = ', '.join(f'{_} = ?' for _ in PARAMETER_COLUMNS)
+        self.executemany(f'UPDATE images SET {set_clause} WHERE id = ?', [(*values, _) for _ in image_ids])
+
+    def set_params(self, params_by_id):
+        """
+        Store different parameters for many images in one transaction.
+
+        Args:
+            params_by_id (dict): Maps the ID of every image to update to its Parameter.
+        """
+        set_clause = ', '.join(f'{_} = ?' for _ in PARAMETER_COLUMNS)
+        self.executemany(
+            f'UPDATE images SET {set_clause} WHERE id = ?',
+            [(*[getattr(params, _) for _ in PARAMETER_COLUMNS], image_id) for image_id, params in params_by_id.items()]
         )
 
     def set_config(self, key, value):
@@ -258,11 +962,7 @@ class Database:
             key (str): The configuration key.
             value (str): The value to set for the given key.
         """
-        exists = self.select('config', ['value'], 'key = ?', (key,))
-        if exists:
-            self.update('config', ['value'], [value], f'key = "{key}"')
-        else:
-            self.insert('config', {'key': key, 'value': value}, dict_=True)
+        self.execute('INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)', (key, value))
 
     def get_config(self, key):
         """
@@ -274,14 +974,21 @@ class Database:
         Returns:
             list: A list containing the configuration value.
         """
-        return self.select('config', ['value'], f'key = "{key}"')
+        return self.select('config', ['value'], 'key = ?', (key,))
 
     def close(self):
         """
-        Close the database connection and reset the singleton instance.
+        Close the database connections and reset the singleton instance.
 
-        This method closes the connection to the SQLite database and sets the
-        singleton instance to None, allowing for re-instantiation if needed.
+        This method stops the writer thread once the queued writes are done, closes the
+        connections to the SQLite database and sets the singleton instance to None,
+        allowing for re-instantiation if needed.
         """
+        self._writes.put(_STOP)
+        self._writer.join()
         self.conn.close()
+        with self._lock:
+            for connection in self._readers.values():
+                connection.close()
+            self._readers = {}
         Database._instance = None
@@ -0,0 +1,118 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ai_integration import stub_response
+from config import FAKE_AI_CHUNK_DELAY, FAKE_AI_ERROR_RATE, FAKE_AI_JITTER, FAKE_AI_LATENCY, FAKE_AI_PORT
+from render_service import ChunkedWriter
+
+
+class FakeAnalyzer:
+    """
+    A stand-in for the analysis model, served over HTTP for `ai_integration.HttpAnalyzer`.
+
+    Every answer is the deterministic `stub_response` to the prompt, streamed in chunks after a
+    simulated latency, so the AI path of the application, its batches and caches can be tested and
+    load-tested offline under realistic network conditions.
+
+    Endpoint:
+      POST /generate  a JSON object with the prompt and the base64 JPEG, answered as chunked text
+
+    The latency before the first chunk is `latency` plus an exponentially distributed jitter of
+    mean `jitter`, which gives the long tail of a real service. A fraction `error_rate` of the
+    requests is answered with a 503 after the latency.
+    """
+    def __init__(self, latency=FAKE_AI_LATENCY, jitter=FAKE_AI_JITTER, chunk_delay=FAKE_AI_CHUNK_DELAY,
+                 error_rate=FAKE_AI_ERROR_RATE, chunk_size=16, seed=None):
+        """
+        Initializes the stand-in.
+
+        :param latency: The minimum seconds before the first chunk of an answer.
+        :param jitter: The mean seconds of the random delay added to the latency, 0 for none.
+        :param chunk_delay: The seconds between the chunks of an answer.
+        :param error_rate: The fraction of requests answered with an error, between 0 and 1.
+        :param chunk_size: The number of characters per chunk.
+        :param seed: The seed of the random jitter and errors, for repeatable runs.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.requests = 0  # number of requests received
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """
+        Draws the simulated delay and outcome of a request.
+
+        :return: A tuple (seconds before the answer, True if the request fails).
+        """
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + (self._random.expovariate(1 / self.jitter) if self.jitter > 0 else 0)
+            return delay, self._random.random() < self.error_rate
+
+    def serve(self, host='127.0.0.1', port=FAKE_AI_PORT):
+        """
+        Creates the HTTP server of the stand-in, each request is handled in its own thread.
+
+        :param host: The address to listen on, only local clients by default.
+        :param port: The port to listen on, 0 for any free port.
+        :return: The ThreadingHTTPServer, call its `serve_forever` to start serving.
+        """
+        handler = type('Handler', (FakeAnalyzerRequestHandler,), {'analyzer': self})
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        return server
+
+
+class FakeAnalyzerRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the requests of a FakeAnalyzer, see its documentation for the endpoint.
+    """
+    protocol_version = 'HTTP/1.1'
+    analyzer = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/generate':
+            return self._send(404, b'Not found')
+        try:
+            prompt = json.loads(body)['prompt']
+        except (ValueError, KeyError, TypeError):
+            return self._send(400, b'Expected a JSON object with a prompt')
+        delay, fail = self.analyzer.draw()
+        time.sleep(delay)
+        if fail:
+            return self._send(503, b'Injected error')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        writer = ChunkedWriter(self.wfile)
+        text = stub_response(prompt).encode()
+        for start in range(0, len(text), self.analyzer.chunk_size):
+            if start:
+                time.sleep(self.analyzer.chunk_delay)
+            writer.write(text[start:start + self.analyzer.chunk_size])
+            self.wfile.flush()
+        writer.close()
+
+
+if __name__ == '__main__':
+    print(f'Serving stand-in analyses on http://127.0.0.1:{FAKE_AI_PORT}/generate')
+    FakeAnalyzer().serve().serve_forever()
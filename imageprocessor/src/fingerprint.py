@@ -0,0 +1,53 @@
+import hashlib
+import os
+
+
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_COUNT = 3
+FULL_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def quick_hash(path):
+    """
+    Computes a fast content fingerprint of a file from its size and a few sampled chunks.
+
+    Only `SAMPLE_COUNT` chunks of `SAMPLE_SIZE` bytes spread evenly over the file are read
+    (the whole file if it is smaller), so the cost does not grow with the file size. Copies
+    of the same raw file always get the same fingerprint.
+
+    :param path: Path to the file.
+    :return: The hex digest, or None if the file cannot be read.
+    """
+    try:
+        size = os.path.getsize(path)
+        digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+        with open(path, 'rb') as file:
+            if size <= SAMPLE_SIZE * SAMPLE_COUNT:
+                digest.update(file.read())
+            else:
+                step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+                for i in range(SAMPLE_COUNT):
+                    file.seek(i * step)
+                    digest.update(file.read(SAMPLE_SIZE))
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def full_hash(path):
+    """
+    Computes a hash of the whole content of a file.
+
+    Used to confirm a duplicate found by `quick_hash` when an exact match is required.
+
+    :param path: Path to the file.
+    :return: The hex digest, or None if the file cannot be read.
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    try:
+        with open(path, 'rb') as file:
+            while chunk := file.read(FULL_HASH_CHUNK_SIZE):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
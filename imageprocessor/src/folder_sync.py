@@ -0,0 +1,144 @@
+import os
+
+from config import RAW_EXTENSIONS
+from data import Database, ImportSummary
+from thumbnail_store import ThumbnailStore
+
+
+_RAW_SUFFIXES = tuple('.' + _ for _ in RAW_EXTENSIONS)
+# Called with the list of changed or removed image IDs, so caches of those images can be dropped
+_invalidation_listeners = []
+
+
+def add_invalidation_listener(callback):
+    """
+    Registers a function called with the IDs of images whose file changed or was removed by a sync.
+
+    :param callback: A function taking a list of image IDs.
+    """
+    _invalidation_listeners.append(callback)
+
+
+def scan_folder(folder):
+    """
+    Walks a folder tree with `os.scandir` and yields the raw files it contains.
+
+    Sub-folders are walked iteratively and unreadable folders are skipped.
+
+    :param folder: The folder to scan.
+    :return: A generator of (path, mtime, file_size) tuples.
+    """
+    stack = [os.path.normpath(folder)]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(_RAW_SUFFIXES) and entry.is_file():
+                        stat = entry.stat()
+                        yield entry.path, stat.st_mtime, stat.st_size
+        except OSError:
+            continue
+
+
+class SyncResult:
+    """
+    The outcome of a folder sync.
+    """
+    def __init__(self):
+        self.new_ids = []  # IDs of imported images, their thumbnails still need to be created
+        self.new_paths = []
+        self.changed_ids = []  # IDs of images whose file changed, their thumbnails were dropped
+        self.removed_ids = []
+        self.unchanged = 0
+        self.import_summary = ImportSummary()
+
+    def __str__(self):
+        return (f'{len(self.new_ids)} new, {len(self.changed_ids)} changed, '
+                f'{len(self.removed_ids)} removed, {self.unchanged} unchanged')
+
+
+def sync_folder(folder, database=None):
+    """
+    Brings the library in sync with the raw files in a folder.
+
+    The folder is scanned and every file is compared with the indexed (path, mtime, file_size)
+    record of the library, so only new, changed and removed files are processed and an unchanged
+    tree costs one directory walk and three queries. New files are imported; duplicates are skipped
+    and remembered with their own record so they are not fingerprinted again, and files the user
+    deleted from the library are skipped. Changed files get their metadata re-read and their
+    thumbnails dropped, and removed files are deleted from the library. Invalidation listeners are
+    notified of changed and removed images.
+
+    A folder that does not exist (e.g. an unplugged drive) is skipped instead of removing all
+    of its images from the library.
+
+    :param folder: The folder to sync.
+    :param database: The Database to sync, defaults to the singleton.
+    :return: A SyncResult.
+    """
+    database = database if database is not None else Database()
+    result = SyncResult()
+    if not os.path.isdir(folder):
+        return result
+    records = database.file_records(folder)
+    duplicates = database.duplicate_records(folder)
+    excluded = database.excluded_paths(folder)
+    new_paths = {}
+    skipped = {}  # unchanged duplicates -> the path of their original
+    for path, mtime, file_size in scan_folder(folder):
+        record = records.pop(path, None)
+        if record is None and path in excluded:
+            excluded.discard(path)
+            result.unchanged += 1
+        elif record is None:
+            duplicate = duplicates.pop(path, None)
+            if duplicate is not None and duplicate[:2] == (mtime, file_size):
+                skipped[path] = duplicate[2]
+            else:
+                new_paths[path] = (mtime, file_size)
+        elif record[1] != mtime or record[2] != file_size:
+            result.changed_ids.append(record[0])
+        else:
+            result.unchanged += 1
+    result.removed_ids = [_[0] for _ in records.values()]
+    # a duplicate whose original is removed now is imported in its place
+    for path, duplicate_of in skipped.items():
+        if duplicate_of in records:
+            new_paths[path] = os.path.getmtime(path), os.path.getsize(path)
+        else:
+            result.unchanged += 1
+
+    if new_paths:
+        imported = database.import_image(list(new_paths), result.import_summary)
+        if imported is not None:
+            result.new_ids, result.new_paths = imported
+    database.set_duplicate_records(
+        [(path, *new_paths[path], duplicate_of) for path, duplicate_of in result.import_summary.duplicates],
+        removed_paths=list(duplicates) + result.new_paths
+    )
+    if result.changed_ids:
+        database.refresh_file_records(result.changed_ids)
+        ThumbnailStore(database).delete(result.changed_ids)
+    database.delete_images(result.removed_ids)
+    # excluded files no longer on disk
+    database.include_paths(excluded)
+
+    invalidated = result.changed_ids + result.removed_ids
+    if invalidated:
+        for callback in _invalidation_listeners:
+            callback(invalidated)
+    return result
+
+
+def sync_library_folders(database=None):
+    """
+    Syncs every registered library folder.
+
+    :param database: The Database to sync, defaults to the singleton.
+    :return: A list of (folder, SyncResult) tuples.
+    """
+    database = database if database is not None else Database()
+    return [(folder, sync_folder(folder, database)) for folder in database.library_folders()]
@@ -0,0 +1,231 @@
+import json
+import threading
+import time
+
+from config import JOB_CLASSES, JOB_FAILED_KEEP_DAYS, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY, JOB_WORKERS
+from prefetch import lower_thread_priority
+
+
+class JobScheduler:
+    """
+    Runs background jobs stored in the jobs table of the database, so they survive a restart.
+
+    Every kind of job is registered with a function and a job class. No more than `JOB_WORKERS`
+    jobs run at once, a free worker takes the queued job of the highest priority class, and every
+    class limits how many of its jobs run at once, so thumbnails go before exports and a long
+    batch of exports never takes all workers. Jobs run at low CPU priority and wait while `busy` returns True, e.g. while
+    a frame is rendered, so the edit view is not slowed down.
+
+    A failing job is retried after a growing delay until `JOB_MAX_ATTEMPTS` attempts failed, then
+    it is kept as failed with its error. Jobs running when the application stopped are queued
+    again by `start`. Finished jobs are deleted.
+    """
+    def __init__(self, database, classes=JOB_CLASSES, workers=JOB_WORKERS, max_attempts=JOB_MAX_ATTEMPTS,
+                 retry_delay=JOB_RETRY_DELAY, busy=None):
+        """
+        Initializes the scheduler, jobs run once `start` is called.
+
+        :param database: The Database holding the jobs table.
+        :param classes: A dictionary mapping each job class to its (priority, concurrency limit).
+        :param workers: The number of jobs running at once in all classes.
+        :param max_attempts: The number of attempts of a failing job.
+        :param retry_delay: The delay in seconds before the first retry, doubled for every further one.
+        :param busy: A function returning True while jobs should wait before starting.
+        """
+        self.database = database
+        self.classes = classes
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # called with the job ID, its kind, its payload and the error or None after a job finished or failed,
+        # see `add_listener`
+        self._listeners = []
+        self._busy = busy or (lambda: False)
+        self._handlers = {}  # kind -> (function, job class)
+        self._condition = threading.Condition()
+        self._queue = []  # (priority, due time, job ID, kind, payload, attempts) of the queued jobs
+        self._running = {}  # job class -> number of running jobs
+        self._started = False
+
+    def add_listener(self, callback):
+        """
+        Registers a function called with the job ID, its kind, its payload and the error or None
+        after a job finished or finally failed, e.g. by every session showing the library.
+
+        :param callback: The function to call.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """
+        Unregisters a function registered with `add_listener`.
+
+        :param callback: The function to remove, ignored if it is not registered.
+        """
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def register(self, kind, function, job_class):
+        """
+        Registers the function running a kind of job.
+
+        :param kind: The name of the kind of job, stored with every job.
+        :param function: Called with the payload of a job as keyword arguments.
+        :param job_class: One of the classes of the scheduler.
+        """
+        if job_class not in self.classes:
+            raise ValueError(f'Unknown job class: {job_class}')
+        self._handlers[kind] = (function, job_class)
+
+    def _push(self, job_id, kind, payload, attempts, due=0.0):
+        priority = self.classes[self._handlers[kind][1]][0]
+        self._queue.append((priority, due, job_id, kind, payload, attempts))
+        self._condition.notify_all()
+
+    def submit(self, kind, unique=False, **payload):
+        """
+        Stores a job and queues it, jobs run in the order of their class priority and then of submission.
+
+        :param kind: A registered kind of job.
+        :param unique: If True, no job is added while a job of the same kind and payload is queued or running.
+        :param payload: The JSON serializable arguments of the job function.
+        :return: The ID of the job.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f'Unknown job kind: {kind}')
+        encoded = json.dumps(payload, sort_keys=True)
+
+        def insert(cursor):
+            if unique:
+                row = cursor.execute(
+                    "SELECT id FROM jobs WHERE kind = ? AND payload = ? AND state IN ('queued', 'running')",
+                    (kind, encoded)
+                ).fetchone()
+                if row is not None:
+                    return row[0], False
+            cursor.execute(
+                'INSERT INTO jobs (kind, payload, created) VALUES (?, ?, ?)', (kind, encoded, time.time())
+            )
+            return cursor.lastrowid, True
+        with self._condition:
+            job_id, added = self.database.write(insert)
+            # jobs submitted before `start` are queued from the table
+            if added and self._started:
+                self._push(job_id, kind, payload, 0)
+        return job_id
+
+    def start(self):
+        """
+        Queues the stored jobs, including those interrupted by a crash, and starts running jobs.
+        Jobs of kinds which are not registered yet stay in the table.
+        """
+        with self._condition:
+            if self._started:
+                return
+            self._started = True
+            self.database.execute("UPDATE jobs SET state = 'queued' WHERE state = 'running'")
+            rows = self.database.execute(
+                "SELECT id, kind, payload, attempts FROM jobs WHERE state = 'queued' ORDER BY id"
+            ).fetchall()
+            for job_id, kind, payload, attempts in rows:
+                if kind in self._handlers:
+                    self._push(job_id, kind, json.loads(payload), attempts)
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+    def wait(self, timeout=None):
+        """
+        Waits until no job is queued or running, failed jobs do not count.
+
+        :param timeout: The maximum number of seconds to wait, no limit if None.
+        :return: True if all jobs are done.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._queue and not any(self._running.values()), timeout
+            )
+
+    def state(self, job_id):
+        """
+        Returns the state of a job.
+
+        :param job_id: The ID of the job.
+        :return: A tuple (state, attempts, error), or None once the job is done.
+        """
+        return self.database.execute(
+            'SELECT state, attempts, error FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+
+    def prune(self, max_age=JOB_FAILED_KEEP_DAYS * 24 * 3600):
+        """
+        Deletes the failed jobs submitted more than `max_age` seconds ago, until then they are kept
+        so their error can be looked up.
+
+        :param max_age: The age in seconds of the oldest failed job kept.
+        """
+        self.database.execute(
+            "DELETE FROM jobs WHERE state = 'failed' AND created < ?", (time.time() - max_age,)
+        )
+
+    def _next_job(self):
+        """
+        Waits until a worker is free and a job is due whose class has a free slot, and takes it from the queue.
+
+        :return: The (priority, due time, job ID, kind, payload, attempts) of the job.
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wake = None
+                if sum(self._running.values()) >= self.workers:
+                    self._condition.wait()
+                    continue
+                for entry in sorted(self._queue):
+                    job_class = self._handlers[entry[3]][1]
+                    if self._running.get(job_class, 0) >= self.classes[job_class][1]:
+                        continue
+                    if entry[1] > now:
+                        wake = entry[1] if wake is None else min(wake, entry[1])
+                        continue
+                    self._queue.remove(entry)
+                    self._running[job_class] = self._running.get(job_class, 0) + 1
+                    return entry
+                self._condition.wait(None if wake is None else wake - now)
+
+    def _dispatch(self):
+        while True:
+            entry = self._next_job()
+            threading.Thread(target=self._run, args=(entry,), daemon=True).start()
+
+    def _run(self, entry):
+        _, _, job_id, kind, payload, attempts = entry
+        function, job_class = self._handlers[kind]
+        lower_thread_priority()
+        self.database.execute("UPDATE jobs SET state = 'running' WHERE id = ?", (job_id,))
+        error = None
+        try:
+            while self._busy():
+                time.sleep(0.05)
+            function(**payload)
+        except Exception as e:
+            error = e
+        attempts += 1
+        with self._condition:
+            self._running[job_class] -= 1
+            if error is None:
+                self.database.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            elif attempts < self.max_attempts:
+                self.database.execute(
+                    "UPDATE jobs SET state = 'queued', attempts = ?, error = ? WHERE id = ?",
+                    (attempts, repr(error), job_id)
+                )
+                self._push(job_id, kind, payload, attempts,
+                           time.monotonic() + self.retry_delay * 2 ** (attempts - 1))
+            else:
+                self.database.execute(
+                    "UPDATE jobs SET state = 'failed', attempts = ?, error = ? WHERE id = ?",
+                    (attempts, repr(error), job_id)
+                )
+            self._condition.notify_all()
+        if error is None or attempts >= self.max_attempts:
+            for listener in list(self._listeners):
+                listener(job_id, kind, payload, error)
@@ -1,14 +1,27 @@
 import base64
 import os
 import shutil
+import threading
+import time
 
 import flet as ft
-from PIL import Image
 
 from config import *
-from ImageProcessing import RawImage, EmptyImage, ImageProcessorThread, Parameter, create_thumbnail
+from ImageProcessing import RawImage, EmptyImage, HalfSizeImage, PreviewImage, ImageProcessorThread, Parameter, \
+    Viewport, update_control
+from auto_tone import auto_tone
+import compute_backends
 import directory_management
-from data import Database
+from data import Database, ImportSummary
+from folder_sync import add_invalidation_listener, sync_folder, sync_library_folders
+from jobs import JobScheduler
+from prefetch import Prefetcher
+from presets import PresetStrip, apply_preset
+from render_backends import ProcessRenderBackend
+from strip_export import export_image
+from thumbnail_renderer import ThumbnailRenderer
+from thumbnail_store import ThumbnailStore
+from warm_start import WarmStart
 import ai_integration
 
 # Create persist and temp dirs
@@ -75,19 +88,19 @@ def create_control_area(page):
     return status_text_box, status_container, prompt_text_box, feedback_text_box, submit_button, compare_button, reset_button
 
 
-image_analyzer = ai_integration.ImageAnalyzer()
+image_analyzer = ai_integration.create_analyzer()
 def submit_button_click(
         e, prompt_text_box, params, status_text_box, feedback_text_box,
         exposure_slider, contrast_slider, highlights_slider,
         exposure_slider_value, contrast_slider_value, highlights_slider_value,
-        image_object, img_container
+        image_object, img_container, image_id, render_thread=image_processor_thread
 ):
     """
     Handles the click event of the submit button by sending the image to the AI API and updating
     the UI with the results.
 
-    This function sends the prompt and parameters to the image analysis API, processes the response,
-    and updates the image settings (exposure, contrast, etc.) based on the returned parameters.
+    This function sends the prompt and parameters to the image analysis API, shows the feedback and
+    previews the adjustments while the response streams in, and updates the image settings (exposure, contrast, etc.) based on the returned parameters.
     The image is also reprocessed using the updated settings.
 
     :param e: The event triggered by the button click.
@@ -103,15 +116,30 @@ def submit_button_click(
     :param highlights_slider_value: The current value of the highlights slider.
     :param image_object: The image object to be processed.
     :param img_container: The container for displaying the image.
+    :param image_id: The ID of the image in the database.
+    :param render_thread: The ImageProcessorThread of the session, the singleton by default.
     """
     # Call API
     status_text_box.value = 'Sending image to Google AI Studio'
     e.page.update()
-    response = image_analyzer.api_call(prompt_text_box.value, params)
+    suggestion = None if isinstance(image_object, EmptyImage) else auto_tone(image_object.tone_plane())
+    previewed = params
+
+    def on_update(feedback, new_params):
+        nonlocal previewed
+        # show the feedback as it streams and preview every adjustment as soon as it arrived
+        feedback_text_box.value = feedback
+        if vars(new_params) != vars(previewed):
+            previewed = new_params
+            render_thread.process_image(image_object, new_params, img_container)
+        e.page.update()
+    response = image_analyzer.api_call(
+        prompt_text_box.value, params, suggestion, on_update, directory=render_thread.directory
+    )
     if response['success']:
         feedback_text_box.value = response['feedback']
         new_params = response['new_parameters']
-        status_text_box.value = 'Success'
+        status_text_box.value = 'Auto-tone applied' if response.get('fallback') else 'Success'
         exposure_slider.value = new_params.exposure
         exposure_slider_value.value = new_params.exposure
         contrast_slider.value = new_params.contrast
@@ -122,12 +150,14 @@ def submit_button_click(
         contrast_slider_value.value = new_params.shadows
         highlights_slider.value = new_params.black_levels
         highlights_slider_value.value = new_params.black_levels
-        database.update(table='images', column=['contrast'], value=[new_params.contrast], condition=f'id = {current_image_id}')
-        database.update(table='images', column=['exposure'], value=[new_params.exposure], condition=f'id = {current_image_id}')
-        database.update(table='images', column=['highlights'], value=[new_params.highlights], condition=f'id = {current_image_id}')
-        database.update(table='images', column=['shadows'], value=[new_params.shadows], condition=f'id = {current_image_id}')
-        database.update(table='images', column=['black_levels'], value=[new_params.black_levels], condition=f'id = {current_image_id}')
-        image_processor_thread.process_image(image_object, new_params, img_container)
+        database.update(table='images', column=['contrast'], value=[new_params.contrast], condition=f'id = {image_id}')
+        database.update(table='images', column=['exposure'], value=[new_params.exposure], condition=f'id = {image_id}')
+        database.update(table='images', column=['highlights'], value=[new_params.highlights], condition=f'id = {image_id}')
+        database.update(table='images', column=['shadows'], value=[new_params.shadows], condition=f'id = {image_id}')
+        database.update(table='images', column=['black_levels'], value=[new_params.black_levels], condition=f'id = {image_id}')
+        render_thread.process_image(image_object, new_params, img_container)
+        warm_start.save_async(image_id, new_params)
+        thumbnail_renderer.schedule([image_id], delay=THUMBNAIL_RENDER_DELAY)
     else:
         status_text_box.value = 'Failed'
         feedback_text_box.value = response['feedback']
@@ -147,11 +177,115 @@ def open_url(url):
         os.system(f'open {url}')
 
 database = Database()
+thumbnail_store = ThumbnailStore(database)
+warm_start = WarmStart(os.path.join(PERSIST_DIR, 'warm_start'))
+add_invalidation_listener(warm_start.invalidate)
+# decodes the neighbours of the edited image while the render thread is idle
+prefetcher = Prefetcher(busy=ImageProcessorThread.busy)
+add_invalidation_listener(lambda image_ids: prefetcher.clear())
+# renders edited thumbnails from small proxies while the render thread is idle
+thumbnail_renderer = ThumbnailRenderer(
+    database, thumbnail_store, os.path.join(PERSIST_DIR, 'thumbnail_proxies'),
+    busy=ImageProcessorThread.busy
+)
+add_invalidation_listener(thumbnail_renderer.delete)
+
+
+def thumbnail_job(image_id):
+    """
+    Creates the proxy and the thumbnails of an imported image, measuring the decode time used to
+    estimate the time saved by skipping duplicates.
+
+    :param image_id: The ID of the image.
+    """
+    row = database.execute('SELECT path FROM images WHERE id = ?', (image_id,)).fetchone()
+    if row is None:  # deleted in the meantime
+        return
+    start = time.perf_counter()
+    thumbnail_renderer.create(image_id, row[0])
+    database.record_decode_time(time.perf_counter() - start)
+
+
+def export_job(image_id, path, parameters):
+    """
+    Exports an image at full resolution.
+
+    :param image_id: The ID of the image.
+    :param path: The destination path, its extension selects the format.
+    :param parameters: The values of the parameters in the order of `PARAMETER_COLUMNS`.
+    """
+    row = database.execute('SELECT path FROM images WHERE id = ?', (image_id,)).fetchone()
+    if row is None:
+        return
+    # rendered in strips, a full resolution render would hold several float32 copies of the image
+    export_image(row[0], Parameter(*parameters), path)
+
+
+def auto_tone_job(image_ids):
+    """
+    Sets the parameters proposed by the local auto-tone on images, computed from their thumbnail
+    proxies, and renders their thumbnails again.
+
+    :param image_ids: The IDs of the images.
+    """
+    proposed = {}
+    for image_id in image_ids:
+        proxy = thumbnail_renderer.load_proxy(image_id)
+        if proxy is None:
+            row = database.execute('SELECT path FROM images WHERE id = ?', (image_id,)).fetchone()
+            if row is None:
+                continue
+            proxy = thumbnail_renderer.create_proxy(image_id, row[0])
+        proposed[image_id] = auto_tone(proxy)
+    database.set_params(proposed)
+    thumbnail_renderer.schedule(list(proposed))
+
+
+def backfill_job():
+    """
+    Reads the metadata and the content fingerprints of images imported before they were cataloged.
+    """
+    database.backfill_metadata()
+    database.backfill_content_hash()
+
+
+# runs thumbnails, exports and backfills in the background, jobs interrupted by a restart are resumed
+job_scheduler = JobScheduler(database, busy=ImageProcessorThread.busy)
+job_scheduler.register('thumbnail', thumbnail_job, 'thumbnail')
+job_scheduler.register('export', export_job, 'export')
+job_scheduler.register('auto_tone', auto_tone_job, 'edit')
+job_scheduler.register('backfill', backfill_job, 'metadata')
+
+
+def startup():
+    """
+    Prepares the library once per process before the app is opened, not in every session of the
+    web server: selects the backends of the render kernels, benchmarking them on the first start on
+    this host, tidies the thumbnail store and the jobs, starts the job scheduler and syncs the
+    library folders. Importing the module starts nothing, so it does not touch the library.
+    """
+    compute_backends.auto_select(database, COMPUTE_BACKEND)
+    # move thumbnails of older versions into the store and reclaim space of deleted ones
+    thumbnail_store.migrate_legacy(os.path.join(PERSIST_DIR, 'thumbnails'))
+    thumbnail_store.compact()
+    job_scheduler.prune()
+    job_scheduler.start()
+    # read metadata of images imported before the metadata catalog existed
+    job_scheduler.submit('backfill', unique=True)
+    # pick up files added, changed or removed in the library folders since the last start
+    for folder, result in sync_library_folders(database):
+        for image_id in result.new_ids + result.changed_ids:
+            job_scheduler.submit('thumbnail', unique=True, image_id=image_id)
+
+
 def main(page):
     # library
     image_paths = {}
+    library_order = []
+    library_images = {}  # image ID -> thumbnail control in the library grid
+    selected_ids = set()
+    copied_params = None
     # edit
-    global image_object, current_image_id
     image_object = EmptyImage()
     current_image_id = 0
     params = Parameter()
@@ -172,7 +306,8 @@ def main(page):
     def file_selected(e):
         """
         Handles the file selection process, imports selected image(s), creates thumbnails, and adds them
-        to the database and the library page.
+        to the database and the library page. Copies of images already in the library are skipped and
+        reported in the import summary.
 
         Args:
             e (ft.FilePickerResult): The result from the file picker containing the selected files.
@@ -181,21 +316,101 @@ def main(page):
             return
         file_path = [_.path for _ in e.files]
         # save to database
-        _ = database.import_image(file_path)
+        summary = ImportSummary()
+        _ = database.import_image(file_path, summary)
+        e.page.open(ft.SnackBar(ft.Text(str(summary))))
         if _ is None:
+            e.page.update()
             return
         ids, new_images = _
         for new_image_path, id_ in zip(new_images, ids):
-            # create thumbnails
-            create_thumbnail(new_image_path, os.path.join(PERSIST_DIR, 'thumbnails', str(id_) + '.jpg'))
             # add to image_paths
             image_paths[id_] = new_image_path
-            # add image to library page
-            image_grid.controls.append(create_image_selector_in_library(id_))
-        database.set_config('last_opened', '"None"')
+        create_thumbnails(ids)
+        # add images to library page
+        refresh_library()
+        remember_last_opened('"None"')
         e.page.update()
 
 
+    def create_thumbnails(image_ids):
+        """
+        Queues the jobs creating the proxies and thumbnails of the given images, each thumbnail
+        is shown in the library once its job is done.
+
+        Args:
+            image_ids (list): The IDs of the images.
+        """
+        for id_ in image_ids:
+            job_scheduler.submit('thumbnail', unique=True, image_id=id_)
+
+    def sync_folders(folders=None):
+        """
+        Syncs library folders with the library and creates the thumbnails of new and changed images.
+
+        Args:
+            folders (list, optional): The folders to sync. Defaults to all registered library folders.
+
+        Returns:
+            str: A summary of the changes, one part per folder.
+        """
+        if folders is None:
+            results = sync_library_folders(database)
+        else:
+            results = [(folder, sync_folder(folder, database)) for folder in folders]
+        for folder, result in results:
+            for id_, path in zip(result.new_ids, result.new_paths):
+                image_paths[id_] = path
+            for id_ in result.removed_ids:
+                image_paths.pop(id_, None)
+            create_thumbnails(result.new_ids + result.changed_ids)
+        return '; '.join(f'{os.path.basename(folder)}: {result}' for folder, result in results)
+
+    def folder_selected(e):
+        """
+        Registers the selected folder as a library folder and imports its raw files.
+
+        Args:
+            e (ft.FilePickerResultEvent): The result from the file picker containing the selected folder.
+        """
+        if e.path is None:
+            return
+        database.add_library_folder(e.path)
+        summary = sync_folders([e.path])
+        refresh_library()
+        e.page.open(ft.SnackBar(ft.Text(summary)))
+        e.page.update()
+
+    def add_folder_button_onclick(e):
+        """
+        Triggered when the 'Add Folder' button is clicked. Opens a folder picker to select a library folder.
+        """
+        folder_picker = ft.FilePicker(
+            on_result=folder_selected,
+        )
+        page.overlay.append(folder_picker)
+        page.update()
+        folder_picker.get_directory_path()
+    add_folder_button = ft.TextButton(
+        text='Add Folder',
+        tooltip='Keep the raw files of a folder in sync with the library',
+        on_click=add_folder_button_onclick
+    )
+
+    def sync_button_onclick(e):
+        """
+        Triggered when the 'Sync' button is clicked. Rescans all library folders for changes.
+        """
+        summary = sync_folders()
+        refresh_library()
+        e.page.open(ft.SnackBar(ft.Text(summary or 'No library folders')))
+        e.page.update()
+    sync_button = ft.TextButton(
+        text='Sync',
+        tooltip='Rescan the library folders for new, changed and removed files',
+        on_click=sync_button_onclick
+    )
+
     def import_button_onclick(e):
         """
         Triggered when the 'Import Image' button is clicked. Opens a file picker to select images to import.
@@ -225,13 +440,9 @@ def main(page):
             return
         export_path = e.path
         if image is None:
-            image_path = image_paths[image_id]
             # TODO: check if raw image exists, pop up alert if not
             params_sql = database.execute('SELECT exposure, contrast, highlights, shadows, black_levels FROM images WHERE id = ?', (image_id,)).fetchone()
-            params = Parameter(*params_sql)
-            image_object = RawImage(image_path)
-            image = image_object.render_image(params)
-            RawImage.save_image(image, export_path)
+            job_scheduler.submit('export', image_id=image_id, path=export_path, parameters=list(params_sql))
         else:
             image.save(export_path)
         e.page.update()
@@ -259,16 +470,21 @@ def main(page):
 
     def delete_button_click(e, image_id):
         """
-        Handles the deletion of an image from both the database and the UI. Removes the thumbnail
-        and deletes the image entry from the database.
+        Handles the deletion of an image from both the database and the UI. Removes the thumbnails
+        from the thumbnail store, its proxy and deletes the image entry from the database. A file in
+        a library folder is excluded from the folder syncs, so it is not imported again.
 
         Args:
             e (ft.Event): The event object triggered by the button click.
             image_id (int): The ID of the image to delete.
         """
-        os.remove(os.path.join(PERSIST_DIR, 'thumbnails', str(image_id) + '.jpg'))
-        database.delete('images', 'id = ?', (image_id,))
+        thumbnail_store.delete(image_id)
+        thumbnail_renderer.delete([image_id])
+        database.delete_images([image_id], exclude=True)
         # remove from library view
+        library_order.remove(image_id)
+        library_images.pop(image_id, None)
+        selected_ids.discard(image_id)
         image_id = str(image_id)
         for control in image_grid.controls:
             if control.key == image_id:
@@ -286,7 +502,7 @@ def main(page):
         Returns:
             ft.Column: The column containing the image, edit, export, and delete buttons.
         """
-        thumbnail_path = os.path.join(PERSIST_DIR, 'thumbnails', str(image_id) + '.jpg')
+        thumbnail = thumbnail_store.get_base64(image_id, LIBRARY_THUMBNAIL_SIZE)
         edit_button = ft.ElevatedButton(
             text='Edit',
             on_click=lambda e: open_edit_tab(page, image_id)
@@ -299,12 +515,19 @@ def main(page):
             text='Delete',
             on_click=lambda e: delete_button_click(e, image_id)
         )
+        select_checkbox = ft.Checkbox(
+            value=image_id in selected_ids,
+            tooltip='Select',
+            on_change=lambda e: select_image(e, image_id)
+        )
+        library_images[image_id] = ft.Image(src_base64=thumbnail, width=200, height=200)
         return ft.Column(
             key=str(image_id),
             controls=[
-                ft.Image(src=thumbnail_path, width=200, height=200),
+                library_images[image_id],
                 ft.Row(
                     controls=[
+                        select_checkbox,
                         edit_button,
                         export_button,
                         delete_button
@@ -316,6 +539,111 @@ def main(page):
             horizontal_alignment=ft.CrossAxisAlignment.CENTER,
         )
 
+    def select_image(e, image_id):
+        """
+        Adds an image to or removes it from the library selection when its checkbox changes.
+
+        Args:
+            e (ft.ControlEvent): The event object triggered by the checkbox.
+            image_id (int): The ID of the image.
+        """
+        if e.control.value:
+            selected_ids.add(image_id)
+        else:
+            selected_ids.discard(image_id)
+
+    def copy_settings_click(e):
+        """
+        Copies the parameters of the selected image, so they can be pasted onto other images.
+
+        Args:
+            e (ft.ControlEvent): The event object triggered by the button click.
+        """
+        nonlocal copied_params
+        if len(selected_ids) != 1:
+            e.page.open(ft.SnackBar(ft.Text('Select one image to copy its settings from')))
+            e.page.update()
+            return
+        image_id = next(iter(selected_ids))
+        copied_params = Parameter(*database.get_params(image_id)[0])
+        paste_settings_button.disabled = False
+        e.page.open(ft.SnackBar(ft.Text('Settings copied')))
+        e.page.update()
+
+    def paste_settings_click(e):
+        """
+        Applies the copied parameters to all selected images in one transaction. Their thumbnails
+        are rendered again in the background from the stored proxies.
+
+        Args:
+            e (ft.ControlEvent): The event object triggered by the button click.
+        """
+        if copied_params is None or not selected_ids:
+            return
+        image_ids = [_ for _ in library_order if _ in selected_ids]
+        database.apply_params(image_ids, copied_params)
+        thumbnail_renderer.schedule(image_ids)
+        e.page.open(ft.SnackBar(ft.Text(f'Settings pasted to {len(image_ids)} images')))
+        e.page.update()
+
+    def auto_tone_selection_click(e):
+        """
+        Queues the local auto-tone of the selected images, their thumbnails update once it is done.
+
+        Args:
+            e (ft.ControlEvent): The event object triggered by the button click.
+        """
+        if not selected_ids:
+            return
+        image_ids = [_ for _ in library_order if _ in selected_ids]
+        job_scheduler.submit('auto_tone', image_ids=image_ids)
+        e.page.open(ft.SnackBar(ft.Text(f'Auto-toning {len(image_ids)} images')))
+        e.page.update()
+
+    def select_all_click(e):
+        """
+        Selects all images shown in the library, or clears the selection if they are all selected.
+
+        Args:
+            e (ft.ControlEvent): The event object triggered by the button click.
+        """
+        if selected_ids.issuperset(library_order):
+            selected_ids.clear()
+        else:
+            selected_ids.update(library_order)
+        refresh_library()
+        e.page.update()
+
+    def job_done(job_id, kind, payload, error):
+        """
+        Shows the result of a background job: the thumbnail of an imported image, or whether an export worked.
+
+        Args:
+            job_id (int): The ID of the job.
+            kind (str): The kind of the job.
+            payload (dict): The arguments of the job.
+            error (Exception): The error of the last attempt of a failed job, None if it is done.
+        """
+        if kind == 'thumbnail' and error is None:
+            thumbnail_rendered(payload['image_id'])
+        elif kind == 'export':
+            name = os.path.basename(payload['path'])
+            page.open(ft.SnackBar(ft.Text(f'Exported {name}' if error is None else f'Export of {name} failed: {error}')))
+            page.update()
+
+    def thumbnail_rendered(image_id):
+        """
+        Shows the new thumbnail of an image in the library after the thumbnail renderer rewrote it.
+
+        Args:
+            image_id (int): The ID of the image.
+        """
+        image = library_images.get(image_id)
+        if image is None or image.page is None:
+            return
+        image.src_base64 = thumbnail_store.get_base64(image_id, LIBRARY_THUMBNAIL_SIZE)
+        update_control(image, page)
+
     def open_edit_tab(page, image_id):
         """
         Opens the image edit tab and loads the image and its parameters from the database for editing.
@@ -327,24 +655,72 @@ def main(page):
         Returns:
             RawImage: The image object that is being edited.
         """
-        global image_object, current_image_id
+        nonlocal image_object, current_image_id
         current_image_id = image_id
         image_path = database.execute('SELECT path FROM images WHERE id = ?', (image_id,)).fetchone()
         if image_path is None:
             # TODO: alert
             return
         image_path = image_path[0]
-        image_object = RawImage(image_path)
+        # a prefetched image is shown right away, otherwise a half size decode is shown first
+        image_object = prefetcher.cached(image_path)
+        full_quality = image_object is not None
+        if not full_quality:
+            image_object = HalfSizeImage(image_path)
+        load_params(image_id)
+
+        page.go('/edit')
+        remember_last_opened(image_id)
+        render_thread.process_image(image_object, params, photo_area, generate_original=True)
+        refresh_presets()
+        warm_start.save_async(image_id, params, image_object)
+        if full_quality:
+            prefetch_neighbours(image_id)
+        else:
+            threading.Thread(target=finish_decode, args=(image_id, image_path), daemon=True).start()
+        return image_object
+
+    def prefetch_neighbours(image_id):
+        """
+        Starts decoding the images before and after an image in library order. The image itself
+        stays in the wish list, so other sessions opening it share its decode.
+
+        Args:
+            image_id (int): The ID of the image being edited.
+        """
+        image_ids = [image_id] + Prefetcher.neighbours(library_order, image_id)
+        prefetcher.prefetch([image_paths[_] for _ in image_ids if _ in image_paths], owner=page.session_id)
+
+    def step_image(e, step):
+        """
+        Opens the previous or next image in library order in the edit view.
+
+        Args:
+            e: The event object triggered by the button click.
+            step (int): -1 for the previous image, 1 for the next one.
+        """
+        if current_image_id not in library_order:
+            return
+        index = library_order.index(current_image_id) + step
+        if 0 <= index < len(library_order):
+            open_edit_tab(e.page, library_order[index])
+
+    def load_params(image_id):
+        """
+        Loads the parameters of an image from the database into the parameters object edited by
+        the sliders, and sets the sliders and their value text boxes.
+
+        Args:
+            image_id (int): The ID of the image.
+        """
         exposure, contrast, highlights, shadows, black_levels = database.execute(
             'SELECT exposure, contrast, highlights, shadows, black_levels FROM images WHERE id = ?',
             (image_id,)).fetchone()
-        params = Parameter(
-            exposure=exposure,
-            contrast=contrast,
-            highlights=highlights,
-            shadows=shadows,
-            black_levels=black_levels
-        )
+        params.exposure = exposure
+        params.contrast = contrast
+        params.highlights = highlights
+        params.shadows = shadows
+        params.black_levels = black_levels
 
         exposure_slider.value = exposure
         contrast_slider.value = contrast
@@ -357,11 +733,78 @@ def main(page):
         shadows_slider_value.value = str(shadows)
         black_levels_slider_value.value = str(black_levels)
 
+    def remember_last_opened(value):
+        """
+        Stores the page shown last, which is reopened at the next start. Only the desktop app does
+        this, the sessions of the web server share one database and would reopen each other's image.
+
+        Args:
+            value: The ID of the edited image, or '"None"' when the library is shown.
+        """
+        if not page.web:
+            database.set_config('last_opened', value)
+
+    def restore_last_opened(image_id):
+        """
+        Reopens the image that was being edited when the application was closed.
+
+        If its warm start data is stored, the last frame is shown immediately and edits render on
+        the stored proxy while the raw file is decoded in a background thread. Otherwise the image
+        is opened with `open_edit_tab`.
+
+        Args:
+            image_id (int): The ID of the image to reopen.
+
+        Returns:
+            RawImage: The image object that is being edited.
+        """
+        nonlocal image_object, current_image_id
+        image_path = database.execute('SELECT path FROM images WHERE id = ?', (image_id,)).fetchone()
+        warm = warm_start.load(image_id)
+        if image_path is None or warm is None:
+            return open_edit_tab(page, image_id)
+        frame, proxy = warm
+        current_image_id = image_id
+        load_params(image_id)
+        photo_area.content = ft.Image(src_base64=base64.b64encode(frame).decode('utf-8'), key='temp')
+        image_object = PreviewImage(image_path[0], proxy)
         page.go('/edit')
-        database.set_config('last_opened', image_id)
-        image_processor_thread.process_image(image_object, params, photo_area, generate_original=True)
+        render_thread.process_image(image_object, params, photo_area, generate_original=True)
+        refresh_presets()
+        threading.Thread(target=finish_decode, args=(image_id, image_path[0]), daemon=True).start()
         return image_object
 
+    def finish_decode(image_id, image_path):
+        """
+        Decodes the raw file of an image at full quality and swaps it in for the preview (a warm
+        start proxy or a half size decode) once ready, unless another image was opened in the meantime.
+
+        If the file cannot be decoded, e.g. it was moved or is corrupt, the error is shown and the
+        preview is dropped, so it is not edited as if it were the image.
+
+        Args:
+            image_id (int): The ID of the image.
+            image_path (str): The path of the raw file.
+        """
+        nonlocal image_object
+        try:
+            full_image = prefetcher.get(image_path)
+        except Exception as e:  # the decode errors of rawpy share no base class with OSError
+            if current_image_id == image_id:
+                image_object = EmptyImage()
+                photo_area.content = ft.Text(f'{os.path.basename(image_path)} could not be opened', key='temp')
+                status_text_box.value = f'Failed to open the image: {e}'
+                warm_start.invalidate([image_id])
+                remember_last_opened('"None"')
+                page.update()
+            return
+        if current_image_id != image_id:
+            return
+        image_object = full_image
+        render_thread.process_image(full_image, params, photo_area, generate_original=True)
+        refresh_presets()
+        prefetch_neighbours(image_id)
+
     def onchange_parameter(e, current_param_name, value_text_box, params, img_container, round_=None):
         """
         Updates the value of a parameter when the slider is adjusted and processes the image.
@@ -376,8 +819,9 @@ def main(page):
         """
         value_text_box.value = str(round(e.control.value, round_))
         params.__setattr__(current_param_name, e.control.value)
-        image_processor_thread.process_image(image_object, params, img_container)
-        e.page.update()
+        render_thread.process_image(image_object, params, img_container)
+        # the frame is delivered by the render thread, only the value text changed here
+        update_control(value_text_box, e.page)
 
     def on_change_end_parameter(e, current_param_name, params, round_=None):
         """
@@ -392,6 +836,10 @@ def main(page):
         value = str(round(e.control.value, round_))
         params.__setattr__(current_param_name, e.control.value)
         database.update(table='images', column=[current_param_name], value=[value], condition=f'id = {current_image_id}')
+        warm_start.save_async(current_image_id, params)
+        refresh_presets()
+        # the library thumbnail is rendered once the slider has been left alone for a moment
+        thumbnail_renderer.schedule([current_image_id], delay=THUMBNAIL_RENDER_DELAY)
 
     def create_parameter_sliders(img_container):
         """
@@ -505,6 +953,74 @@ def main(page):
             shadows_slider_value, black_levels_slider_value
         )
 
+    def auto_tone_click(e):
+        """
+        Sets the parameters proposed by the local auto-tone for the edited image and renders it.
+
+        Args:
+            e: The event object triggered by the auto button click.
+        """
+        if isinstance(image_object, EmptyImage):
+            return
+        database.apply_params([current_image_id], auto_tone(image_object.tone_plane()))
+        load_params(current_image_id)
+        page.update()
+        render_thread.process_image(image_object, params, photo_area)
+        refresh_presets()
+        warm_start.save_async(current_image_id, params)
+        thumbnail_renderer.schedule([current_image_id], delay=THUMBNAIL_RENDER_DELAY)
+
+    def apply_preset_click(e, changes):
+        """
+        Applies the changes of a preset to the parameters of the edited image and renders it.
+
+        Args:
+            e: The event object triggered by the click on the preview of the preset.
+            changes (dict): The changes of the preset, see `apply_preset`.
+        """
+        if isinstance(image_object, EmptyImage):
+            return
+        database.apply_params([current_image_id], apply_preset(params, changes))
+        load_params(current_image_id)
+        page.update()
+        render_thread.process_image(image_object, params, photo_area)
+        refresh_presets()
+        warm_start.save_async(current_image_id, params)
+        thumbnail_renderer.schedule([current_image_id], delay=THUMBNAIL_RENDER_DELAY)
+
+    def refresh_presets():
+        """
+        Requests new previews of the presets for the edited image and parameters, rendered in the background.
+        """
+        if not isinstance(image_object, EmptyImage):
+            preset_strip.update(image_object, params)
+
+    def presets_rendered(image, previews):
+        """
+        Shows the previews of the presets in the strip next to the edit view, unless another image was opened.
+
+        Args:
+            image (RawImage): The image the previews were rendered from.
+            previews (list): The (name, Parameter, base64 JPEG) of every preset.
+        """
+        if image is not image_object:
+            return
+        preset_area.controls = [
+            ft.Container(
+                content=ft.Column(
+                    [
+                        ft.Image(src_base64=preview, width=PRESET_LONG_EDGE, fit=ft.ImageFit.CONTAIN),
+                        ft.Text(name, size=12)
+                    ],
+                    spacing=2
+                ),
+                tooltip=f'Apply {name}',
+                on_click=lambda e, changes=changes: apply_preset_click(e, changes)
+            )
+            for (name, _, preview), (_, changes) in zip(previews, preset_strip.presets)
+        ]
+        update_control(preset_area, page)
+
     def reset(e):
         """
         Resets all sliders and parameters to their default values, updates the database
@@ -534,12 +1050,38 @@ def main(page):
         database.update(table='images', column=['shadows'], value=[0], condition=f'id = {current_image_id}')
         database.update(table='images', column=['black_levels'], value=[0], condition=f'id = {current_image_id}')
         page.update()
-        image_processor_thread.process_image(image_object, params, photo_area)
+        render_thread.process_image(image_object, params, photo_area)
+        refresh_presets()
+        warm_start.save_async(current_image_id, params)
+        thumbnail_renderer.schedule([current_image_id], delay=THUMBNAIL_RENDER_DELAY)
 
     # app name
     page.title = APP_NAME
-    # setup thread
-    image_processor_thread.page = page
+    # setup thread, every web session renders on its own thread and the desktop window on the singleton
+    render_thread = ImageProcessorThread.new_session(page.session_id) if page.web else image_processor_thread
+    render_thread.page = page
+    if RENDER_BACKEND == 'process' and not isinstance(image_processor_thread.backend, ProcessRenderBackend):
+        image_processor_thread.backend = ProcessRenderBackend()
+    # sessions share the worker processes of the singleton
+    render_thread.backend = image_processor_thread.backend
+
+    def close_session(e):
+        """
+        Stops the render thread of a closed web session, drops its prefetch wish list and stops
+        its updates on rendered thumbnails and finished jobs.
+
+        Args:
+            e: The event object triggered when the session is closed.
+        """
+        render_thread.close()
+        preset_strip.close()
+        prefetcher.release(page.session_id)
+        thumbnail_renderer.remove_listener(thumbnail_rendered)
+        job_scheduler.remove_listener(job_done)
+    page.on_close = close_session
+    # previews of the presets applied to the edited parameters, rendered in one batch while the render thread is idle
+    preset_strip = PresetStrip(busy=ImageProcessorThread.busy)
+    preset_strip.on_render = presets_rendered
     # Window
     page.window.width = 1250
     page.window.height = 1000
@@ -555,7 +1097,7 @@ def main(page):
             e: The event object triggered by the action of navigating to the library.
         """
         page.go("/library")
-        database.set_config('last_opened', '"None"')
+        remember_last_opened('"None"')
 
     def compare_button_click(e):
         """
@@ -565,23 +1107,66 @@ def main(page):
         Args:
             e: The event object triggered by the comparison button click.
         """
+        # nothing to compare before an image has been rendered
+        if isinstance(image_object, EmptyImage) or render_thread.original_path is None:
+            return
         if photo_area.content.key == 'original':
-            photo_area.content.key = 'temp'
-            with open(os.path.join(TEMP_DIR, 'temp.tif'), 'rb') as file:
-                photo_area.content.src_base64 = base64.b64encode(file.read()).decode('utf-8')
+            render_thread.presenter.show(render_thread.frame_path, photo_area, e.page, key='temp')
+        else:
+            render_thread.presenter.show(
+                render_thread.original_path, photo_area, e.page, key='original'
+            )
+
+    def zoom_button_click(e):
+        """
+        Toggles between showing the whole image and a 1:1 view of its centre, which renders only the visible pixels.
+
+        Args:
+            e: The event object triggered by the zoom button click.
+        """
+        if render_thread.viewport is None:
+            render_thread.viewport = Viewport(int(photo_area.width), int(photo_area.height))
+            zoom_button.text = 'Fit'
         else:
-            photo_area.content.key = 'original'
-            with open(os.path.join(TEMP_DIR, 'original.tif'), 'rb') as file:
-                photo_area.content.src_base64 = base64.b64encode(file.read()).decode('utf-8')
+            render_thread.viewport = None
+            zoom_button.text = '1:1'
+        render_thread.process_image(image_object, params, photo_area, generate_original=True)
         e.page.update()
 
+    def pan_photo(e):
+        """
+        Moves the 1:1 view with the mouse while the image is dragged.
+
+        Args:
+            e (ft.DragUpdateEvent): The event object triggered by dragging the image.
+        """
+        viewport = render_thread.viewport
+        if viewport is None:
+            return
+        viewport.pan(e.delta_x, e.delta_y, image_object.raw_image.shape)
+        render_thread.process_image(image_object, params, photo_area)
+
+    def pan_photo_end(e):
+        """
+        Renders the original of the new 1:1 view once dragging ends, so the compare view shows the same region.
+
+        Args:
+            e (ft.DragEndEvent): The event object triggered by the end of the drag.
+        """
+        if render_thread.viewport is not None:
+            render_thread.process_image(image_object, params, photo_area, generate_original=True)
+
     library_page_button = ft.ElevatedButton(
         text='Library',
         on_click=go_from_edit_to_library
     )
+    previous_image_button = ft.TextButton(text='Previous', on_click=lambda e: step_image(e, -1))
+    next_image_button = ft.TextButton(text='Next', on_click=lambda e: step_image(e, 1))
+    zoom_button = ft.TextButton(text='1:1', tooltip='Zoom to 100%, drag the image to pan', on_click=zoom_button_click)
     edit_page_export_button = ft.TextButton(
         text='Export',
-        on_click=lambda e: export_button_click(e, current_image_id, Image.open(os.path.join(TEMP_DIR, 'temp.tif')))
+        # exported from the raw file, the preview may still be the half size decode
+        on_click=lambda e: export_button_click(e, current_image_id)
     )
     # Photo area
     image_object, photo_area = create_photo_area(
@@ -595,27 +1180,53 @@ def main(page):
      exposure_slider_value, contrast_slider_value, highlights_slider_value,
      shadows_slider_value, black_levels_slider_value
      ) = create_parameter_sliders(photo_area)
+    photo_gesture = ft.GestureDetector(
+        content=photo_area,
+        expand=True,
+        drag_interval=30,
+        on_pan_update=pan_photo,
+        on_pan_end=pan_photo_end
+    )
 
     # Control area
     status_text_box, status_container, prompt_text_box, feedback_text_box, submit_button, compare_button, reset_button = create_control_area(page)
-    submit_button.on_click = lambda e: submit_button_click(
-        e,
-        prompt_text_box, params, status_text_box, feedback_text_box,
-        exposure_slider, contrast_slider, highlights_slider,
-        exposure_slider_value, contrast_slider_value, highlights_slider_value,
-        image_object, photo_area
-    )
+
+    def submit_click(e):
+        """
+        Sends the edited image to the AI API and renders the previews of the presets with the new parameters.
+
+        Args:
+            e: The event object triggered by the submit button click.
+        """
+        submit_button_click(
+            e,
+            prompt_text_box, params, status_text_box, feedback_text_box,
+            exposure_slider, contrast_slider, highlights_slider,
+            exposure_slider_value, contrast_slider_value, highlights_slider_value,
+            image_object, photo_area, current_image_id, render_thread
+        )
+        if not isinstance(image_object, EmptyImage):
+            # the parameters stored by the submission
+            load_params(current_image_id)
+            page.update()
+            refresh_presets()
+    submit_button.on_click = submit_click
     compare_button.on_click = compare_button_click
     reset_button.on_click = reset
 
+    auto_tone_button = ft.TextButton(
+        text='Auto', tooltip='Set the parameters from the histogram of the image', on_click=auto_tone_click
+    )
     control_button_area = ft.Row(
-        [submit_button, compare_button, reset_button],
+        [submit_button, auto_tone_button, compare_button, reset_button],
         alignment=ft.MainAxisAlignment.CENTER
     )
     control_area = ft.Column(
         [status_container, prompt_text_box, feedback_text_box, control_button_area]
     )
 
+    # Preset strip, filled by `presets_rendered`
+    preset_area = ft.Column(width=PRESET_LONG_EDGE, spacing=8, scroll=ft.ScrollMode.AUTO)
     # Edit area
     edit_area = ft.Column(
         [control_area, parameter_area],
@@ -624,14 +1235,86 @@ def main(page):
     # Main area
     edit_page = ft.Column(
         controls=[
-            ft.Row([library_page_button, edit_page_export_button]),
+            ft.Row([library_page_button, edit_page_export_button, previous_image_button, next_image_button,
+                    zoom_button]),
             ft.Row(
-                [photo_area, edit_area],
+                [photo_gesture, preset_area, edit_area],
                 vertical_alignment=ft.CrossAxisAlignment.START
             )
         ]
     )
     # Library
+    def refresh_library(e=None):
+        """
+        Rebuilds the library grid from the metadata catalog using the selected sort order and filters.
+
+        Args:
+            e: The event object triggered by changing a sort or filter control, if any.
+        """
+        filters = {}
+        if edited_dropdown.value != 'all':
+            filters['edited'] = edited_dropdown.value == 'edited'
+        if camera_dropdown.value != 'all':
+            filters['camera_model'] = camera_dropdown.value
+        camera_dropdown.options = [ft.dropdown.Option('all', 'All cameras')] + [
+            ft.dropdown.Option(_) for _ in database.distinct_values('camera_model')
+        ]
+        library_order[:] = database.query_images(
+            sort_by=sort_dropdown.value,
+            descending=descending_checkbox.value,
+            filters=filters
+        )
+        library_images.clear()
+        image_grid.controls = [create_image_selector_in_library(_) for _ in library_order]
+        if e is not None:
+            e.page.update()
+
+    sort_dropdown = ft.Dropdown(
+        label='Sort by',
+        value='id',
+        width=150,
+        options=[
+            ft.dropdown.Option('id', 'Import order'),
+            ft.dropdown.Option('capture_time', 'Capture date'),
+            ft.dropdown.Option('camera', 'Camera'),
+            ft.dropdown.Option('lens', 'Lens'),
+            ft.dropdown.Option('iso', 'ISO'),
+            ft.dropdown.Option('file_size', 'File size'),
+        ],
+        on_change=refresh_library
+    )
+    descending_checkbox = ft.Checkbox(label='Descending', value=False, on_change=refresh_library)
+    edited_dropdown = ft.Dropdown(
+        label='Show',
+        value='all',
+        width=130,
+        options=[
+            ft.dropdown.Option('all', 'All'),
+            ft.dropdown.Option('edited', 'Edited'),
+            ft.dropdown.Option('unedited', 'Unedited'),
+        ],
+        on_change=refresh_library
+    )
+    camera_dropdown = ft.Dropdown(label='Camera', value='all', width=180, on_change=refresh_library)
+    select_all_button = ft.TextButton(text='Select All', on_click=select_all_click)
+    auto_tone_selection_button = ft.TextButton(
+        text='Auto Tone',
+        tooltip='Set the parameters of the selected images from their histograms',
+        on_click=auto_tone_selection_click
+    )
+    copy_settings_button = ft.TextButton(
+        text='Copy Settings',
+        tooltip='Copy the settings of the selected image',
+        on_click=copy_settings_click
+    )
+    paste_settings_button = ft.TextButton(
+        text='Paste Settings',
+        tooltip='Apply the copied settings to the selected images',
+        disabled=True,
+        on_click=paste_settings_click
+    )
+    thumbnail_renderer.add_listener(thumbnail_rendered)
+    job_scheduler.add_listener(job_done)
     image_grid = ft.GridView(
         expand=1,
         runs_count=5,
@@ -643,9 +1326,10 @@ def main(page):
     images_to_load = database.select('images', ['id', 'path'],)
     for i in images_to_load:
         image_paths[i[0]] = i[1]
-        image_grid.controls.append(create_image_selector_in_library(i[0]))
+    refresh_library()
     library_page = ft.Column([
-        import_button,
+        ft.Row([import_button, add_folder_button, sync_button, sort_dropdown, descending_checkbox, edited_dropdown, camera_dropdown]),
+        ft.Row([select_all_button, copy_settings_button, paste_settings_button, auto_tone_selection_button]),
         image_grid
     ])
     def route_change(route):
@@ -673,12 +1357,13 @@ def main(page):
     page.on_route_change = route_change
     page.on_view_pop = view_pop
     page.go('/library')
-    last_opened = database.get_config('last_opened')
+    last_opened = None if page.web else database.get_config('last_opened')
     if last_opened:
-        last_opened = last_opened[0][0]
-        if last_opened != 'None' or last_opened != '"None"':
+        last_opened = str(last_opened[0][0])
+        # 'None' or '"None"' when the library was the last page shown
+        if last_opened.isdigit():
             current_image_id = int(last_opened)
-            image_object = open_edit_tab(page, current_image_id)
+            image_object = restore_last_opened(current_image_id)
     # first time open
     not_first_time_open = database.get_config('not_first_time_open')
     if not not_first_time_open:
@@ -703,5 +1388,10 @@ def main(page):
     page.update()
 
 if __name__ == '__main__':
-    ft.app(target=main)
+    startup()
+    # frames are served from TEMP_DIR to web clients, see FramePresenter
+    if SERVER_MODE:
+        ft.app(target=main, assets_dir=TEMP_DIR, view=ft.AppView.WEB_BROWSER, port=SERVER_PORT)
+    else:
+        ft.app(target=main, assets_dir=TEMP_DIR)
     shutil.rmtree(TEMP_DIR)
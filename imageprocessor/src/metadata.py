@@ -0,0 +1,155 @@
+import os
+import struct
+
+
+# Only the start of the file is read, the EXIF data of raw files lives in the header
+HEADER_BYTES = 512 * 1024
+
+# Catalog columns filled by read_metadata, in the order they are stored
+METADATA_COLUMNS = [
+    'capture_time', 'camera_make', 'camera_model', 'lens', 'iso',
+    'exposure_time', 'aperture', 'focal_length', 'file_size', 'mtime'
+]
+
+# TIFF/EXIF tag ID -> catalog column
+_TAGS = {
+    0x010F: 'camera_make',
+    0x0110: 'camera_model',
+    0x0132: 'capture_time',  # DateTime, overridden by DateTimeOriginal
+    0x9003: 'capture_time',  # DateTimeOriginal
+    0xA434: 'lens',
+    0x8827: 'iso',
+    0x8832: 'iso',  # RecommendedExposureIndex
+    0x829A: 'exposure_time',
+    0x829D: 'aperture',
+    0x920A: 'focal_length',
+}
+_EXIF_IFD_POINTER = 0x8769
+# TIFF field type -> (struct format, size in bytes)
+_TYPES = {
+    1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8),
+    7: ('B', 1), 8: ('h', 2), 9: ('i', 4), 10: ('ii', 8),
+}
+
+
+def _parse_ifd(buffer, tiff_start, ifd_offset, byte_order, tags):
+    """
+    Reads the known tags of one IFD into `tags` and returns the EXIF IFD offset if present.
+
+    :param buffer: The bytes containing the TIFF structure.
+    :param tiff_start: Position of the TIFF header in the buffer, offsets are relative to it.
+    :param ifd_offset: Offset of the IFD to read.
+    :param byte_order: '<' or '>' as found in the TIFF header.
+    :param tags: A dictionary collecting the values by tag ID.
+    :return: The offset of the EXIF IFD, or None.
+    """
+    position = tiff_start + ifd_offset
+    if position + 2 > len(buffer):
+        return None
+    exif_offset = None
+    (count,) = struct.unpack_from(byte_order + 'H', buffer, position)
+    for i in range(count):
+        entry = position + 2 + i * 12
+        if entry + 12 > len(buffer):
+            break
+        tag, type_, value_count = struct.unpack_from(byte_order + 'HHI', buffer, entry)
+        if type_ not in _TYPES or value_count == 0:
+            continue
+        if tag != _EXIF_IFD_POINTER and tag not in _TAGS:
+            continue
+        fmt, size = _TYPES[type_]
+        length = size * value_count
+        if length <= 4:
+            value_position = entry + 8
+        else:
+            (value_position,) = struct.unpack_from(byte_order + 'I', buffer, entry + 8)
+            value_position += tiff_start
+        if value_position + length > len(buffer):
+            continue
+        if type_ == 2:
+            value = buffer[value_position:value_position + length].split(b'\x00')[0]
+            value = value.decode('ascii', errors='ignore').strip()
+        elif type_ in (5, 10):
+            numerator, denominator = struct.unpack_from(byte_order + fmt, buffer, value_position)
+            value = numerator / denominator if denominator else None
+        else:
+            (value,) = struct.unpack_from(byte_order + fmt, buffer, value_position)
+        if tag == _EXIF_IFD_POINTER:
+            exif_offset = value
+        elif value not in (None, '') and tag not in tags:
+            tags[tag] = value
+    return exif_offset
+
+
+def _parse_tiff(buffer, tiff_start, tags):
+    """
+    Reads the known tags of the first IFD and the EXIF IFD of a TIFF structure.
+
+    :param buffer: The bytes containing the TIFF structure.
+    :param tiff_start: Position of the TIFF header in the buffer.
+    :param tags: A dictionary collecting the values by tag ID.
+    """
+    byte_order = {b'II': '<', b'MM': '>'}.get(buffer[tiff_start:tiff_start + 2])
+    if byte_order is None or tiff_start + 8 > len(buffer):
+        return
+    (ifd_offset,) = struct.unpack_from(byte_order + 'I', buffer, tiff_start + 4)
+    exif_offset = _parse_ifd(buffer, tiff_start, ifd_offset, byte_order, tags)
+    if exif_offset:
+        _parse_ifd(buffer, tiff_start, exif_offset, byte_order, tags)
+
+
+def _find_tiff_headers(buffer):
+    """
+    Finds the TIFF structures holding EXIF data in the header of a raw file.
+
+    Handles TIFF based raw files (DNG, NEF, CR2, ARW, ORF, RW2, ...), the CMT boxes of
+    CR3 files and embedded `Exif` blocks (RAF and other containers).
+
+    :param buffer: The first bytes of the file.
+    :return: A list of positions of TIFF headers in the buffer.
+    """
+    positions = []
+    if buffer[:2] in (b'II', b'MM'):
+        positions.append(0)
+    for marker, skip in ((b'CMT1', 4), (b'CMT2', 4), (b'Exif\x00\x00', 6)):
+        index = buffer.find(marker)
+        if index != -1:
+            positions.append(index + skip)
+    return positions
+
+
+def read_metadata(path):
+    """
+    Reads the capture metadata of a raw file from its header without decoding the image.
+
+    Missing files and unknown formats are not an error, the corresponding values are None.
+
+    :param path: Path to the raw image file.
+    :return: A dictionary with one entry per column in `METADATA_COLUMNS`.
+    """
+    metadata = dict.fromkeys(METADATA_COLUMNS)
+    try:
+        stat = os.stat(path)
+        metadata['file_size'] = stat.st_size
+        metadata['mtime'] = stat.st_mtime
+        with open(path, 'rb') as file:
+            buffer = file.read(HEADER_BYTES)
+    except OSError:
+        return metadata
+
+    tags = {}
+    for tiff_start in _find_tiff_headers(buffer):
+        try:
+            _parse_tiff(buffer, tiff_start, tags)
+        except struct.error:
+            continue
+
+    for tag, column in _TAGS.items():
+        if tag in tags and (metadata[column] is None or tag == 0x9003):
+            metadata[column] = tags[tag]
+    if metadata['capture_time']:
+        # 'YYYY:MM:DD HH:MM:SS' -> 'YYYY-MM-DD HH:MM:SS', which sorts chronologically
+        metadata['capture_time'] = metadata['capture_time'].replace(':', '-', 2)
+    if metadata['iso'] is not None:
+        metadata['iso'] = int(metadata['iso'])
+    return metadata
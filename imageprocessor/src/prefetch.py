@@ -0,0 +1,282 @@
+import mmap
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from config import PREFETCH_AHEAD, PREFETCH_BEHIND, PREFETCH_MEMORY_MB, RENDER_WORKERS
+from ImageProcessing import RawImage
+
+
+def read_ahead(path):
+    """
+    Maps a raw file into memory and asks the OS to start reading it.
+
+    The returned map can be decoded with `rawpy.open_buffer`, so a slow disk is read while
+    the CPU is still busy with something else.
+
+    :param path: Path to the raw file.
+    :return: The read-only memory map, or None if the file cannot be mapped.
+    """
+    try:
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # ValueError: empty file
+        return None
+    if hasattr(mmap, 'MADV_WILLNEED'):
+        mapped.madvise(mmap.MADV_WILLNEED)
+    return mapped
+
+
+def file_version(path):
+    """
+    Returns what changes when a raw file is replaced, so images decoded from the old file are not reused.
+
+    :param path: Path to the raw file.
+    :return: A tuple (modification time in nanoseconds, size), or None if the file cannot be read.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def lower_thread_priority(niceness=10):
+    """
+    Lowers the CPU priority of the calling thread, so it does not slow down rendering.
+
+    Only supported on Linux, where the nice value applies to a single thread.
+
+    :param niceness: The increment of the nice value.
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+        except OSError:
+            pass
+
+
+class Prefetcher:
+    """
+    Decodes the raw files of the images likely opened next in a background thread.
+
+    The wish list is set with `prefetch`, usually from the current image and its neighbours in
+    library order. Files are read ahead through a memory map and decoded at low priority while
+    the render thread is idle. Decoded images are kept up to a memory budget, so stepping to
+    the next image in the edit view does not wait for a decode.
+
+    In the web server mode every session sets its own wish list and the decoded images are shared,
+    so a file opened by several sessions is decoded once. No more than `RENDER_WORKERS` files are
+    decoded at the same time. A decoded image is not returned any more once its file was replaced.
+    """
+    def __init__(self, memory_budget=PREFETCH_MEMORY_MB * 1024 * 1024, busy=None, decoder=RawImage, workers=None):
+        """
+        Initializes the prefetcher, its daemon thread is started with the first wish list.
+
+        :param memory_budget: The maximum number of bytes used by the decoded images.
+        :param busy: A function returning True while decoding should wait, e.g. while a frame is rendered.
+        :param decoder: Creates the image from a path and an optional buffer, RawImage by default.
+        :param workers: The maximum number of files decoded at the same time, `RENDER_WORKERS` by default.
+        """
+        self.memory_budget = memory_budget
+        self.hits = 0
+        self.misses = 0
+        self._busy = busy or (lambda: False)
+        self._decoder = decoder
+        self._slots = threading.BoundedSemaphore(workers or RENDER_WORKERS or os.cpu_count() or 1)
+        self._condition = threading.Condition()
+        self._event = threading.Event()
+        self._images = OrderedDict()  # path -> decoded image, least recently used first
+        self._versions = {}  # path -> file_version of the decoded image
+        self._wishes = {}  # owner, e.g. a session -> its wish list
+        self._wanted = []  # paths to prefetch from all wish lists, most likely next first
+        self._failed = set()  # paths which could not be decoded, not retried until the next wish list
+        self._decoding = set()
+        self._image_size = 0  # bytes of the largest decoded image, the estimate for the next one
+        self._thread = None
+
+    @staticmethod
+    def neighbours(order, current, ahead=PREFETCH_AHEAD, behind=PREFETCH_BEHIND):
+        """
+        Returns the items around the current one, most likely next first.
+
+        The next item comes first, then the previous one, then further items alternately.
+
+        :param order: The list of items, e.g. image IDs in library order.
+        :param current: The current item.
+        :param ahead: The number of items after the current one.
+        :param behind: The number of items before the current one.
+        :return: A list of items.
+        """
+        if current not in order:
+            return []
+        index = order.index(current)
+        result = []
+        for distance in range(1, max(ahead, behind) + 1):
+            if distance <= ahead and index + distance < len(order):
+                result.append(order[index + distance])
+            if distance <= behind and index - distance >= 0:
+                result.append(order[index - distance])
+        return result
+
+    def prefetch(self, paths, owner=None):
+        """
+        Replaces the wish list of an owner. Decoded images no longer wanted by any owner are dropped.
+
+        :param paths: The paths of the raw files to decode, most likely next first.
+        :param owner: The owner of the wish list, e.g. the session ID of a page.
+        """
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._wishes[owner] = list(paths)
+            self._update_wanted()
+
+    def release(self, owner):
+        """
+        Drops the wish list of an owner, e.g. of a closed session.
+
+        :param owner: The owner of the wish list.
+        """
+        with self._condition:
+            self._wishes.pop(owner, None)
+            self._update_wanted()
+
+    def clear(self):
+        """
+        Drops all wish lists and all decoded images, e.g. after files changed on disk.
+        """
+        with self._condition:
+            self._wishes.clear()
+            self._update_wanted()
+
+    def _update_wanted(self):
+        """
+        Merges the wish lists, taking their items in turns, and drops the decoded images no longer wanted.
+        """
+        wanted = []
+        for rank in range(max((len(_) for _ in self._wishes.values()), default=0)):
+            for paths in self._wishes.values():
+                if rank < len(paths) and paths[rank] not in wanted:
+                    wanted.append(paths[rank])
+        self._wanted = wanted
+        self._failed.clear()
+        for path in [_ for _ in self._images if _ not in self._wanted]:
+            self._discard(path)
+        self._event.set()
+
+    def _discard(self, path):
+        del self._images[path]
+        self._versions.pop(path, None)
+
+    def _current(self, path, version):
+        """
+        Returns the decoded image of a raw file if it was decoded from its current version, dropping an outdated one.
+        """
+        image = self._images.get(path)
+        if image is not None and self._versions.get(path) != version:
+            self._discard(path)
+            return None
+        return image
+
+    def _store(self, path, image, version):
+        self._images[path] = image
+        self._versions[path] = version
+        self._image_size = max(self._image_size, image.raw_image.nbytes)
+
+    def cached(self, path):
+        """
+        Returns the image of a raw file if it is already decoded, without waiting or decoding.
+
+        :param path: Path to the raw file.
+        :return: The decoded image, or None.
+        """
+        version = file_version(path)
+        with self._condition:
+            image = self._current(path, version)
+            if image is not None:
+                self._images.move_to_end(path)
+                self.hits += 1
+            return image
+
+    def get(self, path):
+        """
+        Returns the image of a raw file, decoding it now unless it was prefetched.
+
+        Waits for the decode if the file is being decoded at the moment, e.g. prefetched or opened
+        by another session. The decoded image is kept until the next wish list leaves it out.
+
+        :param path: Path to the raw file.
+        :return: The decoded image.
+        """
+        version = file_version(path)
+        with self._condition:
+            while path in self._decoding:
+                self._condition.wait()
+            image = self._current(path, version)
+            if image is not None:
+                self._images.move_to_end(path)
+                self.hits += 1
+                return image
+            self.misses += 1
+            self._decoding.add(path)
+        image = None
+        try:
+            with self._slots:
+                image = self._decoder(path)
+            return image
+        finally:
+            with self._condition:
+                self._decoding.discard(path)
+                if image is not None:
+                    self._store(path, image, version)
+                self._condition.notify_all()
+
+    def _memory_used(self):
+        return sum(_.raw_image.nbytes for _ in self._images.values())
+
+    def _next_path(self):
+        """
+        Returns the next path to decode, or None if all wanted images are decoded or the budget is used up.
+        """
+        for path in self._wanted:
+            if path in self._images or path in self._failed or path in self._decoding:
+                continue
+            if self._memory_used() + self._image_size > self.memory_budget:
+                return None
+            return path
+        return None
+
+    def _run(self):
+        lower_thread_priority()
+        while True:
+            self._event.wait()
+            with self._condition:
+                path = self._next_path()
+                if path is None:
+                    self._event.clear()
+                    continue
+                self._decoding.add(path)
+            image = None
+            version = file_version(path)
+            buffer = read_ahead(path)
+            try:
+                while self._busy():
+                    time.sleep(0.05)
+                with self._slots:
+                    image = self._decoder(path, buffer)
+            except Exception:  # the error is reported when the image is opened
+                pass
+            finally:
+                if buffer is not None:
+                    buffer.close()
+                with self._condition:
+                    self._decoding.discard(path)
+                    if image is None:
+                        self._failed.add(path)
+                    elif path in self._wanted:
+                        self._store(path, image, version)
+                    self._condition.notify_all()
@@ -0,0 +1,149 @@
+import base64
+import io
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from config import PRESET_LONG_EDGE, PRESETS
+from data import PARAMETER_COLUMNS
+from ImageProcessing import ImageProcessorThread, Parameter, PreviewImage, RawImage
+from prefetch import lower_thread_priority
+
+# Range of every parameter, the same as its slider in the edit view
+PARAMETER_RANGES = {
+    'exposure': (-5, 5),
+    'contrast': (-100, 100),
+    'highlights': (0, 100),
+    'shadows': (0, 100),
+    'black_levels': (-100, 100),
+}
+
+
+def apply_preset(params, changes):
+    """
+    Applies the changes of a preset to parameters.
+
+    :param params: The parameters the preset is applied to.
+    :param changes: A dictionary of parameter names and the values added to them.
+    :return: A new Parameter, every value kept in the range of its slider.
+    """
+    values = {}
+    for name in PARAMETER_COLUMNS:
+        low, high = PARAMETER_RANGES[name]
+        values[name] = min(max(getattr(params, name) + changes.get(name, 0), low), high)
+    return Parameter(**values)
+
+
+def render_presets(image, params, presets=PRESETS):
+    """
+    Renders the previews of presets applied to parameters in one batch, see `RawImage.render_batch`.
+
+    :param image: A small linear image, e.g. a proxy of `PRESET_LONG_EDGE`.
+    :param params: The parameters the presets are applied to.
+    :param presets: A list of (name, changes) of the presets.
+    :return: A list of (name, Parameter, base64 JPEG) of the presets.
+    """
+    preset_params = [apply_preset(params, changes) for _, changes in presets]
+    with ImageProcessorThread.render_slots:
+        frames = image.render_batch(preset_params)
+    previews = []
+    for (name, _), preset, frame in zip(presets, preset_params, frames):
+        buffer = io.BytesIO()
+        Image.fromarray(RawImage.quantize(frame, np.uint8), mode='RGB').save(buffer, format='JPEG', quality=85)
+        previews.append((name, preset, base64.b64encode(buffer.getvalue()).decode('utf-8')))
+    return previews
+
+
+class PresetStrip:
+    """
+    Renders the previews of the presets applied to the edited parameters in a background thread.
+
+    Only the latest request is rendered, so a series of edits renders the strip once. The previews
+    are rendered from a small proxy of the image, created once per image, at low priority while
+    the render thread is idle.
+    """
+    def __init__(self, presets=PRESETS, long_edge=PRESET_LONG_EDGE, busy=None):
+        """
+        Initializes the strip and starts its daemon thread.
+
+        :param presets: A list of (name, changes) of the presets, see `apply_preset`.
+        :param long_edge: The long edge of the previews in pixels.
+        :param busy: A function returning True while rendering should wait, e.g. while a frame is rendered.
+        """
+        self.presets = presets
+        self.long_edge = long_edge
+        # called with the image and the list returned by `render_presets` after the previews were rendered
+        self.on_render = None
+        self._busy = busy or (lambda: False)
+        self._condition = threading.Condition()
+        self._request = None  # (image, params) to render next
+        self._rendering = False
+        self._closed = False
+        self._proxy = None
+        self._proxy_source = None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def update(self, image, params):
+        """
+        Requests the previews of an image with the presets applied to parameters.
+
+        :param image: The RawImage being edited.
+        :param params: The edited parameters, copied so later edits do not change the request.
+        """
+        with self._condition:
+            self._request = (image, params.copy())
+            self._condition.notify_all()
+
+    def close(self):
+        """
+        Stops the background thread, e.g. when the session of the strip is closed.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Waits until the latest request is rendered.
+
+        :param timeout: The maximum number of seconds to wait, no limit if None.
+        :return: True if no request is left.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._request is None and not self._rendering, timeout)
+
+    def proxy(self, image):
+        """
+        Returns the proxy of an image the previews are rendered from, created once per linear image.
+
+        :param image: The RawImage being edited.
+        :return: A PreviewImage.
+        """
+        if self._proxy_source is not image.raw_image:
+            self._proxy = PreviewImage(getattr(image, 'file_path', None), image.create_proxy(self.long_edge))
+            self._proxy_source = image.raw_image
+        return self._proxy
+
+    def _run(self):
+        lower_thread_priority()
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._request is not None or self._closed)
+                if self._closed:
+                    return
+                (image, params), self._request = self._request, None
+                self._rendering = True
+            try:
+                while self._busy():
+                    time.sleep(0.05)
+                previews = render_presets(self.proxy(image), params, self.presets)
+                if self.on_render is not None:
+                    self.on_render(image, previews)
+            except Exception:  # e.g. the image was closed, the old previews are kept
+                pass
+            finally:
+                with self._condition:
+                    self._rendering = False
+                    self._condition.notify_all()
@@ -0,0 +1,160 @@
+import atexit
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import compute_backends
+from config import RENDER_PROCESSES, RENDER_SHARED_IMAGES
+from ImageProcessing import PreviewImage, RawImage
+
+
+# Shared memory name -> (SharedMemory, PreviewImage) of the images attached by a worker process
+_attached = {}
+
+
+def _attach(name, shape, dtype, live):
+    """
+    Wraps a linear image in shared memory into a PreviewImage, without copying it.
+
+    Runs in a worker process. The images stay attached for the next frames as long as the
+    backend keeps them shared, the others are detached so their memory can be freed.
+
+    :param name: The name of the shared memory block.
+    :param shape: The shape of the image.
+    :param dtype: The data type of the image.
+    :param live: The names of all shared memory blocks the backend currently keeps.
+    :return: The PreviewImage.
+    """
+    for old_name in [_ for _ in _attached if _ not in live]:
+        shm, image_object = _attached.pop(old_name)
+        image_object.raw_image = None  # the buffer cannot be closed while an array uses it
+        shm.close()
+    if name not in _attached:
+        shm = shared_memory.SharedMemory(name=name)
+        raw_image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        _attached[name] = (shm, PreviewImage(None, raw_image))
+    return _attached[name][1]
+
+
+def _render_shared(name, shape, dtype, live, params, path, region=None):
+    """
+    Renders a linear image in shared memory and saves the frame, see `ProcessRenderBackend`.
+
+    Runs in a worker process.
+    """
+    image_object = _attach(name, shape, dtype, live)
+    RawImage.save_image(image_object.render_region(params, region), path)
+
+
+class _SharedImage:
+    """
+    A copy of a linear image in shared memory, unlinked once it is evicted and no frame uses it.
+    """
+    def __init__(self, raw_image):
+        self.source = raw_image
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, raw_image.nbytes))
+        self.shape = raw_image.shape
+        self.dtype = raw_image.dtype.str
+        np.ndarray(self.shape, dtype=raw_image.dtype, buffer=self.shm.buf)[...] = raw_image
+        self.users = 0
+        self.retired = False
+
+    def unlink(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ProcessRenderBackend:
+    """
+    A render backend of ImageProcessorThread which renders and encodes frames in worker processes.
+
+    The GIL-bound parts of a frame, such as the Python glue between the numpy steps and the
+    PIL encode, no longer compete with the UI for the interpreter. The linear image is copied
+    into shared memory once when a new image is rendered, so a frame only sends its name and
+    the parameters to the worker and nothing is pickled or copied per frame. The images rendered
+    last are kept shared, so sessions of the web server editing different images do not copy
+    theirs again for every frame. Workers are started with `spawn` on every platform.
+    """
+    def __init__(self, processes=RENDER_PROCESSES, images=RENDER_SHARED_IMAGES):
+        """
+        Initializes the backend, the worker processes are started with the first frame and use
+        the compute backends selected at this time.
+
+        :param processes: The number of worker processes.
+        :param images: The number of images kept in shared memory.
+        """
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+            initializer=compute_backends.select, initargs=(compute_backends.selection(),)
+        )
+        self._lock = threading.Lock()
+        self._images = images
+        # id() of the linear image -> its _SharedImage, least recently rendered first
+        self._shared = OrderedDict()
+        self._closed = False
+        atexit.register(self.close)
+
+    def _acquire(self, image_object):
+        """
+        Returns the shared copy of the linear image of an image, creating it for a new image, and
+        the names of all shared copies kept.
+        """
+        with self._lock:
+            key = id(image_object.raw_image)
+            shared = self._shared.get(key)
+            # the source is kept by the copy, so its id() cannot be reused by another array
+            if shared is None or shared.source is not image_object.raw_image:
+                shared = _SharedImage(image_object.raw_image)
+                self._shared[key] = shared
+                while len(self._shared) > self._images:
+                    self._retire(self._shared.popitem(last=False)[1])
+            self._shared.move_to_end(key)
+            shared.users += 1
+            return shared, tuple(_.shm.name for _ in self._shared.values())
+
+    @staticmethod
+    def _retire(shared):
+        shared.retired = True
+        if shared.users == 0:
+            shared.unlink()
+
+    def _release(self, shared):
+        with self._lock:
+            shared.users -= 1
+            if shared.retired and shared.users == 0:
+                shared.unlink()
+
+    def render_to_file(self, image_object, params, path, region=None):
+        """
+        Renders an image in a worker process and waits until the frame is saved.
+
+        :param image_object: The image to render.
+        :param params: Parameters used for rendering the image.
+        :param path: The destination path of the frame, its extension selects the format.
+        :param region: The (top, left, height, width) of the region to render, the whole image if None.
+        """
+        shared, live = self._acquire(image_object)
+        try:
+            self._executor.submit(
+                _render_shared, shared.shm.name, shared.shape, shared.dtype, live, params.copy(), path, region
+            ).result()
+        finally:
+            self._release(shared)
+
+    def close(self):
+        """
+        Stops the worker processes and frees the shared memory.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for shared in self._shared.values():
+                self._retire(shared)
+            self._shared.clear()
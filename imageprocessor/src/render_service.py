@@ -0,0 +1,327 @@
+import hashlib
+import io
+import json
+import re
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+from config import PROXY_LONG_EDGE, RENDER_SERVICE_IMAGES, RENDER_SERVICE_PORT, RENDER_SERVICE_PREVIEWS, \
+    THUMBNAIL_SIZES
+from data import PARAMETER_COLUMNS, Database
+from ImageProcessing import ImageProcessorThread, Parameter, PreviewImage, RawImage
+from prefetch import Prefetcher, file_version
+from strip_export import PngStripWriter, render_strips
+from thumbnail_store import ThumbnailStore
+
+
+class ChunkedWriter:
+    """
+    A binary file object which sends everything written to it as HTTP/1.1 chunks.
+    """
+    def __init__(self, file):
+        """
+        :param file: The file object of the response, e.g. `BaseHTTPRequestHandler.wfile`.
+        """
+        self._file = file
+
+    def write(self, data):
+        if data:
+            self._file.write(b'%x\r\n%s\r\n' % (len(data), data))
+        return len(data)
+
+    def close(self):
+        """
+        Sends the last chunk, which ends the response.
+        """
+        self._file.write(b'0\r\n\r\n')
+
+
+class RenderService:
+    """
+    Renders the images of the library for other tools through a local HTTP API, without the GUI.
+
+    Endpoints:
+      GET /images                      the catalog as JSON, with the stored parameters of every image
+      GET /images/<id>/thumbnail?size= the stored JPEG thumbnail
+      GET /images/<id>/preview?size=   a JPEG rendered at the given long edge
+      GET /images/<id>/export?bit_depth= the full resolution render as a PNG, streamed strip by strip
+
+    Previews and exports use the stored parameters of the image, any of which can be overridden
+    by a query parameter of the same name, e.g. `?exposure=0.5`. Every response has an ETag
+    derived from the image, its file and the parameters, so a client sending it back in
+    If-None-Match gets a 304 without anything being rendered. Decoded images and previews are
+    shared by all requests, so after the first request of an image none decodes it again.
+    Renders are admitted through `ImageProcessorThread.render_slots`, so requests served in
+    parallel never render more than `RENDER_WORKERS` images at the same time.
+    """
+    def __init__(self, database, thumbnail_store, prefetcher=None, images=RENDER_SERVICE_IMAGES,
+                 previews=RENDER_SERVICE_PREVIEWS):
+        """
+        Initializes the service.
+
+        :param database: The Database holding the images and their parameters.
+        :param thumbnail_store: The ThumbnailStore of the library.
+        :param prefetcher: The Prefetcher which decodes and keeps the raw files, a new one by default.
+        :param images: The number of recently requested images kept decoded.
+        :param previews: The number of encoded previews kept in memory.
+        """
+        self.database = database
+        self.thumbnail_store = thumbnail_store
+        self.prefetcher = prefetcher if prefetcher is not None else Prefetcher()
+        self.images = images
+        self.previews = previews
+        self._lock = threading.Lock()
+        self._recent = []  # paths of the recently requested images, most recent first
+        self._proxies = OrderedDict()  # (path, long edge) -> PreviewImage, least recently used first
+        self._encoded = OrderedDict()  # ETag -> JPEG bytes, least recently used first
+
+    def catalog(self):
+        """
+        Returns the images of the library.
+
+        :return: A list of dictionaries with the ID, path and parameters of every image.
+        """
+        rows = self.database.select('images', ['id', 'path'] + PARAMETER_COLUMNS)
+        return [
+            {'id': row[0], 'path': row[1], 'parameters': dict(zip(PARAMETER_COLUMNS, row[2:]))}
+            for row in rows
+        ]
+
+    def image(self, image_id, overrides=None):
+        """
+        Reads the path and the parameters of an image.
+
+        :param image_id: The ID of the image.
+        :param overrides: A dictionary of parameter names and values replacing the stored ones.
+        :return: A tuple (path, Parameter), or None if the image does not exist.
+        """
+        row = self.database.select('images', ['path'] + PARAMETER_COLUMNS, 'id = ?', (image_id,))
+        if not row:
+            return None
+        values = dict(zip(PARAMETER_COLUMNS, row[0][1:]))
+        values.update(overrides or {})
+        return row[0][0], Parameter(*(values[_] for _ in PARAMETER_COLUMNS))
+
+    @staticmethod
+    def etag(*key):
+        """
+        Returns the quoted ETag of a response.
+
+        :param key: The values the response depends on, e.g. the kind of response, the image and its parameters.
+        :return: The ETag.
+        """
+        return '"' + hashlib.sha1(repr(key).encode()).hexdigest() + '"'
+
+    @staticmethod
+    def file_version(path):
+        """
+        Returns what changes when a raw file is replaced, so renders of the old file are not reused.
+        """
+        return file_version(path)
+
+    @staticmethod
+    def parameter_key(params):
+        return tuple(getattr(params, _) for _ in PARAMETER_COLUMNS)
+
+    def decoded(self, path):
+        """
+        Returns the decoded raw file, keeping the recently requested ones.
+
+        :param path: The path of the raw file.
+        :return: The RawImage.
+        """
+        with self._lock:
+            self._recent = ([path] + [_ for _ in self._recent if _ != path])[:self.images]
+            recent = list(self._recent)
+        image = self.prefetcher.get(path)
+        self.prefetcher.prefetch(recent, owner=self)
+        return image
+
+    def proxy(self, path, long_edge):
+        """
+        Returns the image downscaled to a long edge, created once per image and size.
+
+        :param path: The path of the raw file.
+        :param long_edge: The long edge in pixels.
+        :return: A PreviewImage.
+        """
+        key = (path, self.file_version(path), long_edge)
+        with self._lock:
+            proxy = self._proxies.get(key)
+            if proxy is not None:
+                self._proxies.move_to_end(key)
+                return proxy
+        proxy = PreviewImage(path, self.decoded(path).create_proxy(long_edge))
+        with self._lock:
+            self._proxies[key] = proxy
+            while len(self._proxies) > self.images:
+                self._proxies.popitem(last=False)
+        return proxy
+
+    def preview(self, path, params, long_edge, etag):
+        """
+        Renders an image at a long edge and encodes it as JPEG, or returns the cached encoding.
+
+        :param path: The path of the raw file.
+        :param params: The parameters used for rendering.
+        :param long_edge: The long edge in pixels.
+        :param etag: The ETag of the preview, the key of the cache.
+        :return: The JPEG bytes.
+        """
+        with self._lock:
+            data = self._encoded.get(etag)
+            if data is not None:
+                self._encoded.move_to_end(etag)
+                return data
+        proxy = self.proxy(path, long_edge)
+        with ImageProcessorThread.render_slots:
+            frame = RawImage.quantize(proxy.render_image(params), np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(frame, mode='RGB').save(buffer, format='JPEG', quality=90)
+        data = buffer.getvalue()
+        with self._lock:
+            self._encoded[etag] = data
+            while len(self._encoded) > self.previews:
+                self._encoded.popitem(last=False)
+        return data
+
+    def export(self, path, params, file, bit_depth=8):
+        """
+        Renders an image at full resolution and writes it to a file object as a PNG, strip by strip.
+
+        A render slot is held for one strip at a time, so a slow client does not block other renders.
+
+        :param path: The path of the raw file.
+        :param params: The parameters used for rendering.
+        :param file: The binary file object the PNG is written to.
+        :param bit_depth: The bit depth of the PNG (8 or 16).
+        """
+        linear = self.decoded(path).raw_image
+        data_type = np.uint16 if bit_depth == 16 else np.uint8
+        writer = PngStripWriter(file, linear.shape[1], linear.shape[0], data_type)
+        strips = render_strips(linear, params)
+        while True:
+            with ImageProcessorThread.render_slots:
+                strip = next(strips, None)
+            if strip is None:
+                break
+            writer.write(RawImage.quantize(strip, data_type))
+        writer.close()
+
+    def serve(self, host='127.0.0.1', port=RENDER_SERVICE_PORT):
+        """
+        Creates the HTTP server of the service, each request is handled in its own thread.
+
+        :param host: The address to listen on, only local clients by default.
+        :param port: The port to listen on, 0 for any free port.
+        :return: The ThreadingHTTPServer, call its `serve_forever` to start serving.
+        """
+        handler = type('Handler', (RenderRequestHandler,), {'service': self})
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        return server
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the requests of a RenderService, see its documentation for the endpoints.
+    """
+    protocol_version = 'HTTP/1.1'
+    service = None
+    _route = re.compile(r'^/images/(\d+)/(thumbnail|preview|export)$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type='text/plain; charset=utf-8', etag=None):
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')  # revalidate, a 304 is cheap
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def _not_modified(self, etag):
+        if etag in self.headers.get('If-None-Match', ''):
+            self._send(304, etag=etag)
+            return True
+        return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == '/images':
+            return self._send(200, json.dumps(self.service.catalog()).encode(), 'application/json')
+        match = self._route.match(url.path)
+        if match is None:
+            return self._send(404, b'Not found')
+        try:
+            size = int(query.get('size', max(THUMBNAIL_SIZES) if match[2] == 'thumbnail' else PROXY_LONG_EDGE))
+            bit_depth = int(query.get('bit_depth', 8))
+            overrides = {_: float(query[_]) for _ in PARAMETER_COLUMNS if _ in query}
+        except ValueError:
+            return self._send(400, b'Invalid query parameter')
+        if size < 1 or bit_depth not in (8, 16):
+            return self._send(400, b'Invalid query parameter')
+        image_id = int(match[1])
+        image = self.service.image(image_id, overrides)
+        if image is None:
+            return self._send(404, b'Unknown image')
+        path, params = image
+        try:
+            getattr(self, '_' + match[2])(image_id, path, params, size, bit_depth)
+        except Exception as e:  # e.g. the raw file is missing or cannot be decoded
+            self._send(500, str(e).encode())
+
+    def _thumbnail(self, image_id, path, params, size, bit_depth):
+        data = self.service.thumbnail_store.get(image_id, size)
+        if data is None:
+            return self._send(404, b'No thumbnail')
+        # a thumbnail is rewritten a while after the parameters changed, so its ETag follows its content
+        etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+        if not self._not_modified(etag):
+            self._send(200, data, 'image/jpeg', etag)
+
+    def _preview(self, image_id, path, params, size, bit_depth):
+        etag = self.service.etag(
+            'preview', image_id, path, self.service.file_version(path), self.service.parameter_key(params), size
+        )
+        if not self._not_modified(etag):
+            self._send(200, self.service.preview(path, params, size, etag), 'image/jpeg', etag)
+
+    def _export(self, image_id, path, params, size, bit_depth):
+        etag = self.service.etag(
+            'export', image_id, path, self.service.file_version(path), self.service.parameter_key(params), bit_depth
+        )
+        if self._not_modified(etag):
+            return
+        self.service.decoded(path)  # errors are reported before the response starts
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        writer = ChunkedWriter(self.wfile)
+        try:
+            self.service.export(path, params, writer, bit_depth)
+        except Exception:  # the response already started, ending it without the last chunk tells the client
+            self.close_connection = True
+            return
+        writer.close()
+
+
+if __name__ == '__main__':
+    database = Database()
+    service = RenderService(database, ThumbnailStore(database))
+    print(f'Serving renders on http://127.0.0.1:{RENDER_SERVICE_PORT}/images')
+    service.serve().serve_forever()
@@ -0,0 +1,258 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from config import EXPORT_STRIP_ROWS
+from ImageProcessing import RawImage
+
+
+class PngStripWriter:
+    """
+    Writes an RGB PNG file row by row, so the whole image never has to be in memory.
+
+    Rows are filtered with the PNG Sub filter and compressed as they arrive.
+    """
+    def __init__(self, path, width, height, data_type, compress_level=6):
+        """
+        Creates the file and writes the PNG header.
+
+        :param path: The destination path, or a binary file object the PNG is streamed to.
+        :param width: The image width in pixels.
+        :param height: The image height in pixels.
+        :param data_type: np.uint8 or np.uint16.
+        :param compress_level: The zlib compression level.
+        """
+        self._owns_file = isinstance(path, (str, os.PathLike))
+        self._file = open(path, 'wb') if self._owns_file else path
+        self._bytes_per_pixel = 3 * np.dtype(data_type).itemsize
+        self._compressor = zlib.compressobj(compress_level)
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8 * np.dtype(data_type).itemsize, 2, 0, 0, 0))
+
+    def _chunk(self, chunk_type, data):
+        self._file.write(struct.pack('>I', len(data)) + chunk_type + data)
+        self._file.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+    def write(self, rows):
+        """
+        Appends rows to the image.
+
+        :param rows: An array of shape (rows, width, 3).
+        """
+        rows = np.ascontiguousarray(rows.astype(rows.dtype.newbyteorder('>'), copy=False))
+        rows = rows.view(np.uint8).reshape(rows.shape[0], -1)
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 1  # Sub filter: each byte minus the byte of the previous pixel
+        filtered[:, 1:self._bytes_per_pixel + 1] = rows[:, :self._bytes_per_pixel]
+        np.subtract(rows[:, self._bytes_per_pixel:], rows[:, :-self._bytes_per_pixel],
+                    out=filtered[:, self._bytes_per_pixel + 1:])
+        data = self._compressor.compress(filtered.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+
+    def close(self):
+        """
+        Finishes and closes the file.
+        """
+        self._chunk(b'IDAT', self._compressor.flush())
+        self._chunk(b'IEND', b'')
+        if self._owns_file:
+            self._file.close()
+
+    def discard(self):
+        """
+        Closes and deletes the unfinished file. A file object passed in is left to its owner.
+        """
+        if self._owns_file:
+            self._file.close()
+            os.remove(self._file.name)
+
+
+class TiffStripWriter:
+    """
+    Writes an uncompressed RGB TIFF file row by row, so the whole image never has to be in memory.
+
+    The pixel data is a single strip following the header, its size is known in advance.
+    """
+    def __init__(self, path, width, height, data_type):
+        """
+        Creates the file and writes the TIFF header.
+
+        :param path: The destination path.
+        :param width: The image width in pixels.
+        :param height: The image height in pixels.
+        :param data_type: np.uint8 or np.uint16.
+        """
+        self._file = open(path, 'wb')
+        self._data_type = np.dtype(data_type).newbyteorder('<')
+        bits = 8 * self._data_type.itemsize
+        entries = [
+            (256, 4, width),  # ImageWidth
+            (257, 4, height),  # ImageLength
+            (258, 3, None),  # BitsPerSample, three values stored after the IFD
+            (259, 3, 1),  # Compression: none
+            (262, 3, 2),  # PhotometricInterpretation: RGB
+            (273, 4, None),  # StripOffsets, the data follows the IFD
+            (277, 3, 3),  # SamplesPerPixel
+            (278, 4, height),  # RowsPerStrip
+            (279, 4, width * height * 3 * self._data_type.itemsize),  # StripByteCounts
+            (284, 3, 1),  # PlanarConfiguration: chunky
+        ]
+        ifd_size = 2 + 12 * len(entries) + 4
+        bits_offset = 8 + ifd_size
+        data_offset = bits_offset + 6
+        header = b'II' + struct.pack('<HI', 42, 8) + struct.pack('<H', len(entries))
+        for tag, type_, value in entries:
+            if tag == 258:
+                header += struct.pack('<HHII', tag, type_, 3, bits_offset)
+            elif tag == 273:
+                header += struct.pack('<HHII', tag, type_, 1, data_offset)
+            elif type_ == 3:
+                header += struct.pack('<HHIHH', tag, type_, 1, value, 0)
+            else:
+                header += struct.pack('<HHII', tag, type_, 1, value)
+        header += struct.pack('<I', 0) + struct.pack('<HHH', bits, bits, bits)
+        self._file.write(header)
+
+    def write(self, rows):
+        """
+        Appends rows to the image.
+
+        :param rows: An array of shape (rows, width, 3).
+        """
+        self._file.write(np.ascontiguousarray(rows, dtype=self._data_type).tobytes())
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        self._file.close()
+
+    def discard(self):
+        """
+        Closes and deletes the unfinished file.
+        """
+        self._file.close()
+        os.remove(self._file.name)
+
+
+class ImageStripWriter:
+    """
+    Collects rows in an 8-bit image and saves it with PIL when closed.
+
+    Used for formats without a streaming encoder, such as JPEG. Only the 8-bit output is kept
+    in memory, not the float intermediates of the render pipeline.
+    """
+    def __init__(self, path, width, height):
+        """
+        Creates the output image.
+
+        :param path: The destination path.
+        :param width: The image width in pixels.
+        :param height: The image height in pixels.
+        """
+        self._path = path
+        self._image = Image.new('RGB', (width, height))
+        self._row = 0
+
+    def write(self, rows):
+        """
+        Appends rows to the image.
+
+        :param rows: A uint8 array of shape (rows, width, 3).
+        """
+        self._image.paste(Image.fromarray(rows, mode='RGB'), (0, self._row))
+        self._row += rows.shape[0]
+
+    def close(self):
+        """
+        Saves the image.
+        """
+        self._image.save(self._path)
+
+    def discard(self):
+        """
+        Drops the unfinished image, nothing was written yet.
+        """
+        self._image = None
+
+
+def open_strip_writer(path, width, height, data_type):
+    """
+    Returns a writer for the format selected by the extension of the path.
+
+    :param path: The destination path.
+    :param width: The image width in pixels.
+    :param height: The image height in pixels.
+    :param data_type: np.uint8 or np.uint16, as returned by `RawImage.output_type`.
+    :return: A PngStripWriter, TiffStripWriter or ImageStripWriter.
+    """
+    extension = path.lower().rsplit('.', 1)[-1]
+    if extension == 'png':
+        return PngStripWriter(path, width, height, data_type)
+    if extension in ('tif', 'tiff'):
+        return TiffStripWriter(path, width, height, data_type)
+    return ImageStripWriter(path, width, height)
+
+
+def render_strips(linear, params, strip_rows=EXPORT_STRIP_ROWS):
+    """
+    Renders a linear image in horizontal strips.
+
+    The tone plane of the whole image is created once and every strip is rendered with
+    `RawImage.render_window`, so the strips are identical to the rows of `render_image`
+    and no rows of the neighbouring strips are needed.
+
+    :param linear: The linear image, a uint16 array as returned by `RawImage.decode` or a float array.
+    :param params: The parameters used for rendering.
+    :param strip_rows: The number of rows per strip.
+    :return: A generator of rendered strips.
+    """
+    height = linear.shape[0]
+    tone_plane = RawImage.create_tone_plane(linear)
+    for top in range(0, height, strip_rows):
+        strip = linear[top:top + strip_rows]
+        if strip.dtype == np.uint16:
+            strip = strip.astype(np.float32) / 65535.0
+        yield RawImage.render_window(strip, params, tone_plane, (top, 0), linear.shape[:2])
+
+
+def write_strips(linear, params, path, bit_depth=8, strip_rows=EXPORT_STRIP_ROWS):
+    """
+    Renders a linear image strip by strip and writes each strip to the output file as it goes.
+
+    :param linear: The linear image, see `render_strips`.
+    :param params: The parameters used for rendering.
+    :param path: The destination path, its extension selects the format.
+    :param bit_depth: The bit depth to save the image in (8 or 16).
+    :param strip_rows: The number of rows per strip.
+    """
+    data_type = RawImage.output_type(path, bit_depth)
+    height, width = linear.shape[:2]
+    writer = open_strip_writer(path, width, height, data_type)
+    try:
+        for strip in render_strips(linear, params, strip_rows):
+            writer.write(RawImage.quantize(strip, data_type))
+    except BaseException:
+        writer.discard()
+        raise
+    writer.close()
+
+
+def export_image(raw_path, params, path, bit_depth=8, strip_rows=EXPORT_STRIP_ROWS):
+    """
+    Exports a raw file at full resolution with bounded memory.
+
+    Only the 16-bit decode is kept for the whole image, the float32 render pipeline runs on
+    one strip at a time.
+
+    :param raw_path: Path to the raw image file.
+    :param params: The parameters used for rendering.
+    :param path: The destination path, its extension selects the format.
+    :param bit_depth: The bit depth to save the image in (8 or 16).
+    :param strip_rows: The number of rows per strip.
+    """
+    write_strips(RawImage.decode(raw_path), params, path, bit_depth, strip_rows)
@@ -0,0 +1,236 @@
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from config import THUMBNAIL_PROXY_LONG_EDGE, THUMBNAIL_SIZES
+from data import PARAMETER_COLUMNS
+from ImageProcessing import HalfSizeImage, Parameter, PreviewImage, RawImage
+from prefetch import lower_thread_priority
+from thumbnail_store import encode_thumbnails
+
+
+def render_thumbnails(proxy, params, sizes=THUMBNAIL_SIZES):
+    """
+    Renders a linear proxy with the given parameters and encodes it as thumbnails.
+
+    :param proxy: The linear proxy image.
+    :param params: The parameters used for rendering.
+    :param sizes: Long edge sizes in pixels of the thumbnails to create.
+    :return: A dictionary mapping each size to the encoded JPEG bytes.
+    """
+    frame = PreviewImage(None, proxy).render_image(params)
+    return encode_thumbnails(Image.fromarray(RawImage.quantize(frame, np.uint8), mode='RGB'), sizes)
+
+
+class ThumbnailRenderer:
+    """
+    Renders the thumbnails of the library with the stored parameters of each image.
+
+    A small linear proxy of every image is kept on disk, so after the parameters of an image
+    changed its thumbnails are rendered from the proxy in a background thread instead of
+    decoding the raw file again. Scheduled images are rendered at low priority while the
+    render thread is idle, and edits can be scheduled with a delay, so a series of edits
+    to the same image renders its thumbnails once. Proxies missing for images imported
+    before are created from a half size decode the first time they are needed.
+    """
+    def __init__(self, database, thumbnail_store, directory, busy=None, decoder=HalfSizeImage,
+                 long_edge=THUMBNAIL_PROXY_LONG_EDGE):
+        """
+        Initializes the renderer, its daemon thread is started when the first image is scheduled.
+
+        :param database: The Database holding the images and their parameters.
+        :param thumbnail_store: The ThumbnailStore the thumbnails are written to.
+        :param directory: The folder where the proxies are stored.
+        :param busy: A function returning True while rendering should wait, e.g. while a frame is rendered.
+        :param decoder: Creates the linear image of a raw file from its path, HalfSizeImage by default.
+        :param long_edge: The long edge of the proxies in pixels.
+        """
+        self.database = database
+        self.thumbnail_store = thumbnail_store
+        self.directory = directory
+        self.long_edge = long_edge
+        # called with the image ID after the thumbnails of a scheduled image were rewritten, see `add_listener`
+        self._listeners = []
+        self._busy = busy or (lambda: False)
+        self._decoder = decoder
+        self._condition = threading.Condition()
+        self._scheduled = {}  # image ID -> time.monotonic() after which it is rendered
+        self._rendering = None
+        self._thread = None
+
+    def add_listener(self, callback):
+        """
+        Registers a function called with the image ID after the thumbnails of a scheduled image
+        were rewritten, e.g. by every session showing the library.
+
+        :param callback: The function to call.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """
+        Unregisters a function registered with `add_listener`.
+
+        :param callback: The function to remove, ignored if it is not registered.
+        """
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _path(self, image_id):
+        return os.path.join(self.directory, f'{image_id}.npy')
+
+    def load_proxy(self, image_id):
+        """
+        Loads the stored proxy of an image.
+
+        :param image_id: The ID of the image.
+        :return: The linear proxy as a float32 array, or None if it is not stored.
+        """
+        try:
+            return np.load(self._path(image_id)).astype(np.float32)
+        except (OSError, ValueError):
+            return None
+
+    def save_proxy(self, image_id, proxy):
+        """
+        Stores the proxy of an image as float16.
+
+        :param image_id: The ID of the image.
+        :param proxy: The linear proxy image.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = self._path(image_id) + '.tmp'
+        with open(temp_path, 'wb') as file:
+            np.save(file, proxy.astype(np.float16))
+        os.replace(temp_path, self._path(image_id))
+
+    def create_proxy(self, image_id, image_path):
+        """
+        Decodes a raw file, stores its proxy and returns it.
+
+        :param image_id: The ID of the image.
+        :param image_path: The path of the raw file.
+        :return: The linear proxy image.
+        """
+        proxy = self._decoder(image_path).create_proxy(self.long_edge)
+        self.save_proxy(image_id, proxy)
+        return proxy
+
+    def params(self, image_ids):
+        """
+        Reads the stored parameters of images.
+
+        :param image_ids: A list of image IDs.
+        :return: A dictionary mapping the ID of every existing image to its Parameter.
+        """
+        placeholders = ', '.join('?' for _ in image_ids)
+        rows = self.database.select(
+            'images', ['id'] + PARAMETER_COLUMNS, f'id IN ({placeholders})', tuple(image_ids)
+        )
+        return {row[0]: Parameter(*row[1:]) for row in rows}
+
+    def create(self, image_id, image_path):
+        """
+        Creates the proxy and the thumbnails of an image now, e.g. right after it was imported.
+
+        :param image_id: The ID of the image.
+        :param image_path: The path of the raw file.
+        """
+        proxy = self.create_proxy(image_id, image_path)
+        params = self.params([image_id]).get(image_id, Parameter())
+        self.thumbnail_store.put(image_id, render_thumbnails(proxy, params))
+
+    def schedule(self, image_ids, delay=0):
+        """
+        Queues images whose thumbnails are rendered again in the background thread.
+
+        Scheduling an image again before it was rendered restarts its delay, it is rendered
+        once with its latest parameters.
+
+        :param image_ids: A list of image IDs.
+        :param delay: The number of seconds to wait before rendering, e.g. `THUMBNAIL_RENDER_DELAY`
+                      after an edit which may be followed by more edits.
+        """
+        due = time.monotonic() + delay
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            for image_id in image_ids:
+                self._scheduled[image_id] = due
+            self._condition.notify_all()
+
+    def delete(self, image_ids):
+        """
+        Drops the proxies of images and unschedules them, e.g. after their file changed or they were deleted.
+
+        :param image_ids: A list of image IDs.
+        """
+        with self._condition:
+            for image_id in image_ids:
+                self._scheduled.pop(image_id, None)
+                try:
+                    os.remove(self._path(image_id))
+                except FileNotFoundError:
+                    pass
+
+    def wait(self, timeout=None):
+        """
+        Waits until all scheduled images are rendered.
+
+        :param timeout: The maximum number of seconds to wait, no limit if None.
+        :return: True if all scheduled images are rendered.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._scheduled and self._rendering is None, timeout
+            )
+
+    def _render(self, image_id):
+        params = self.params([image_id]).get(image_id)
+        if params is None:  # deleted in the meantime
+            return
+        proxy = self.load_proxy(image_id)
+        if proxy is None:
+            row = self.database.select('images', ['path'], 'id = ?', (image_id,))
+            if not row:
+                return
+            proxy = self.create_proxy(image_id, row[0][0])
+        self.thumbnail_store.put(image_id, render_thumbnails(proxy, params))
+        for listener in list(self._listeners):
+            listener(image_id)
+
+    def _next_image(self):
+        """
+        Waits until a scheduled image is due and unschedules it.
+
+        :return: The ID of the image scheduled first among the due ones.
+        """
+        with self._condition:
+            while True:
+                self._condition.wait_for(lambda: self._scheduled)
+                image_id = min(self._scheduled, key=self._scheduled.get)
+                remaining = self._scheduled[image_id] - time.monotonic()
+                if remaining <= 0:
+                    del self._scheduled[image_id]
+                    self._rendering = image_id
+                    return image_id
+                self._condition.wait(remaining)
+
+    def _run(self):
+        lower_thread_priority()
+        while True:
+            image_id = self._next_image()
+            try:
+                while self._busy():
+                    time.sleep(0.05)
+                self._render(image_id)
+            except Exception:  # e.g. the raw file is missing, the old thumbnails are kept
+                pass
+            finally:
+                with self._condition:
+                    self._rendering = None
+                    self._condition.notify_all()
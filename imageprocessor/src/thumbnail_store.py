@@ -0,0 +1,163 @@
+import base64
+import io
+import os
+
+from PIL import Image
+
+from config import THUMBNAIL_SIZES
+from data import Database
+
+
+def encode_thumbnails(image, sizes=THUMBNAIL_SIZES, quality=85):
+    """
+    Encodes a PIL image as JPEG thumbnails in several sizes.
+
+    The image is shrunk progressively from the largest size to the smallest, so
+    every size is resampled from the previous one instead of the full image.
+
+    :param image: The PIL image to create the thumbnails from. It is resized in place.
+    :param sizes: Long edge sizes in pixels of the thumbnails to create.
+    :param quality: JPEG quality of the encoded thumbnails.
+    :return: A dictionary mapping each size to the encoded JPEG bytes.
+    """
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    thumbnails = {}
+    for size in sorted(sizes, reverse=True):
+        image.thumbnail((size, size))
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality)
+        thumbnails[size] = buffer.getvalue()
+    return thumbnails
+
+
+class ThumbnailStore:
+    """
+    Stores the thumbnails of every image as JPEG BLOBs in the application database.
+
+    Each image keeps one thumbnail per size in `THUMBNAIL_SIZES`, so the library
+    reads only the bytes it displays and no file is created per image.
+    """
+    def __init__(self, database=None):
+        """
+        Initializes the store on top of the given database.
+
+        :param database: The Database holding the thumbnails table, defaults to the singleton.
+        """
+        self.database = database if database is not None else Database()
+
+    def put(self, image_id, thumbnails, commit=True):
+        """
+        Stores the thumbnails of an image, replacing the existing ones of the same size.
+
+        :param image_id: The ID of the image the thumbnails belong to.
+        :param thumbnails: A dictionary mapping the thumbnail size to the encoded JPEG bytes.
+        :param commit: Whether to wait until the thumbnails are committed.
+        """
+        self.database.executemany(
+            'INSERT OR REPLACE INTO thumbnails (image_id, size, data) VALUES (?, ?, ?)',
+            [(image_id, size, data) for size, data in thumbnails.items()],
+            commit=commit
+        )
+
+    def get(self, image_id, size):
+        """
+        Retrieves the smallest stored thumbnail that is at least `size` pixels on its long edge.
+
+        Falls back to the largest stored thumbnail if none is big enough.
+
+        :param image_id: The ID of the image.
+        :param size: The requested long edge size in pixels.
+        :return: The encoded JPEG bytes, or None if the image has no thumbnail.
+        """
+        row = self.database.execute(
+            'SELECT data FROM thumbnails WHERE image_id = ? AND size >= ? ORDER BY size LIMIT 1',
+            (image_id, size)
+        ).fetchone()
+        if row is None:
+            row = self.database.execute(
+                'SELECT data FROM thumbnails WHERE image_id = ? ORDER BY size DESC LIMIT 1',
+                (image_id,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def get_base64(self, image_id, size):
+        """
+        Retrieves a thumbnail encoded as a base64 string, ready for `ft.Image.src_base64`.
+
+        :param image_id: The ID of the image.
+        :param size: The requested long edge size in pixels.
+        :return: The base64 encoded thumbnail, or None if the image has no thumbnail.
+        """
+        data = self.get(image_id, size)
+        return None if data is None else base64.b64encode(data).decode('utf-8')
+
+    def has(self, image_id):
+        """
+        Checks whether any thumbnail is stored for an image.
+
+        :param image_id: The ID of the image.
+        :return: True if at least one thumbnail is stored.
+        """
+        return self.database.execute(
+            'SELECT 1 FROM thumbnails WHERE image_id = ? LIMIT 1', (image_id,)
+        ).fetchone() is not None
+
+    def delete(self, image_ids, commit=True):
+        """
+        Deletes all thumbnails of the given images.
+
+        The space they used is reclaimed by the next `compact`.
+
+        :param image_ids: An image ID or a list of image IDs.
+        :param commit: Whether to wait until the deletion is committed.
+        """
+        if isinstance(image_ids, int):
+            image_ids = [image_ids]
+        self.database.executemany(
+            'DELETE FROM thumbnails WHERE image_id = ?', [(_,) for _ in image_ids], commit=commit
+        )
+
+    def compact(self, min_free_ratio=0.25):
+        """
+        Removes thumbnails of images that no longer exist and reclaims unused space.
+
+        The database file is only rewritten (VACUUM) when the free pages exceed
+        `min_free_ratio` of the file, so calling this on every start is cheap.
+
+        :param min_free_ratio: Fraction of free pages above which the file is rewritten.
+        :return: True if the database file was rewritten.
+        """
+        self.database.execute('DELETE FROM thumbnails WHERE image_id NOT IN (SELECT id FROM images)')
+        page_count = self.database.execute('PRAGMA page_count').fetchone()[0]
+        free_count = self.database.execute('PRAGMA freelist_count').fetchone()[0]
+        if page_count == 0 or free_count / page_count <= min_free_ratio:
+            return False
+        self.database.execute('VACUUM')
+        return True
+
+    def migrate_legacy(self, thumbnail_dir):
+        """
+        Moves thumbnails from the old one-JPEG-per-image folder into the store.
+
+        Every `<id>.jpg` file of an image without stored thumbnails is resized to all
+        sizes and stored, then the file is removed.
+
+        :param thumbnail_dir: The folder containing the old `<id>.jpg` thumbnails.
+        :return: The number of migrated thumbnails.
+        """
+        if not os.path.isdir(thumbnail_dir):
+            return 0
+        migrated = 0
+        for entry in os.scandir(thumbnail_dir):
+            image_id, extension = os.path.splitext(entry.name)
+            if extension != '.jpg' or not image_id.isdigit():
+                continue
+            image_id = int(image_id)
+            if not self.has(image_id):
+                with Image.open(entry.path) as image:
+                    self.put(image_id, encode_thumbnails(image), commit=False)
+            os.remove(entry.path)
+            migrated += 1
+        self.database.commit()
+        return migrated
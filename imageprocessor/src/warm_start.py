@@ -0,0 +1,116 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ImageProcessing import PreviewImage, RawImage
+
+
+class WarmStart:
+    """
+    Keeps the linear proxy and the last preview frame of the image being edited on disk.
+
+    At the next start the frame is shown immediately and editing works on the proxy while
+    the raw file is decoded in the background. Only the most recently edited image is kept.
+    """
+    def __init__(self, directory):
+        """
+        Initializes the warm start storage.
+
+        :param directory: The folder where the proxy and the frame are stored.
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._proxy = None  # (image_id, proxy) of the last saved proxy
+        # a single worker keeps background saves in the order they were requested
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _path(self, image_id, extension):
+        return os.path.join(self.directory, f'{image_id}.{extension}')
+
+    def save_proxy(self, image_id, proxy):
+        """
+        Stores the linear proxy of an image and drops the data of any other image.
+
+        :param image_id: The ID of the image.
+        :param proxy: The linear proxy image, stored as float16.
+        """
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for entry in os.scandir(self.directory):
+                if not entry.name.startswith(f'{image_id}.'):
+                    os.remove(entry.path)
+            temp_path = self._path(image_id, 'npy.tmp')
+            with open(temp_path, 'wb') as file:
+                np.save(file, proxy.astype(np.float16))
+            os.replace(temp_path, self._path(image_id, 'npy'))
+            self._proxy = (image_id, proxy)
+
+    def save_frame(self, image_id, params):
+        """
+        Renders the stored proxy of an image with the given parameters and stores it as the last frame.
+
+        Does nothing if no proxy is stored for the image.
+
+        :param image_id: The ID of the image.
+        :param params: The parameters the image is displayed with.
+        """
+        with self._lock:
+            if self._proxy is not None and self._proxy[0] == image_id:
+                proxy = self._proxy[1]
+            elif os.path.exists(self._path(image_id, 'npy')):
+                proxy = np.load(self._path(image_id, 'npy'))
+                self._proxy = (image_id, proxy)
+            else:
+                return
+            frame = PreviewImage(None, proxy).render_image(params)
+            temp_path = self._path(image_id, 'tmp.jpg')
+            RawImage.save_image(frame, temp_path)
+            os.replace(temp_path, self._path(image_id, 'jpg'))
+
+    def save_async(self, image_id, params, image_object=None):
+        """
+        Stores the last frame of an image in a background worker, see `save_frame`.
+
+        :param image_id: The ID of the image.
+        :param params: The parameters the image is displayed with, copied before returning.
+        :param image_object: If given, a proxy of this RawImage is created and stored first.
+        """
+        def save(params):
+            if image_object is not None:
+                self.save_proxy(image_id, image_object.create_proxy())
+            self.save_frame(image_id, params)
+        self._executor.submit(save, params.copy())
+
+    def invalidate(self, image_ids):
+        """
+        Drops the stored data if it belongs to one of the given images, e.g. after their file changed.
+
+        :param image_ids: A list of image IDs.
+        """
+        with self._lock:
+            if not os.path.isdir(self.directory):
+                return
+            for entry in os.scandir(self.directory):
+                if entry.name.split('.')[0] in {str(_) for _ in image_ids}:
+                    os.remove(entry.path)
+            if self._proxy is not None and self._proxy[0] in image_ids:
+                self._proxy = None
+
+    def load(self, image_id):
+        """
+        Loads the stored frame and proxy of an image.
+
+        :param image_id: The ID of the image.
+        :return: A tuple of the JPEG frame bytes and the linear proxy, or None if they are not stored.
+        """
+        with self._lock:
+            try:
+                with open(self._path(image_id, 'jpg'), 'rb') as file:
+                    frame = file.read()
+                proxy = np.load(self._path(image_id, 'npy'))
+            except (OSError, ValueError):
+                return None
+            self._proxy = (image_id, proxy)
+        return frame, proxy.astype(np.float32)
@@ -0,0 +1,23 @@
+import sys
+
+import pytest
+
+sys.path.append('imageprocessor/src')
+
+import data
+from data import Database
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    # Use a fresh database in a temporary folder instead of the user's library
+    monkeypatch.setattr(data, 'generate_persist_dir', lambda: str(tmp_path))
+    monkeypatch.setattr(Database, '_instance', None)
+    db_instance = Database()
+    yield db_instance
+    db_instance.close()
+
+
+@pytest.fixture
+def db(fresh_db):
+    return fresh_db
@@ -2,13 +2,17 @@ import sys
 import numpy as np
 from PIL import Image
 import os
-from unittest.mock import patch
+import base64
+import threading
+import time
+from unittest.mock import Mock, patch
 
 
 sys.path.append('imageprocessor/src')
 
 from main import create_control_area
-from ImageProcessing import RawImage, Parameter, EmptyImage, ImageProcessorThread
+from ImageProcessing import RawImage, Parameter, EmptyImage, HalfSizeImage, PreviewImage, ImageProcessorThread, \
+    FramePresenter, ThreadRenderBackend, Viewport
 
 #Parameter Tests
 
@@ -76,6 +80,95 @@ def test_RawImage_save_image(tmp_path):
     assert saved_image.size == (100, 100), "Saved image should have the correct dimensions"
     assert saved_image.mode == "RGB", "Saved image should be in RGB mode"
 
+def test_Parameter_copy():
+    param = Parameter(exposure=2, contrast=10, highlights=3, shadows=-2, black_levels=1)
+    copy = param.copy()
+    param.exposure = 0
+
+    assert copy is not param, "Copy should be a new object"
+    assert copy.exposure == 2, "Copy should not follow changes of the original"
+    assert (copy.contrast, copy.highlights, copy.shadows, copy.black_levels) == (10, 3, -2, 1)
+
+#PreviewImage Tests
+
+def test_PreviewImage_render():
+    linear = np.full((4, 6, 3), 0.25, dtype=np.float32)
+    preview = PreviewImage('image.CR3', linear)
+    result = preview.render_image(Parameter(exposure=1))
+
+    assert preview.file_path == 'image.CR3'
+    assert result.shape == (4, 6, 3), "Rendered preview should keep the proxy size"
+
+def test_create_proxy():
+    preview = PreviewImage(None, np.random.rand(400, 600, 3).astype(np.float32))
+
+    assert preview.create_proxy(long_edge=300).shape == (200, 300, 3), "Proxy should keep the aspect ratio"
+    assert preview.create_proxy(long_edge=1000).shape == (400, 600, 3), "Small images should not be upscaled"
+
+def test_render_window_matches_full_render():
+    linear = np.random.default_rng(0).random((60, 90, 3), dtype=np.float32)
+    params = Parameter(exposure=0.5, highlights=40, shadows=60)
+    tone_plane = RawImage.create_tone_plane(linear, long_edge=20)
+
+    full = RawImage.render_window(linear, params, tone_plane)
+    window = RawImage.render_window(linear[10:40, 25:70], params, tone_plane, (10, 25), (60, 90))
+
+    assert tone_plane.shape == (13, 20, 3)
+    assert np.allclose(window, full[10:40, 25:70], atol=1e-6), "A window should render like the same pixels of the full image"
+
+def test_tone_maps_do_not_depend_on_resolution():
+    # a dark and a bright half, the shadows should be lifted the same at any resolution
+    linear = np.full((400, 600, 3), 0.02, dtype=np.float32)
+    linear[:, 300:] = 0.5
+    params = Parameter(shadows=80, highlights=-50)
+
+    full = PreviewImage(None, linear).render_image(params)
+    small = PreviewImage(None, PreviewImage(None, linear).create_proxy(long_edge=300)).render_image(params)
+    downscaled = PreviewImage(None, full.astype(np.float32)).create_proxy(long_edge=300)
+
+    assert np.abs(small - downscaled).mean() < 0.005
+
+def test_render_region_matches_full_render():
+    preview = PreviewImage(None, np.random.default_rng(1).random((80, 120, 3), dtype=np.float32))
+    params = Parameter(exposure=0.3, contrast=20, highlights=30, shadows=50)
+
+    region = preview.render_region(params, (20, 30, 40, 50))
+
+    assert region.shape == (40, 50, 3)
+    assert np.allclose(region, preview.render_image(params)[20:60, 30:80], atol=1e-6)
+
+def test_render_batch_matches_single_renders():
+    preview = PreviewImage(None, np.random.default_rng(2).random((50, 70, 3), dtype=np.float32))
+    params_list = [
+        Parameter(), Parameter(exposure=1), Parameter(shadows=50), Parameter(highlights=30, shadows=20),
+        Parameter(highlights=-40), Parameter(contrast=40, black_levels=-20), Parameter(contrast=40, black_levels=-20, shadows=10)
+    ]
+
+    rendered = preview.render_batch(params_list)
+
+    assert len(rendered) == len(params_list)
+    for params, result in zip(params_list, rendered):
+        assert np.array_equal(result, preview.render_image(params)), f"Batch render differs for {vars(params)}"
+
+def test_Viewport_region_stays_inside_image():
+    viewport = Viewport(200, 100)
+
+    assert viewport.region((1000, 2000, 3)) == (450, 900, 100, 200)
+    assert viewport.region((50, 80, 3)) == (0, 0, 50, 80), "A small image should be shown whole"
+
+    viewport.pan(5000, -5000, (1000, 2000, 3))
+    assert viewport.region((1000, 2000, 3)) == (900, 0, 100, 200)
+    viewport.pan(-100, 0, (1000, 2000, 3))
+    assert viewport.region((1000, 2000, 3)) == (900, 100, 100, 200), "Panning back should move the view at once"
+
+def test_ThreadRenderBackend_renders_region(tmp_path):
+    preview = PreviewImage(None, np.random.rand(80, 120, 3).astype(np.float32))
+
+    ThreadRenderBackend().render_to_file(preview, Parameter(), str(tmp_path / 'frame.tif'), (10, 20, 30, 40))
+
+    with Image.open(tmp_path / 'frame.tif') as frame:
+        assert frame.size == (40, 30)
+
 #EmptyImage Test 
 
 def test_EmptyImage():
@@ -116,6 +209,17 @@ def test_EmptyImage_save_image(tmp_path):
     assert saved_image.size == (100, 100), "Saved image should have the correct dimensions"
     assert saved_image.mode == "RGB", "Saved image should be in RGB mode"    
 
+@patch("ImageProcessing.rawpy.imread")
+def test_HalfSizeImage_init(mock_imread):
+    raw_file = mock_imread.return_value.__enter__.return_value
+    raw_file.postprocess.return_value = np.full((4, 6, 3), 65535, dtype=np.uint16)
+
+    image = HalfSizeImage("image.cr3")
+
+    assert raw_file.postprocess.call_args.kwargs["half_size"] is True, "Should decode at half size"
+    assert image.raw_image.dtype == np.float32
+    assert np.all(image.raw_image == 1.0), "Should be normalized like a full decode"
+
 #ImageProcessorThread Test
 
 @patch("ImageProcessing.TEMP_DIR", "/tmp")  # Mock TEMP_DIR for testing
@@ -130,3 +234,96 @@ def test_ImageProcessorThread_initialization():
     assert thread1 is thread2, "ImageProcessorThread should enforce singleton behavior"
 
 
+def wait_until(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_ImageProcessorThread_sessions_render_their_own_frames(tmp_path):
+    image = PreviewImage(None, np.full((20, 30, 3), 0.18, dtype=np.float32))
+    with patch("ImageProcessing.TEMP_DIR", str(tmp_path)):
+        sessions = [ImageProcessorThread.new_session(name) for name in ('a', 'b')]
+    assert sessions[0] is not sessions[1] and ImageProcessorThread() not in sessions
+
+    for session in sessions:
+        session.page = Mock(web=False)
+        session.process_image(image, Parameter(), Mock())
+    assert wait_until(lambda: all(_.frame_path for _ in sessions))
+
+    assert os.path.dirname(sessions[0].frame_path) == str(tmp_path / 'sessions' / 'a' / 'frames')
+    assert os.path.dirname(sessions[1].frame_path) == str(tmp_path / 'sessions' / 'b' / 'frames')
+    sessions[0].close()
+    assert wait_until(lambda: not (tmp_path / 'sessions' / 'a').exists()), "A closed session should remove its frames"
+    assert (tmp_path / 'sessions' / 'b' / 'temp.tif').exists()
+    sessions[1].close()
+
+
+def test_ImageProcessorThread_render_slots_bound_all_sessions(tmp_path, monkeypatch):
+    monkeypatch.setattr(ImageProcessorThread, 'render_slots', threading.BoundedSemaphore(1))
+    active, peak = [], []
+
+    class SlowBackend:
+        def render_to_file(self, image_object, params, path, region=None):
+            active.append(path)
+            peak.append(len(active))
+            time.sleep(0.05)
+            open(path, 'wb').close()
+            active.remove(path)
+
+    image = PreviewImage(None, np.zeros((4, 4, 3), dtype=np.float32))
+    with patch("ImageProcessing.TEMP_DIR", str(tmp_path)):
+        sessions = [ImageProcessorThread.new_session(name) for name in range(3)]
+    for session in sessions:
+        session.backend = SlowBackend()
+        session.presenter = Mock()
+        session.process_image(image, Parameter(), Mock())
+    assert wait_until(lambda: all(_.frame_path for _ in sessions))
+
+    assert max(peak) == 1, "No more frames than render slots should be rendered at the same time"
+    for session in sessions:
+        session.close()
+
+
+#FramePresenter Tests
+
+def test_FramePresenter_delivers_latest_frame_only(tmp_path):
+    presenter = FramePresenter(max_fps=5, delivery='file')
+    container, page = Mock(), Mock(web=False)
+    frames = []
+    for i in range(10):
+        frames.append(tmp_path / f'{i}.tif')
+        frames[-1].write_bytes(str(i).encode())
+        presenter.submit(str(frames[-1]), container, page)
+    time.sleep(0.5)
+
+    assert container.content.src == str(frames[-1]), "The newest frame should be shown"
+    assert container.content.src_base64 is None
+    assert presenter.presented <= 3, "Frames should be delivered at the capped rate"
+    assert presenter.presented + presenter.dropped == 10
+    assert frames[-1].exists() and not frames[1].exists(), "Outdated frames should be deleted"
+    container.content.update.assert_called()
+    page.update.assert_not_called()
+
+
+def test_FramePresenter_base64_delivery(tmp_path):
+    frame = tmp_path / 'frame.tif'
+    frame.write_bytes(b'frame')
+    container, page = Mock(), Mock(web=False)
+
+    FramePresenter(delivery='base64').show(str(frame), container, page, key='original')
+
+    assert container.content.src_base64 == base64.b64encode(b'frame').decode('utf-8')
+    assert container.content.key == 'original'
+
+
+def test_FramePresenter_falls_back_to_page_update(tmp_path):
+    frame = tmp_path / 'frame.tif'
+    frame.write_bytes(b'frame')
+    container, page = Mock(), Mock(web=False)
+    container.content.update.side_effect = AssertionError
+
+    FramePresenter(delivery='file').show(str(frame), container, page)
+
+    page.update.assert_called_once()
@@ -10,7 +10,7 @@ import httpx
 sys.path.append('imageprocessor/src')
 
 from ImageProcessing import Parameter
-from ai_integration import ImageAnalyzer
+from ai_integration import ImageAnalyzer, create_analyzer
 from ImageProcessing import Parameter
 
 def test_missing_api_key(monkeypatch):
@@ -50,6 +50,18 @@ def test_prepare_image(tmpdir):
     with Image.open(jpeg_path) as img:
         assert img.format == "JPEG", "Output file is not a valid JPEG"
 
+def test_prepare_image_of_a_session(tmpdir):
+    """Test that the frame of a session is converted next to it, not in the shared temp directory."""
+    analyzer = ImageAnalyzer()
+    analyzer.temp_dir = str(tmpdir.mkdir("shared"))
+    session_dir = str(tmpdir.mkdir("session"))
+    Image.new("RGB", (100, 100), color="red").save(os.path.join(session_dir, "temp.tif"), format="TIFF")
+
+    jpeg_path = analyzer._prepare_image(directory=session_dir)
+
+    assert jpeg_path == os.path.join(session_dir, "temp.jpeg") and os.path.exists(jpeg_path)
+    assert os.listdir(analyzer.temp_dir) == []
+
 @pytest.fixture
 def mock_analyzer(tmpdir, monkeypatch):
     """Fixture to provide a mock ImageAnalyzer with a temp directory."""
@@ -171,3 +183,54 @@ def test_api_call_invalid_json(mock_analyzer):
     # Expected results
     assert result["success"] == 0, "API call should fail due to invalid JSON"
     assert result["feedback"] == "API response is not valid JSON. Please try again.", "Error message mismatch"
+
+def test_api_call_streams_feedback_and_parameters(mock_analyzer):
+    """Test a streamed response reports the feedback and every complete adjustment as it arrives."""
+    tiff_path = os.path.join(mock_analyzer.temp_dir, "temp.tif")
+    Image.new("RGB", (100, 100), color="blue").save(tiff_path, format="TIFF")
+    text = '```json\n{"improvement_suggestions": "Brighten \\"it\\" up.", "exposure_adjustment": 1.5, ' \
+           '"contrast_adjustment": 20}\n```'
+    mock_analyzer.client.models.generate_content_stream.return_value = [
+        MagicMock(text=text[i:i + 7]) for i in range(0, len(text), 7)
+    ]
+    updates = []
+
+    result = mock_analyzer.api_call("Brighten", Parameter(), on_update=lambda *update: updates.append(update))
+
+    assert result["success"] == 1 and result["feedback"] == 'Brighten "it" up.'
+    assert result["new_parameters"].exposure == 1.5 and result["new_parameters"].contrast == 20
+    feedbacks = [feedback for feedback, _ in updates]
+    assert feedbacks == sorted(feedbacks, key=len) and 'Brighten "it" up.'.startswith(feedbacks[1])
+    exposures = [new_params.exposure for _, new_params in updates]
+    assert exposures[0] == 0 and exposures[-1] == 1.5, "The exposure should be applied before the response ended"
+    assert updates[-2][1].contrast == 0
+
+
+def test_api_call_stream_ends_early(mock_analyzer):
+    """Test a stream ending in the middle of the JSON is reported as invalid."""
+    tiff_path = os.path.join(mock_analyzer.temp_dir, "temp.tif")
+    Image.new("RGB", (100, 100), color="blue").save(tiff_path, format="TIFF")
+    mock_analyzer.client.models.generate_content_stream.return_value = [MagicMock(text='{"exposure_adjustment": 1')]
+
+    result = mock_analyzer.api_call("Brighten", Parameter(), on_update=lambda *update: None)
+
+    assert result["success"] == 0
+
+def test_stub_analyzer_is_deterministic(tmpdir):
+    """Test the stub backend answers offline, the same way for the same prompt."""
+    analyzer = create_analyzer('stub')
+    analyzer.temp_dir = str(tmpdir)
+    Image.new("RGB", (100, 100), color="blue").save(os.path.join(analyzer.temp_dir, "temp.tif"), format="TIFF")
+    updates = []
+
+    first = analyzer.api_call("Brighten", Parameter(), on_update=lambda *update: updates.append(update))
+    second = analyzer.api_call("Brighten", Parameter())
+
+    assert first["success"] == 1 and len(updates) > 1
+    assert vars(first["new_parameters"]) == vars(second["new_parameters"])
+    assert vars(updates[-1][1]) == vars(first["new_parameters"])
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError, match="Unknown AI backend"):
+        create_analyzer('unknown')
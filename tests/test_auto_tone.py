@@ -0,0 +1,54 @@
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append('imageprocessor/src')
+
+from auto_tone import MIDDLE, auto_tone, luminance_histogram, percentiles
+from ImageProcessing import Parameter, PreviewImage
+
+
+def gradient(low, high, shape=(120, 160)):
+    # a grey ramp whose luminance is spread evenly in stops between low and high
+    stops = np.linspace(np.log2(low), np.log2(high), shape[0] * shape[1], dtype=np.float32)
+    return np.repeat((2 ** stops).reshape(*shape, 1), 3, axis=2)
+
+
+def rendered_median(linear, params):
+    return np.median(PreviewImage(None, linear).render_image(params))
+
+
+def test_percentiles_of_histogram():
+    median = percentiles(luminance_histogram(gradient(2 ** -6, 2 ** -2)), [0.5])[0]
+
+    assert median == pytest.approx(-4, abs=0.05)
+
+
+@pytest.mark.parametrize('low, high', [(2 ** -7, 2 ** -5), (2 ** -2, 2 ** 1)])
+def test_exposure_brings_median_to_middle(low, high):
+    linear = gradient(low, high)
+    params = auto_tone(linear)
+
+    assert rendered_median(linear, params) == pytest.approx(MIDDLE, abs=0.08)
+    assert abs(rendered_median(linear, params) - MIDDLE) < abs(rendered_median(linear, Parameter()) - MIDDLE)
+
+
+def test_clipped_highlights_and_crushed_shadows():
+    params = auto_tone(gradient(2 ** -14, 2 ** 2))
+
+    assert params.highlights > 0
+    assert params.shadows > 0
+
+
+def test_hazy_image_gets_contrast_and_deeper_blacks():
+    params = auto_tone(gradient(0.3, 0.45))
+
+    assert params.contrast > 0
+    assert params.black_levels < 0
+
+
+def test_uint16_input_matches_float():
+    linear = gradient(2 ** -8, 2 ** -1)
+
+    assert vars(auto_tone((linear * 65535).astype(np.uint16))) == vars(auto_tone(linear))
@@ -0,0 +1,56 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append('imageprocessor/src')
+
+import compute_backends
+
+
+@pytest.fixture(autouse=True)
+def default_selection():
+    yield
+    compute_backends.select(compute_backends.DEFAULT_SELECTION)
+
+
+@pytest.mark.parametrize('backend, name', [
+    (backend, name) for backend, kernels in compute_backends.BACKENDS.items() for name in kernels
+])
+def test_kernels_match_numpy(backend, name):
+    args = compute_backends._inputs(name, 37)
+    expected = compute_backends.BACKENDS['numpy'][name](*args)
+    result = compute_backends.BACKENDS[backend][name](*args)
+
+    assert result.shape == expected.shape and result.dtype == expected.dtype
+    assert np.allclose(result, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_select_ignores_missing_backends():
+    compute_backends.select({'affine': 'cv2', 'box_blur': 'not installed', 'unknown kernel': 'numpy'})
+
+    assert compute_backends.selection() == {'affine': 'cv2', 'srgb_gamma': 'numpy', 'box_blur': 'cv2'}
+
+
+def test_auto_select_benchmarks_once(db, monkeypatch):
+    calls = []
+
+    def benchmark():
+        calls.append(1)
+        return {name: {'numpy': 2.0, 'cv2': 1.0} for name in compute_backends.KERNELS}
+    monkeypatch.setattr(compute_backends, 'benchmark', benchmark)
+
+    assert compute_backends.auto_select(db) == {name: 'cv2' for name in compute_backends.KERNELS}
+    compute_backends.select('numpy')
+    assert compute_backends.auto_select(db) == {name: 'cv2' for name in compute_backends.KERNELS}
+    assert len(calls) == 1, "The stored choice should be reused"
+
+    db.set_config(compute_backends.CONFIG_KEY, json.dumps({name: 'removed' for name in compute_backends.KERNELS}))
+    compute_backends.auto_select(db)
+    assert len(calls) == 2, "A choice naming a missing backend should be benchmarked again"
+
+
+def test_auto_select_with_fixed_backend(db):
+    assert compute_backends.auto_select(db, 'numpy') == {name: 'numpy' for name in compute_backends.KERNELS}
+    assert db.get_config(compute_backends.CONFIG_KEY) == []
@@ -1,16 +1,12 @@
+import os
 import pytest
 import sys
+import threading
 sys.path.append('imageprocessor/src')
 
-from data import Database 
-
-@pytest.fixture(scope="function")
-def db():
-    # Setup: create a new Database instance before each test
-    db_instance = Database()
-    yield db_instance
-    # Teardown: clean up after the test
-    db_instance.close()
+import data
+from data import Database, ImportSummary
+from ImageProcessing import Parameter
 
 def test_singleton(db):
     # Test that only one instance of Database is created
@@ -64,4 +60,180 @@ def test_import_image(db):
     assert set(new_images) == set(paths)  # Imported images should match paths
 
 
+def test_migrations_applied(fresh_db):
+    assert fresh_db.execute('PRAGMA user_version').fetchone()[0] == len(data.MIGRATIONS)
+    columns = [_[1] for _ in fresh_db.execute('PRAGMA table_info(images)').fetchall()]
+    for column in data.FILTER_COLUMNS:
+        assert column in columns
+
+def test_edited_flag_follows_parameters(fresh_db):
+    image_id = fresh_db.insert('images', {'path': 'a.cr3', 'exposure': 0.5}, dict_=True)
+    assert fresh_db.select('images', ['edited'], 'id = ?', (image_id,))[0][0] == 1
+
+    fresh_db.update('images', ['exposure'], [0], 'id = ?', (image_id,))
+    assert fresh_db.select('images', ['edited'], 'id = ?', (image_id,))[0][0] == 0
+
+def test_query_images_sort_and_filter(fresh_db):
+    fresh_db.insert('images', [
+        {'path': 'a.cr3', 'camera_model': 'R5', 'iso': 400, 'capture_time': '2024-01-03 10:00:00', 'exposure': 1},
+        {'path': 'b.cr3', 'camera_model': 'R6', 'iso': 100, 'capture_time': '2024-01-01 10:00:00', 'exposure': 0},
+        {'path': 'c.cr3', 'camera_model': 'R5', 'iso': 3200, 'capture_time': '2024-01-02 10:00:00', 'exposure': 0},
+    ], list_=True, dict_=True)
+    a, b, c = [fresh_db.select('images', ['id'], 'path = ?', (_,))[0][0] for _ in ('a.cr3', 'b.cr3', 'c.cr3')]
+
+    assert fresh_db.query_images() == [a, b, c]
+    assert fresh_db.query_images('capture_time') == [b, c, a]
+    assert fresh_db.query_images('iso', descending=True) == [c, a, b]
+    assert fresh_db.query_images('iso', filters={'camera_model': 'R5'}) == [a, c]
+    assert fresh_db.query_images(filters={'iso': (200, None)}) == [a, c]
+    assert fresh_db.query_images(filters={'edited': True}) == [a]
+    assert fresh_db.query_images('capture_time', limit=1, offset=1) == [c]
+    assert fresh_db.distinct_values('camera_model') == ['R5', 'R6']
+    with pytest.raises(ValueError):
+        fresh_db.query_images('path')
+
+def test_import_image_reads_metadata(fresh_db, tmp_path):
+    path = tmp_path / 'image.raw'
+    path.write_bytes(b'\x00' * 128)
+    ids, _ = fresh_db.import_image([str(path)])
+
+    assert fresh_db.select('images', ['file_size'], 'id = ?', (ids[0],))[0][0] == 128
+
+def test_import_image_skips_duplicates(fresh_db, tmp_path):
+    content = os.urandom(1024 * 1024)
+    for folder in ('card', 'backup'):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / 'IMG_0001.CR3').write_bytes(content)
+    (tmp_path / 'card' / 'IMG_0002.CR3').write_bytes(os.urandom(1024))
+    fresh_db.record_decode_time(2.0)
+
+    summary = ImportSummary()
+    ids, new_images = fresh_db.import_image(
+        [str(tmp_path / 'card' / 'IMG_0001.CR3'), str(tmp_path / 'card' / 'IMG_0002.CR3')], summary
+    )
+    assert len(ids) == 2
+    assert summary.duplicates == []
+
+    summary = ImportSummary()
+    result = fresh_db.import_image(
+        [str(tmp_path / 'backup' / 'IMG_0001.CR3'), str(tmp_path / 'card' / 'IMG_0002.CR3')], summary
+    )
+    assert result is None, "Nothing new should be imported"
+    assert summary.duplicates == [(str(tmp_path / 'backup' / 'IMG_0001.CR3'), str(tmp_path / 'card' / 'IMG_0001.CR3'))]
+    assert summary.already_imported == [str(tmp_path / 'card' / 'IMG_0002.CR3')]
+    assert summary.skipped_decode_seconds == 2.0
+
+def test_import_image_duplicates_in_same_import_with_full_hash(fresh_db, tmp_path):
+    content = os.urandom(1024 * 1024)
+    (tmp_path / 'a.CR3').write_bytes(content)
+    (tmp_path / 'b.CR3').write_bytes(content)
+
+    summary = ImportSummary()
+    ids, new_images = fresh_db.import_image(
+        [str(tmp_path / 'a.CR3'), str(tmp_path / 'b.CR3')], summary, verify_full_hash=True
+    )
+    assert new_images == [str(tmp_path / 'a.CR3')]
+    assert len(summary.duplicates) == 1
+    assert fresh_db.select('images', ['full_hash'], 'id = ?', (ids[0],))[0][0] is not None
+
+def test_wal_mode_and_per_thread_readers(fresh_db):
+    import threading
+
+    assert fresh_db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    barrier = threading.Barrier(3)
+    connections = []
+
+    def read():
+        fresh_db.execute('SELECT COUNT(*) FROM images').fetchone()
+        connections.append(fresh_db._reader())
+        barrier.wait()  # keep the threads alive until all have read
+
+    threads = [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(map(id, connections))) == 3, "Every thread should read through its own connection"
+    new_thread = threading.Thread(target=lambda: fresh_db.execute('SELECT 1'))
+    new_thread.start()
+    new_thread.join()
+    assert not any(thread in fresh_db._readers for thread in threads), \
+        "Connections of ended threads should be closed"
+
+def test_statements_behind_with_are_classified_by_their_statement():
+    assert data._is_read("WITH recent AS (SELECT id FROM images WHERE path = 'a(') SELECT * FROM recent")
+    assert data._is_read('WITH RECURSIVE n(x) AS (VALUES (1) UNION ALL SELECT x + 1 FROM n) SELECT x FROM n')
+    assert not data._is_read('WITH old AS (SELECT id FROM images) DELETE FROM images WHERE id IN old')
+    assert not data._is_read('with t(a) as (select 1) insert into config select a, a from t')
+    assert not data._is_read('WITH t AS (SELECT 1) UPDATE images SET exposure = 0')
+
+
+def test_write_behind_with_goes_to_the_writer(fresh_db):
+    fresh_db.execute("WITH v(key, value) AS (VALUES ('k', 'v')) INSERT INTO config SELECT key, value FROM v")
+    assert fresh_db.get_config('k') == [('v',)]
+
+def test_concurrent_writes_are_committed(fresh_db):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def insert(i):
+        fresh_db.insert('images', {'path': f'/photos/{i}.cr3'}, dict_=True)
+        return fresh_db.execute('SELECT id FROM images WHERE path = ?', (f'/photos/{i}.cr3',)).fetchone()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        rows = list(executor.map(insert, range(200)))
+
+    assert all(row is not None for row in rows), "A write should be visible to the writing thread once it returns"
+    assert fresh_db.execute('SELECT COUNT(*) FROM images').fetchone()[0] == 200
+
+def test_failing_write_does_not_affect_batch(fresh_db):
+    import sqlite3
+
+    fresh_db.insert('images', {'path': '/photos/a.cr3'}, dict_=True)
+    queued = [fresh_db.insert('images', {'path': path}, dict_=True, commit=False)
+              for path in ['/photos/b.cr3', '/photos/a.cr3', '/photos/c.cr3']]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        fresh_db.commit()
+    assert queued[0].exception() is None and queued[2].exception() is None
+    paths = [_[0] for _ in fresh_db.execute('SELECT path FROM images ORDER BY path').fetchall()]
+    assert paths == ['/photos/a.cr3', '/photos/b.cr3', '/photos/c.cr3']
+
+def test_write_operation_is_atomic(fresh_db):
+    def write(cursor):
+        cursor.execute("INSERT INTO images (path) VALUES ('/photos/a.cr3')")
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        fresh_db.write(write)
+    assert fresh_db.execute('SELECT COUNT(*) FROM images').fetchone()[0] == 0
+
+def test_apply_params_to_many_images(fresh_db):
+    fresh_db.executemany('INSERT INTO images (path) VALUES (?)', [(f'/photos/{i}.cr3',) for i in range(1000)])
+    ids = [_[0] for _ in fresh_db.execute('SELECT id FROM images ORDER BY id').fetchall()]
+    params = Parameter(exposure=0.5, contrast=10, highlights=-20, shadows=30, black_levels=5)
+
+    fresh_db.apply_params(ids[:999], params)
+
+    rows = fresh_db.select('images', data.PARAMETER_COLUMNS + ['edited'], 'id IN (?, ?)', (ids[0], ids[998]))
+    assert rows == [(0.5, 10, -20, 30, 5, 1)] * 2
+    assert fresh_db.get_params(ids[999]) == [(0, 0, 0, 0, 0)], "Unselected images should keep their parameters"
+
+def test_set_params_per_image(fresh_db):
+    ids = [fresh_db.insert('images', {'path': f'/photos/{i}.cr3'}, dict_=True) for i in range(3)]
+
+    fresh_db.set_params({ids[0]: Parameter(exposure=1.5), ids[1]: Parameter(contrast=-20, black_levels=-10)})
+
+    assert fresh_db.get_params(ids[0]) == [(1.5, 0, 0, 0, 0)]
+    assert fresh_db.get_params(ids[1]) == [(0, -20, 0, 0, -10)]
+    assert fresh_db.get_params(ids[2]) == [(0, 0, 0, 0, 0)]
+
+def test_concurrent_decode_times_are_all_recorded(fresh_db):
+    threads = [threading.Thread(target=fresh_db.record_decode_time, args=(float(i),)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
 
+    assert fresh_db.get_config('decode_time_count') == [('20',)]
+    assert fresh_db.average_decode_time() == pytest.approx(9.5)
@@ -0,0 +1,168 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+sys.path.append('imageprocessor/src')
+
+import ai_integration
+from ai_integration import HttpAnalyzer, StubAnalyzer, stub_response
+from fake_analyzer import FakeAnalyzer
+from ImageProcessing import Parameter
+
+
+@pytest.fixture
+def serve(tmpdir):
+    servers = []
+
+    def serve(**options):
+        fake = FakeAnalyzer(seed=0, **options)
+        server = fake.serve(port=0)
+        servers.append(server)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        analyzer = HttpAnalyzer(f'http://127.0.0.1:{server.server_address[1]}')
+        analyzer.temp_dir = str(tmpdir)
+        Image.new("RGB", (100, 100), color="blue").save(os.path.join(analyzer.temp_dir, "temp.tif"), format="TIFF")
+        return fake, analyzer
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_answer_is_streamed(serve):
+    fake, analyzer = serve(latency=0, jitter=0, chunk_delay=0)
+    updates = []
+
+    result = analyzer.api_call("Brighten", Parameter(), on_update=lambda *update: updates.append(update))
+
+    assert result["success"] == 1 and len(updates) > 1
+    expected = analyzer.api_call("Brighten", Parameter())["new_parameters"]
+    assert vars(result["new_parameters"]) == vars(expected)
+    assert fake.requests == 2
+
+
+def test_latency_and_errors_are_injected(serve):
+    fake, analyzer = serve(latency=0.2, jitter=0, chunk_delay=0, error_rate=1)
+
+    start = time.monotonic()
+    result = analyzer.api_call("Brighten", Parameter())
+
+    assert time.monotonic() - start >= 0.2
+    assert result["success"] == 0 and '503' in result["feedback"]
+
+
+def test_jitter_is_repeatable():
+    first, second = FakeAnalyzer(latency=1, jitter=0.5, seed=1), FakeAnalyzer(latency=1, jitter=0.5, seed=1)
+    delays = [first.draw()[0] for _ in range(5)]
+
+    assert delays == [second.draw()[0] for _ in range(5)]
+    assert all(delay >= 1 for delay in delays) and len(set(delays)) == 5
+
+
+def test_stub_response_is_fenced_json():
+    assert stub_response("a").startswith('```json\n') and stub_response("a") == stub_response("a")
+
+
+class SlowFirstAnalyzer(StubAnalyzer):
+    """Answers the first request after `first` seconds and every later one at once."""
+    def __init__(self, first):
+        super().__init__()
+        self.first = first
+        self.calls = 0
+
+    def generate(self, image, prompt):
+        self.calls += 1
+        if self.calls == 1:
+            time.sleep(self.first)
+        return super().generate(image, prompt)
+
+
+@pytest.fixture
+def slow_analyzer(tmpdir, monkeypatch):
+    monkeypatch.setattr(ai_integration, 'AI_HEDGE_DELAY', 0.1)
+
+    def slow_analyzer(first):
+        analyzer = SlowFirstAnalyzer(first)
+        analyzer.temp_dir = str(tmpdir)
+        Image.new("RGB", (100, 100), color="blue").save(os.path.join(analyzer.temp_dir, "temp.tif"), format="TIFF")
+        return analyzer
+    return slow_analyzer
+
+
+def test_slow_request_is_hedged(slow_analyzer):
+    analyzer = slow_analyzer(first=5)
+
+    start = time.monotonic()
+    result = analyzer.api_call("Brighten", Parameter())
+
+    assert result["success"] == 1 and time.monotonic() - start < 2
+    assert analyzer.stats['hedged'] == 1 and analyzer.stats['hedge_wins'] == 1
+
+
+def test_deadline_falls_back_to_suggestion(slow_analyzer):
+    analyzer = slow_analyzer(first=5)
+    analyzer.hedge_percentile = None
+    suggestion = Parameter(exposure=1.25)
+
+    result = analyzer.api_call("Brighten", Parameter(), suggestion, deadline=0.2)
+    assert result["success"] == 1 and result["fallback"] and result["new_parameters"] is suggestion
+
+    analyzer.calls = 0
+    assert analyzer.api_call("Brighten", Parameter(), deadline=0.2)["success"] == 0
+    assert analyzer.stats['timeouts'] == 2 and analyzer.stats['hedged'] == 0
+
+
+def test_latency_percentiles(slow_analyzer, monkeypatch):
+    monkeypatch.setattr(ai_integration, 'AI_HEDGE_MIN_SAMPLES', 3)
+    analyzer = slow_analyzer(first=0)
+    assert analyzer.metrics()['p50'] is None
+
+    for seconds in [0.1, 0.2, 0.3, 0.4]:
+        analyzer.latency.record(seconds)
+
+    metrics = analyzer.metrics()
+    assert metrics['p50'] == pytest.approx(0.25) and metrics['p50'] <= metrics['p95'] <= metrics['p99'] <= 0.4
+    assert analyzer.hedge_delay() == metrics['p95']
+
+
+def test_no_update_after_the_call_returned(slow_analyzer):
+    release = threading.Event()
+
+    class StalledAnalyzer(StubAnalyzer):
+        """Streams half of the answer, then stalls until released."""
+        def generate_stream(self, image, prompt):
+            text = self.generate(image, prompt)
+            yield text[:len(text) // 2]
+            release.wait()
+            for start in range(len(text) // 2, len(text), 8):
+                yield text[start:start + 8]
+
+    analyzer = StalledAnalyzer()
+    analyzer.temp_dir = slow_analyzer(first=0).temp_dir
+    analyzer.hedge_percentile = None
+    updates = []
+
+    result = analyzer.api_call("Brighten", Parameter(), on_update=lambda *args: updates.append(args), deadline=0.2)
+    returned = len(updates)
+    release.set()
+    time.sleep(0.2)
+
+    assert result["success"] == 0
+    assert len(updates) == returned, "Chunks arriving after the deadline should not update the page"
+
+
+def test_concurrent_calls_are_all_counted(slow_analyzer):
+    analyzer = slow_analyzer(first=0)
+    analyzer.hedge_percentile = None
+
+    threads = [threading.Thread(target=analyzer.api_call, args=("Brighten", Parameter())) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert analyzer.metrics()['calls'] == 16
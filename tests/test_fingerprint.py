@@ -0,0 +1,45 @@
+import os
+import shutil
+import sys
+
+sys.path.append('imageprocessor/src')
+
+from fingerprint import SAMPLE_SIZE, full_hash, quick_hash
+
+
+def test_quick_hash_same_for_copies(tmp_path):
+    original = tmp_path / 'original.cr3'
+    original.write_bytes(os.urandom(SAMPLE_SIZE * 10))
+    copy = tmp_path / 'copy.cr3'
+    shutil.copy(original, copy)
+
+    assert quick_hash(str(original)) == quick_hash(str(copy))
+    assert full_hash(str(original)) == full_hash(str(copy))
+
+
+def test_quick_hash_detects_changes(tmp_path):
+    content = bytearray(os.urandom(SAMPLE_SIZE * 10))
+    path = tmp_path / 'image.cr3'
+    path.write_bytes(content)
+    before = quick_hash(str(path))
+
+    content[-1] ^= 0xFF  # the last chunk is always sampled
+    path.write_bytes(content)
+    assert quick_hash(str(path)) != before
+
+    path.write_bytes(content + b'\x00')
+    assert quick_hash(str(path)) != before, "The file size is part of the fingerprint"
+
+
+def test_quick_hash_small_file(tmp_path):
+    path = tmp_path / 'small.cr3'
+    path.write_bytes(b'abc')
+    other = tmp_path / 'other.cr3'
+    other.write_bytes(b'abd')
+
+    assert quick_hash(str(path)) != quick_hash(str(other))
+
+
+def test_hash_missing_file(tmp_path):
+    assert quick_hash(str(tmp_path / 'missing.cr3')) is None
+    assert full_hash(str(tmp_path / 'missing.cr3')) is None
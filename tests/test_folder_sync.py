@@ -0,0 +1,143 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append('imageprocessor/src')
+
+import folder_sync
+from folder_sync import add_invalidation_listener, scan_folder, sync_folder
+from thumbnail_store import ThumbnailStore
+
+
+@pytest.fixture
+def library(tmp_path):
+    folder = tmp_path / 'photos'
+    (folder / 'day1').mkdir(parents=True)
+    (folder / 'day1' / 'IMG_0001.CR3').write_bytes(os.urandom(256))
+    (folder / 'day1' / 'IMG_0002.CR3').write_bytes(os.urandom(256))
+    (folder / 'day1' / 'notes.txt').write_bytes(b'not a raw file')
+    (folder / 'IMG_0003.nef').write_bytes(os.urandom(256))
+    return folder
+
+
+def test_scan_folder(library):
+    found = {os.path.relpath(path, library): size for path, mtime, size in scan_folder(str(library))}
+
+    assert found == {
+        os.path.join('day1', 'IMG_0001.CR3'): 256,
+        os.path.join('day1', 'IMG_0002.CR3'): 256,
+        'IMG_0003.nef': 256,
+    }
+
+
+def test_sync_folder(db, library, monkeypatch):
+    monkeypatch.setattr(folder_sync, '_invalidation_listeners', [])
+    invalidated = []
+    add_invalidation_listener(invalidated.extend)
+
+    result = sync_folder(str(library), db)
+    assert len(result.new_ids) == 3
+    assert result.unchanged == 0
+
+    result = sync_folder(str(library), db)
+    assert (result.new_ids, result.changed_ids, result.removed_ids) == ([], [], [])
+    assert result.unchanged == 3, "A rescan of an unchanged tree should not process any file"
+
+    changed = library / 'day1' / 'IMG_0001.CR3'
+    changed_id = db.select('images', ['id'], 'path = ?', (str(changed),))[0][0]
+    ThumbnailStore(db).put(changed_id, {200: b'stale'})
+    changed.write_bytes(os.urandom(512))
+    removed = library / 'IMG_0003.nef'
+    removed_id = db.select('images', ['id'], 'path = ?', (str(removed),))[0][0]
+    removed.unlink()
+    (library / 'IMG_0004.CR3').write_bytes(os.urandom(256))
+
+    result = sync_folder(str(library), db)
+    assert len(result.new_ids) == 1
+    assert result.changed_ids == [changed_id]
+    assert result.removed_ids == [removed_id]
+    assert result.unchanged == 1
+    assert db.select('images', ['file_size'], 'id = ?', (changed_id,))[0][0] == 512
+    assert not ThumbnailStore(db).has(changed_id), "Thumbnails of changed files should be dropped"
+    assert not db.select('images', ['id'], 'id = ?', (removed_id,))
+    assert sorted(invalidated) == sorted([changed_id, removed_id])
+
+
+def test_sync_folder_ignores_other_folders(db, library, tmp_path):
+    other = tmp_path / 'photos-other' / 'IMG_0001.CR3'
+    other.parent.mkdir()
+    other.write_bytes(os.urandom(256))
+    db.import_image([str(other)])
+
+    result = sync_folder(str(library), db)
+
+    assert result.removed_ids == [], "Images outside the folder should not be removed"
+
+
+def test_sync_missing_folder_keeps_images(db, library, tmp_path):
+    sync_folder(str(library), db)
+    library.rename(tmp_path / 'unplugged')
+
+    result = sync_folder(str(library), db)
+
+    assert result.removed_ids == []
+    assert len(db.select('images', ['id'])) == 3
+
+
+def test_library_folders(db, library):
+    assert db.add_library_folder(str(library)) is True
+    assert db.add_library_folder(str(library)) is False
+    assert db.library_folders() == [str(library)]
+    db.remove_library_folder(str(library))
+    assert db.library_folders() == []
+
+
+def test_sync_folder_remembers_duplicates(db, library):
+    content = (library / 'IMG_0003.nef').read_bytes()
+    (library / 'day1' / 'copy.nef').write_bytes(content)
+
+    result = sync_folder(str(library), db)
+    assert len(result.new_ids) == 3
+    assert len(result.import_summary.duplicates) == 1
+
+    result = sync_folder(str(library), db)
+    assert result.import_summary.duplicates == [], "Known duplicates should not be fingerprinted again"
+    assert result.unchanged == 4
+
+
+def test_sync_folder_imports_duplicate_of_removed_original(db, library):
+    content = (library / 'IMG_0003.nef').read_bytes()
+    (library / 'day1' / 'copy.nef').write_bytes(content)
+    sync_folder(str(library), db)
+
+    (library / 'IMG_0003.nef').unlink()
+    result = sync_folder(str(library), db)
+    assert len(result.removed_ids) == 1
+    assert result.new_paths == [str(library / 'day1' / 'copy.nef')]
+    assert db.duplicate_records(str(library)) == {}
+
+
+def test_sync_folder_forgets_duplicates_of_deleted_images(db, library):
+    content = (library / 'IMG_0003.nef').read_bytes()
+    (library / 'day1' / 'copy.nef').write_bytes(content)
+    sync_folder(str(library), db)
+    assert len(db.duplicate_records(str(library))) == 1
+
+    image_id = db.execute('SELECT id FROM images WHERE path = ?', (str(library / 'IMG_0003.nef'),)).fetchone()[0]
+    db.delete_images([image_id])
+    assert db.duplicate_records(str(library)) == {}
+
+
+def test_sync_folder_skips_deleted_images(db, library):
+    sync_folder(str(library), db)
+    path = str(library / 'IMG_0003.nef')
+    image_id = db.execute('SELECT id FROM images WHERE path = ?', (path,)).fetchone()[0]
+
+    db.delete_images([image_id], exclude=True)
+    result = sync_folder(str(library), db)
+    assert result.new_ids == [] and result.unchanged == 3, "A deleted file should not be imported again"
+
+    (library / 'IMG_0003.nef').unlink()
+    sync_folder(str(library), db)
+    assert db.excluded_paths(str(library)) == set(), "Removed files should be forgotten"
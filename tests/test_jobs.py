@@ -0,0 +1,129 @@
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append('imageprocessor/src')
+
+from jobs import JobScheduler
+
+
+CLASSES = {'high': (0, 1), 'low': (1, 1)}
+
+
+def test_higher_priority_class_runs_first(db):
+    order = []
+    scheduler = JobScheduler(db, CLASSES, workers=1)
+    scheduler.register('thumbnail', lambda name: order.append(name), 'high')
+    scheduler.register('export', lambda name: order.append(name), 'low')
+    for name in ('export 1', 'export 2'):
+        scheduler.submit('export', name=name)
+    scheduler.submit('thumbnail', name='thumbnail')
+
+    scheduler.start()
+
+    assert scheduler.wait(timeout=5)
+    assert order == ['thumbnail', 'export 1', 'export 2']
+    assert db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0] == 0, "Finished jobs should be deleted"
+
+
+def test_class_concurrency_limit(db):
+    running, peak = [], []
+    lock = threading.Lock()
+
+    def job(name):
+        with lock:
+            running.append(name)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(name)
+    scheduler = JobScheduler(db, {'export': (0, 2)}, workers=3)
+    scheduler.register('export', job, 'export')
+    scheduler.start()
+    for i in range(6):
+        scheduler.submit('export', name=i)
+
+    assert scheduler.wait(timeout=5)
+    assert max(peak) == 2
+
+
+def test_failing_job_is_retried_then_kept_as_failed(db):
+    attempts, done = [], []
+
+    def job():
+        attempts.append(1)
+        raise OSError('disk full')
+    scheduler = JobScheduler(db, CLASSES, max_attempts=3, retry_delay=0.01)
+    scheduler.register('export', job, 'low')
+    scheduler.add_listener(lambda *args: done.append(args))
+    scheduler.start()
+    job_id = scheduler.submit('export')
+
+    assert scheduler.wait(timeout=5)
+    assert len(attempts) == 3
+    assert scheduler.state(job_id) == ('failed', 3, "OSError('disk full')")
+    assert len(done) == 1 and isinstance(done[0][3], OSError)
+
+
+def test_prune_deletes_only_old_failed_jobs(db):
+    scheduler = JobScheduler(db, CLASSES)
+    scheduler.register('export', lambda: None, 'low')
+    old_failed, new_failed, old_pending = (scheduler.submit('export') for _ in range(3))
+    db.execute("UPDATE jobs SET state = 'failed' WHERE id IN (?, ?)", (old_failed, new_failed))
+    db.execute('UPDATE jobs SET created = created - 3600 WHERE id IN (?, ?)', (old_failed, old_pending))
+
+    scheduler.prune(max_age=60)
+
+    assert scheduler.state(old_failed) is None
+    assert scheduler.state(new_failed)[0] == 'failed'
+    assert scheduler.state(old_pending)[0] == 'queued'
+
+
+def test_every_listener_is_notified_until_removed(db):
+    first, second = [], []
+    scheduler = JobScheduler(db, CLASSES)
+    scheduler.register('export', lambda name: None, 'low')
+    scheduler.add_listener(lambda *args: first.append(args[2]['name']))
+    def listener(*args):
+        second.append(args)
+    scheduler.add_listener(listener)
+    scheduler.start()
+    scheduler.submit('export', name='a')
+    assert scheduler.wait(timeout=5)
+
+    scheduler.remove_listener(listener)
+    scheduler.submit('export', name='b')
+    assert scheduler.wait(timeout=5)
+
+    assert first == ['a', 'b']
+    assert len(second) == 1
+
+
+def test_interrupted_jobs_resume_after_restart(db):
+    first = JobScheduler(db, CLASSES)
+    first.register('export', lambda name: None, 'low')
+    queued = first.submit('export', name='queued')
+    interrupted = first.submit('export', name='interrupted')
+    db.execute("UPDATE jobs SET state = 'running' WHERE id = ?", (interrupted,))
+    # `first` is never started, like an application which stopped before running its jobs
+
+    done = []
+    second = JobScheduler(db, CLASSES)
+    second.register('export', lambda name: done.append(name), 'low')
+    second.start()
+
+    assert second.wait(timeout=5)
+    assert sorted(done) == ['interrupted', 'queued']
+    assert second.state(queued) is None and second.state(interrupted) is None
+
+
+def test_unique_jobs_are_added_once(db):
+    scheduler = JobScheduler(db, CLASSES)
+    scheduler.register('backfill', lambda: None, 'low')
+
+    assert scheduler.submit('backfill', unique=True) == scheduler.submit('backfill', unique=True)
+    assert db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0] == 1
+    with pytest.raises(ValueError):
+        scheduler.submit('unknown')
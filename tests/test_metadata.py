@@ -0,0 +1,72 @@
+import struct
+import sys
+
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+
+sys.path.append('imageprocessor/src')
+
+from metadata import METADATA_COLUMNS, read_metadata
+
+
+def make_exif():
+    exif = Image.Exif()
+    exif[0x010F] = 'Canon'
+    exif[0x0110] = 'Canon EOS R5'
+    exif[0x0132] = '2020:01:01 00:00:00'
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x9003] = '2024:05:06 07:08:09'
+    exif_ifd[0x8827] = 400
+    exif_ifd[0xA434] = 'RF24-70mm F2.8 L IS USM'
+    exif_ifd[0x829A] = IFDRational(1, 250)
+    exif_ifd[0x829D] = IFDRational(28, 10)
+    exif_ifd[0x920A] = IFDRational(50, 1)
+    return exif
+
+
+def check_metadata(metadata):
+    assert metadata['camera_make'] == 'Canon'
+    assert metadata['camera_model'] == 'Canon EOS R5'
+    assert metadata['capture_time'] == '2024-05-06 07:08:09', "DateTimeOriginal should win over DateTime"
+    assert metadata['lens'] == 'RF24-70mm F2.8 L IS USM'
+    assert metadata['iso'] == 400
+    assert metadata['exposure_time'] == 1 / 250
+    assert metadata['aperture'] == 2.8
+    assert metadata['focal_length'] == 50
+
+
+def test_read_metadata_embedded_exif(tmp_path):
+    path = tmp_path / 'image.jpg'
+    Image.new('RGB', (16, 16)).save(path, exif=make_exif())
+
+    metadata = read_metadata(str(path))
+
+    check_metadata(metadata)
+    assert metadata['file_size'] == path.stat().st_size
+
+
+def test_read_metadata_cr3_cmt_box(tmp_path):
+    tiff = make_exif().tobytes()[len(b'Exif\x00\x00'):]
+    ftyp = struct.pack('>I', 16) + b'ftypcrx \x00\x00\x00\x01'
+    cmt1 = struct.pack('>I', 8 + len(tiff)) + b'CMT1' + tiff
+    path = tmp_path / 'image.cr3'
+    path.write_bytes(ftyp + cmt1 + b'\x00' * 64)
+
+    check_metadata(read_metadata(str(path)))
+
+
+def test_read_metadata_unknown_format(tmp_path):
+    path = tmp_path / 'image.raw'
+    path.write_bytes(b'\x00' * 128)
+
+    metadata = read_metadata(str(path))
+
+    assert list(metadata) == METADATA_COLUMNS
+    assert metadata['file_size'] == 128
+    assert metadata['camera_model'] is None
+
+
+def test_read_metadata_missing_file(tmp_path):
+    metadata = read_metadata(str(tmp_path / 'missing.cr3'))
+
+    assert all(value is None for value in metadata.values())
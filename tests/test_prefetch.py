@@ -0,0 +1,134 @@
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append('imageprocessor/src')
+
+from prefetch import Prefetcher, read_ahead
+
+
+class FakeImage:
+    def __init__(self, path, buffer=None):
+        self.file_path = path
+        self.buffer_content = buffer.read() if buffer is not None else None
+        self.raw_image = np.zeros(100, dtype=np.uint8)
+
+
+def wait_until(condition, timeout=2):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_neighbours_orders_next_first():
+    order = [1, 2, 3, 4, 5]
+
+    assert Prefetcher.neighbours(order, 3, ahead=2, behind=1) == [4, 2, 5]
+    assert Prefetcher.neighbours(order, 5, ahead=2, behind=1) == [4]
+    assert Prefetcher.neighbours(order, 9) == []
+
+
+def test_prefetched_image_is_served_from_memory(tmp_path):
+    path = tmp_path / 'next.cr3'
+    path.write_bytes(b'raw data')
+    prefetcher = Prefetcher(decoder=FakeImage)
+
+    prefetcher.prefetch([str(path)])
+    assert wait_until(lambda: str(path) in prefetcher._images)
+    image = prefetcher.get(str(path))
+
+    assert image.buffer_content == b'raw data', "The file should be decoded from the read-ahead buffer"
+    assert prefetcher.hits == 1 and prefetcher.misses == 0
+
+
+def test_memory_budget_limits_prefetch(tmp_path):
+    paths = [str(tmp_path / f'{i}.cr3') for i in range(4)]
+    prefetcher = Prefetcher(memory_budget=250, decoder=FakeImage)
+
+    prefetcher.prefetch(paths)
+    assert wait_until(lambda: len(prefetcher._images) == 2)
+    time.sleep(0.1)
+
+    assert list(prefetcher._images) == paths[:2], "Only the most likely images should fit the budget"
+
+    prefetcher.prefetch(paths[1:])
+
+    assert wait_until(lambda: list(prefetcher._images) == paths[1:3])
+
+
+def test_prefetch_waits_while_busy(tmp_path):
+    busy = threading.Event()
+    busy.set()
+    prefetcher = Prefetcher(busy=busy.is_set, decoder=FakeImage)
+
+    prefetcher.prefetch([str(tmp_path / 'next.cr3')])
+    time.sleep(0.2)
+    assert not prefetcher._images, "Decoding should wait while the render thread is busy"
+
+    busy.clear()
+    assert wait_until(lambda: len(prefetcher._images) == 1)
+
+
+def test_get_decodes_missing_image(tmp_path):
+    prefetcher = Prefetcher(decoder=FakeImage)
+
+    image = prefetcher.get(str(tmp_path / 'other.cr3'))
+
+    assert image.buffer_content is None
+    assert prefetcher.misses == 1
+
+
+def test_replaced_file_is_decoded_again(tmp_path):
+    path = tmp_path / 'edited.cr3'
+    path.write_bytes(b'old')
+    prefetcher = Prefetcher(decoder=FakeImage)
+    prefetcher.prefetch([str(path)])
+    old = prefetcher.get(str(path))
+
+    path.write_bytes(b'new file')
+
+    assert prefetcher.cached(str(path)) is None, "An image of the old file should not be returned"
+    assert prefetcher.get(str(path)) is not old
+    assert prefetcher.misses == 2
+
+
+def test_wish_lists_of_owners_are_merged(tmp_path):
+    paths = [str(tmp_path / f'{i}.cr3') for i in range(4)]
+    prefetcher = Prefetcher(decoder=FakeImage)
+
+    prefetcher.prefetch(paths[:2], owner='a')
+    prefetcher.prefetch(paths[2:], owner='b')
+    assert prefetcher._wanted == [paths[0], paths[2], paths[1], paths[3]], "Wish lists should take turns"
+    assert wait_until(lambda: len(prefetcher._images) == 4)
+
+    prefetcher.release('b')
+    assert list(prefetcher._images) == paths[:2], "Images only the released owner wanted should be dropped"
+
+
+def test_concurrent_gets_decode_once(tmp_path):
+    decoded = []
+
+    class SlowImage(FakeImage):
+        def __init__(self, path, buffer=None):
+            decoded.append(path)
+            time.sleep(0.1)
+            super().__init__(path, buffer)
+    prefetcher = Prefetcher(decoder=SlowImage)
+    path = str(tmp_path / 'shared.cr3')
+    images = []
+
+    threads = [threading.Thread(target=lambda: images.append(prefetcher.get(path))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert decoded == [path], "Sessions opening the same file should share one decode"
+    assert images[0] is images[1] is images[2]
+
+
+def test_read_ahead_missing_file(tmp_path):
+    assert read_ahead(str(tmp_path / 'missing.cr3')) is None
@@ -0,0 +1,52 @@
+import base64
+import io
+import sys
+import threading
+
+import numpy as np
+from PIL import Image
+
+sys.path.append('imageprocessor/src')
+
+from ImageProcessing import Parameter, PreviewImage
+from presets import PresetStrip, apply_preset, render_presets
+
+
+def test_apply_preset_keeps_slider_ranges():
+    params = apply_preset(Parameter(exposure=4.5, shadows=10), {'exposure': 1, 'shadows': -20, 'contrast': 30})
+
+    assert vars(params) == {'exposure': 5, 'contrast': 30, 'highlights': 0, 'shadows': 0, 'black_levels': 0}
+
+
+def test_render_presets():
+    image = PreviewImage(None, np.full((30, 40, 3), 0.18, dtype=np.float32))
+    presets = [('Brighter', {'exposure': 1}), ('Darker', {'exposure': -1})]
+
+    previews = render_presets(image, Parameter(), presets)
+
+    assert [(name, params.exposure) for name, params, _ in previews] == [('Brighter', 1), ('Darker', -1)]
+    brightness = []
+    for _, _, data in previews:
+        with Image.open(io.BytesIO(base64.b64decode(data))) as preview:
+            assert preview.format == 'JPEG' and preview.size == (40, 30)
+            brightness.append(np.asarray(preview).mean())
+    assert brightness[0] > brightness[1]
+
+
+def test_strip_renders_latest_request_from_proxy():
+    busy = threading.Event()
+    busy.set()
+    strip = PresetStrip([('+1 EV', {'exposure': 1})], long_edge=20, busy=busy.is_set)
+    rendered = []
+    strip.on_render = lambda image, previews: rendered.append((image, previews))
+    image = PreviewImage(None, np.full((60, 80, 3), 0.18, dtype=np.float32))
+
+    strip.update(image, Parameter(exposure=0))
+    strip.update(image, Parameter(exposure=2))
+    busy.clear()
+    assert strip.wait(timeout=5)
+
+    assert rendered[-1][0] is image and rendered[-1][1][0][1].exposure == 3
+    assert strip.proxy(image).raw_image.shape == (15, 20, 3)
+    assert len(rendered) <= 2
+    strip.close()
@@ -0,0 +1,66 @@
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.append('imageprocessor/src')
+
+from ImageProcessing import Parameter, PreviewImage, ThreadRenderBackend
+from render_backends import ProcessRenderBackend
+
+
+@pytest.fixture(scope='module')
+def process_backend():
+    backend = ProcessRenderBackend(processes=1)
+    yield backend
+    backend.close()
+
+
+def make_image(seed=0):
+    return PreviewImage(None, np.random.default_rng(seed).random((48, 64, 3), dtype=np.float32))
+
+
+def test_process_backend_matches_thread_backend(process_backend, tmp_path):
+    image_object = make_image()
+    params = Parameter(exposure=0.5, contrast=20, highlights=-30, shadows=40, black_levels=10)
+
+    ThreadRenderBackend().render_to_file(image_object, params, str(tmp_path / 'thread.tif'))
+    process_backend.render_to_file(image_object, params, str(tmp_path / 'process.tif'))
+
+    thread_frame = np.asarray(Image.open(tmp_path / 'thread.tif'))
+    process_frame = np.asarray(Image.open(tmp_path / 'process.tif'))
+    assert np.array_equal(thread_frame, process_frame)
+
+
+def test_process_backend_renders_region(process_backend, tmp_path):
+    image_object = make_image()
+    params = Parameter(exposure=0.5, shadows=40)
+
+    process_backend.render_to_file(image_object, params, str(tmp_path / 'region.tif'), (8, 16, 20, 30))
+
+    region_frame = np.asarray(Image.open(tmp_path / 'region.tif'))
+    assert region_frame.shape == (20, 30, 3)
+    ThreadRenderBackend().render_to_file(image_object, params, str(tmp_path / 'thread.tif'), (8, 16, 20, 30))
+    assert np.array_equal(region_frame, np.asarray(Image.open(tmp_path / 'thread.tif')))
+
+
+def test_process_backend_shares_image_once(tmp_path):
+    backend = ProcessRenderBackend(processes=1, images=2)
+    first, second = make_image(), make_image(1)
+    try:
+        backend.render_to_file(first, Parameter(), str(tmp_path / 'frame.tif'))
+        shared = backend._shared[id(first.raw_image)]
+        backend.render_to_file(second, Parameter(), str(tmp_path / 'frame.tif'))
+        backend.render_to_file(first, Parameter(exposure=1), str(tmp_path / 'frame.tif'))
+
+        assert backend._shared[id(first.raw_image)] is shared, \
+            "Frames of images edited side by side should reuse their shared memory"
+
+        backend.render_to_file(make_image(2), Parameter(), str(tmp_path / 'frame.tif'))
+
+        assert id(second.raw_image) not in backend._shared, "The least recently rendered image should be evicted"
+        assert backend._shared[id(first.raw_image)] is shared and not shared.retired
+    finally:
+        backend.close()
+    assert shared.retired and shared.users == 0
@@ -0,0 +1,108 @@
+import io
+import sys
+import threading
+
+import cv2
+import httpx
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.append('imageprocessor/src')
+
+from ImageProcessing import Parameter, PreviewImage
+from prefetch import Prefetcher
+from render_service import RenderService
+from thumbnail_store import ThumbnailStore
+
+
+class FakeImage(PreviewImage):
+    decoded = []
+
+    def __init__(self, path, buffer=None):
+        FakeImage.decoded.append(path)
+        super().__init__(path, np.full((60, 90, 3), 0.18, dtype=np.float32))
+
+
+@pytest.fixture
+def client(db):
+    FakeImage.decoded = []
+    service = RenderService(db, ThumbnailStore(db), Prefetcher(decoder=FakeImage))
+    server = service.serve(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with httpx.Client(base_url=f'http://127.0.0.1:{server.server_address[1]}') as client:
+        yield client
+    server.shutdown()
+    server.server_close()
+
+
+def test_catalog(db, client):
+    image_id = db.insert('images', {'path': 'a.cr3', 'exposure': 1}, dict_=True)
+
+    images = client.get('/images').json()
+
+    assert images == [{'id': image_id, 'path': 'a.cr3', 'parameters': {
+        'exposure': 1, 'contrast': 0, 'highlights': 0, 'shadows': 0, 'black_levels': 0
+    }}]
+
+
+def test_preview_is_rendered_at_size_and_revalidated(db, client):
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+
+    response = client.get(f'/images/{image_id}/preview', params={'size': 45})
+    with Image.open(io.BytesIO(response.content)) as image:
+        assert response.status_code == 200 and image.size == (45, 30)
+
+    again = client.get(f'/images/{image_id}/preview', params={'size': 45},
+                       headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+    brighter = client.get(f'/images/{image_id}/preview', params={'size': 45, 'exposure': 1})
+    assert brighter.headers['ETag'] != response.headers['ETag'], "Parameters should change the ETag"
+    assert FakeImage.decoded == ['a.cr3'], "The decoded image should be shared by all requests"
+
+
+def test_replaced_file_is_rendered_again(db, client, tmp_path):
+    path = tmp_path / 'a.cr3'
+    path.write_bytes(b'old')
+    image_id = db.insert('images', {'path': str(path)}, dict_=True)
+    response = client.get(f'/images/{image_id}/preview', params={'size': 45})
+
+    path.write_bytes(b'new file')
+    replaced = client.get(f'/images/{image_id}/preview', params={'size': 45},
+                          headers={'If-None-Match': response.headers['ETag']})
+
+    assert replaced.status_code == 200 and replaced.headers['ETag'] != response.headers['ETag']
+    assert FakeImage.decoded == [str(path)] * 2, "The replaced file should be decoded again"
+
+
+def test_stored_parameters_change_etag(db, client):
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+    before = client.get(f'/images/{image_id}/preview').headers['ETag']
+
+    db.apply_params([image_id], Parameter(exposure=1))
+
+    assert client.get(f'/images/{image_id}/preview').headers['ETag'] != before
+
+
+def test_export_streams_png(db, client):
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+
+    response = client.get(f'/images/{image_id}/export', params={'bit_depth': 16})
+
+    assert response.headers['Transfer-Encoding'] == 'chunked'
+    exported = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_UNCHANGED)
+    assert exported.shape == (60, 90, 3) and exported.dtype == np.uint16
+
+
+def test_thumbnail_and_errors(db, client):
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+    assert client.get(f'/images/{image_id}/thumbnail').status_code == 404
+
+    ThumbnailStore(db).put(image_id, {100: b'jpeg'})
+    response = client.get(f'/images/{image_id}/thumbnail', params={'size': 100})
+    assert response.content == b'jpeg'
+    assert client.get(f'/images/{image_id}/thumbnail',
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    assert client.get('/images/999/preview').status_code == 404
+    assert client.get(f'/images/{image_id}/preview', params={'size': 'large'}).status_code == 400
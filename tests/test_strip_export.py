@@ -0,0 +1,65 @@
+import sys
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.append('imageprocessor/src')
+
+from ImageProcessing import Parameter, PreviewImage, RawImage
+from strip_export import render_strips, write_strips
+
+
+PARAMS = Parameter(exposure=0.7, contrast=30, highlights=-40, shadows=60, black_levels=5)
+
+
+def make_linear():
+    return np.random.default_rng(0).random((53, 41, 3), dtype=np.float32)
+
+
+def test_render_strips_matches_full_render():
+    linear = make_linear()
+
+    full = PreviewImage(None, linear).render_image(PARAMS)
+    strips = np.concatenate(list(render_strips(linear, PARAMS, strip_rows=7)))
+
+    assert np.array_equal(strips, full), "Strips should be identical to a full render"
+
+
+def test_render_strips_uint16_input():
+    linear = (make_linear() * 65535).astype(np.uint16)
+
+    full = PreviewImage(None, linear.astype(np.float32) / 65535.0).render_image(PARAMS)
+    strips = np.concatenate(list(render_strips(linear, PARAMS, strip_rows=10)))
+
+    assert np.array_equal(strips, full)
+
+
+@pytest.mark.parametrize('file_name, bit_depth', [
+    ('export.png', 8), ('export.png', 16), ('export.tif', 8), ('export.tiff', 16)
+])
+def test_write_strips_lossless_formats(tmp_path, file_name, bit_depth):
+    linear = make_linear()
+    strip_path = str(tmp_path / file_name)
+
+    write_strips(linear, PARAMS, strip_path, bit_depth=bit_depth, strip_rows=8)
+
+    expected = RawImage.quantize(PreviewImage(None, linear).render_image(PARAMS),
+                                 RawImage.output_type(strip_path, bit_depth))
+    assert expected.dtype == (np.uint16 if bit_depth == 16 else np.uint8)
+    assert np.array_equal(load_image(strip_path), expected)
+
+
+def load_image(path):
+    # PIL has no 16-bit RGB mode, so the pixel data is read with OpenCV
+    return cv2.imread(path, cv2.IMREAD_UNCHANGED)[..., ::-1]
+
+
+def test_write_strips_jpeg(tmp_path):
+    path = str(tmp_path / 'export.jpeg')
+
+    write_strips(make_linear(), PARAMS, path, strip_rows=16)
+
+    exported = Image.open(path)
+    assert exported.format == 'JPEG' and exported.size == (41, 53)
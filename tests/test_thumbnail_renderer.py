@@ -0,0 +1,101 @@
+import io
+import sys
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.append('imageprocessor/src')
+
+from ImageProcessing import Parameter, PreviewImage
+from thumbnail_renderer import ThumbnailRenderer, render_thumbnails
+from thumbnail_store import ThumbnailStore
+
+
+class FakeDecoder(PreviewImage):
+    decoded = []
+
+    def __init__(self, path):
+        FakeDecoder.decoded.append(path)
+        super().__init__(path, np.full((300, 600, 3), 0.18, dtype=np.float32))
+
+
+@pytest.fixture
+def renderer(db, tmp_path):
+    FakeDecoder.decoded = []
+    return ThumbnailRenderer(db, ThumbnailStore(db), str(tmp_path / 'proxies'), decoder=FakeDecoder, long_edge=100)
+
+
+def brightness(jpeg):
+    with Image.open(io.BytesIO(jpeg)) as image:
+        return np.asarray(image).mean()
+
+
+def test_render_thumbnails_sizes():
+    thumbnails = render_thumbnails(np.full((200, 400, 3), 0.18, dtype=np.float32), Parameter(), sizes=[50, 100])
+
+    for size, jpeg in thumbnails.items():
+        with Image.open(io.BytesIO(jpeg)) as image:
+            assert max(image.size) == size
+
+
+def test_create_stores_proxy_and_thumbnails(db, renderer):
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+
+    renderer.create(image_id, 'a.cr3')
+
+    assert renderer.load_proxy(image_id).shape == (50, 100, 3)
+    assert renderer.thumbnail_store.has(image_id)
+
+
+def test_scheduled_thumbnails_render_from_proxy(db, renderer):
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+    renderer.create(image_id, 'a.cr3')
+    before = brightness(renderer.thumbnail_store.get(image_id, 100))
+    rendered = []
+    renderer.add_listener(rendered.append)
+
+    db.apply_params([image_id], Parameter(exposure=1))
+    renderer.schedule([image_id])
+
+    assert renderer.wait(timeout=5)
+    assert brightness(renderer.thumbnail_store.get(image_id, 100)) > before + 10
+    assert rendered == [image_id]
+    assert FakeDecoder.decoded == ['a.cr3'], "The raw file should not be decoded again"
+
+
+def test_repeated_edits_render_once_after_delay(db, renderer):
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+    renderer.create(image_id, 'a.cr3')
+    rendered = []
+    renderer.add_listener(rendered.append)
+
+    for exposure in (0.5, 1, 1.5):
+        db.apply_params([image_id], Parameter(exposure=exposure))
+        renderer.schedule([image_id], delay=0.3)
+        time.sleep(0.1)
+    assert rendered == [], "The thumbnail should wait until the edits stop"
+
+    assert renderer.wait(timeout=5)
+    assert rendered == [image_id]
+
+
+def test_missing_proxy_is_created_from_raw(db, renderer):
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+
+    renderer.schedule([image_id])
+
+    assert renderer.wait(timeout=5)
+    assert FakeDecoder.decoded == ['a.cr3']
+    assert renderer.load_proxy(image_id) is not None
+    assert renderer.thumbnail_store.has(image_id)
+
+
+def test_delete_drops_proxy(db, renderer):
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+    renderer.create(image_id, 'a.cr3')
+
+    renderer.delete([image_id])
+
+    assert renderer.load_proxy(image_id) is None
@@ -0,0 +1,68 @@
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.append('imageprocessor/src')
+
+from thumbnail_store import ThumbnailStore, encode_thumbnails
+
+
+@pytest.fixture
+def store(db):
+    return ThumbnailStore(db)
+
+
+def test_encode_thumbnails_sizes():
+    thumbnails = encode_thumbnails(Image.new('RGB', (1000, 500), color='red'), sizes=[100, 200, 400])
+
+    assert set(thumbnails) == {100, 200, 400}
+    for size, jpeg in thumbnails.items():
+        with Image.open(io.BytesIO(jpeg)) as img:
+            assert img.format == 'JPEG'
+            assert max(img.size) == size, "Long edge should match the thumbnail size"
+
+
+def test_put_and_get_nearest_size(db, store):
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+    store.put(image_id, {100: b'small', 200: b'medium', 400: b'large'})
+
+    assert store.get(image_id, 200) == b'medium'
+    assert store.get(image_id, 150) == b'medium', "Should return the smallest thumbnail big enough"
+    assert store.get(image_id, 1000) == b'large', "Should fall back to the largest thumbnail"
+    assert store.get(image_id + 1, 200) is None
+    assert store.has(image_id)
+
+
+def test_delete(db, store):
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+    store.put(image_id, {100: b'small', 200: b'medium'})
+    store.delete(image_id)
+
+    assert not store.has(image_id)
+
+
+def test_compact_removes_orphans_and_reclaims_space(db, store):
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+    store.put(image_id, {200: b'kept'})
+    for orphan_id in range(1000, 1050):
+        store.put(orphan_id, {200: os.urandom(16384)})
+
+    assert store.compact() is True, "Database should be rewritten after freeing many pages"
+    assert store.get(image_id, 200) == b'kept'
+    assert db.execute('SELECT COUNT(*) FROM thumbnails').fetchone()[0] == 1
+    assert store.compact() is False, "Nothing left to reclaim"
+
+
+def test_migrate_legacy(tmp_path, db, store):
+    legacy_dir = tmp_path / 'thumbnails'
+    legacy_dir.mkdir()
+    image_id = db.insert('images', {'path': 'a.cr3'}, dict_=True)
+    Image.new('RGB', (512, 341), color='blue').save(legacy_dir / f'{image_id}.jpg')
+
+    assert store.migrate_legacy(str(legacy_dir)) == 1
+    assert not (legacy_dir / f'{image_id}.jpg').exists(), "Legacy file should be removed"
+    with Image.open(io.BytesIO(store.get(image_id, 200))) as img:
+        assert max(img.size) == 200
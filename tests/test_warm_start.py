@@ -0,0 +1,53 @@
+import io
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.append('imageprocessor/src')
+
+from ImageProcessing import Parameter
+from warm_start import WarmStart
+
+
+def test_save_and_load(tmp_path):
+    warm_start = WarmStart(str(tmp_path / 'warm_start'))
+    proxy = np.random.rand(60, 90, 3).astype(np.float32)
+
+    warm_start.save_proxy(7, proxy)
+    warm_start.save_frame(7, Parameter(exposure=1))
+    frame, loaded_proxy = warm_start.load(7)
+
+    assert np.allclose(loaded_proxy, proxy, atol=1e-3), "Proxy is stored as float16"
+    with Image.open(io.BytesIO(frame)) as img:
+        assert img.format == 'JPEG'
+        assert img.size == (90, 60)
+
+
+def test_load_missing(tmp_path):
+    warm_start = WarmStart(str(tmp_path / 'warm_start'))
+    assert warm_start.load(7) is None
+
+    warm_start.save_proxy(7, np.zeros((10, 10, 3), dtype=np.float32))
+    assert warm_start.load(7) is None, "Nothing to show without a frame"
+
+
+def test_only_last_image_kept(tmp_path):
+    warm_start = WarmStart(str(tmp_path / 'warm_start'))
+    for image_id in (1, 2):
+        warm_start.save_proxy(image_id, np.zeros((10, 10, 3), dtype=np.float32))
+        warm_start.save_frame(image_id, Parameter())
+
+    assert warm_start.load(1) is None
+    assert warm_start.load(2) is not None
+
+
+def test_invalidate(tmp_path):
+    warm_start = WarmStart(str(tmp_path / 'warm_start'))
+    warm_start.save_proxy(3, np.zeros((10, 10, 3), dtype=np.float32))
+    warm_start.save_frame(3, Parameter())
+
+    warm_start.invalidate([4])
+    assert warm_start.load(3) is not None
+    warm_start.invalidate([3])
+    assert warm_start.load(3) is None